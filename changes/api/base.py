@@ -1,19 +1,57 @@
 import json
 
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
 from functools import wraps
 from urllib import quote
+from uuid import UUID
 
 from flask import Response, current_app, request
 from flask.ext.restful import Resource
+from sqlalchemy import literal, tuple_
 
-from changes.api.serializer import serialize as serialize_func
+from changes.api.cache import get_etag, get_response, set_response
+from changes.api.serializer import dumps, serialize as serialize_func
 from changes.api.stream import EventStream
 
-LINK_HEADER = '<{uri}&page={page}>; rel="{name}"'
+LINK_HEADER = '<{uri}&{key}={value}>; rel="{name}"'
+
+CURSOR_DATE_FORMAT = '%Y%m%d%H%M%S%f'
 
 
 def as_json(context):
-    return json.dumps(serialize_func(context))
+    return dumps(context)
+
+
+def encode_cursor(direction, instance):
+    """
+    Return an opaque cursor for the page before (``direction='previous'``)
+    or after (``direction='next'``) ``instance``.
+    """
+    value = '{0}:{1}:{2}'.format(
+        direction, instance.date_created.strftime(CURSOR_DATE_FORMAT),
+        instance.id.hex)
+    return urlsafe_b64encode(value).rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Return ``(direction, date_created, id)`` for a cursor, raising
+    ``ValueError`` if it's invalid.
+    """
+    try:
+        value = urlsafe_b64decode(str(cursor) + '=' * (-len(cursor) % 4))
+    except TypeError:
+        raise ValueError(cursor)
+
+    direction, date_created, id_ = value.split(':')
+    if direction not in ('previous', 'next'):
+        raise ValueError(cursor)
+    return (
+        direction,
+        datetime.strptime(date_created, CURSOR_DATE_FORMAT),
+        UUID(hex=id_),
+    )
 
 
 def param(key, validator=lambda x: x, required=True, dest=None):
@@ -71,12 +109,65 @@ class APIView(Resource):
                 return Response(status=404)
             return self.stream_response(channels)
 
+        if request.method == 'GET':
+            cache_keys = self.get_cache_keys(**kwargs)
+            if cache_keys is not None:
+                keys, version = cache_keys
+                return self.cached_response(keys, version, *args, **kwargs)
+
         return super(APIView, self).dispatch_request(*args, **kwargs)
 
-    def paginate(self, queryset, **kwargs):
-        page = int(request.args.get('page', 1))
+    def get_cache_keys(self, **kwargs):
+        """
+        Return the keys which GET responses of this view depend on (see
+        ``changes.api.cache``) along with a version stamp of the objects
+        they're built from, or None if responses shouldn't be cached.
+        """
+        return None
+
+    def cached_response(self, keys, version, *args, **kwargs):
+        """
+        Respond with a 304 if the client's copy is current, otherwise with
+        the cached response, falling back to (and caching) the view's own.
+        """
+        ttl = current_app.config['API_CACHE_TTL']
+        etag = get_etag(request.url, keys, version, ttl)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        body = get_response(etag)
+        if body is None:
+            # views may return e.g. ``('', 404)`` rather than a Response
+            response = current_app.make_response(
+                super(APIView, self).dispatch_request(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            set_response(etag, body, ttl)
+
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        return response
+
+    def paginate(self, queryset, keyset=False, **kwargs):
+        """
+        Respond with a page of ``queryset``, linking to the adjacent pages
+        through the ``Link`` header.
+
+        With ``keyset`` the queryset is paged by ``(date_created, id)``,
+        newest first, using opaque ``cursor`` values rather than offsets, so
+        every page costs the same. Clients passing ``page`` still get offset
+        pagination.
+        """
         per_page = int(request.args.get('per_page', 50))
         assert per_page <= 100
+
+        if keyset and 'page' not in request.args:
+            return self.paginate_keyset(queryset, per_page, **kwargs)
+
+        page = int(request.args.get('page', 1))
         assert page > 0
 
         offset = (page - 1) * per_page
@@ -85,37 +176,89 @@ class APIView(Resource):
 
         links = []
         if page > 1:
-            links.append(('previous', page - 1))
+            links.append(('previous', 'page', page - 1))
         if len(result) > per_page:
-            links.append(('next', page + 1))
+            links.append(('next', 'page', page + 1))
             result = result[:per_page]
 
         response = self.respond(result, **kwargs)
+        self.add_links(response, links)
+        return response
+
+    def paginate_keyset(self, queryset, per_page, **kwargs):
+        model = queryset.column_descriptions[0]['type']
+
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                direction, date_created, id_ = decode_cursor(cursor)
+            except ValueError:
+                return '', 400
+
+            key = tuple_(model.date_created, model.id)
+            position = tuple_(
+                literal(date_created, model.date_created.type),
+                literal(id_, model.id.type),
+            )
+        else:
+            direction = 'next'
+
+        queryset = queryset.order_by(None)
+        if direction == 'next':
+            if cursor:
+                queryset = queryset.filter(key < position)
+            queryset = queryset.order_by(model.date_created.desc(), model.id.desc())
+        else:
+            queryset = queryset.filter(key > position)
+            queryset = queryset.order_by(model.date_created.asc(), model.id.asc())
+
+        result = list(queryset[:per_page + 1])
+        has_more = len(result) > per_page
+        result = result[:per_page]
+
+        if direction == 'next':
+            has_previous, has_next = bool(cursor), has_more
+        else:
+            result.reverse()
+            has_previous, has_next = has_more, True
+
+        links = []
+        if result:
+            if has_previous:
+                links.append(('previous', 'cursor', encode_cursor('previous', result[0])))
+            if has_next:
+                links.append(('next', 'cursor', encode_cursor('next', result[-1])))
+
+        response = self.respond(result, **kwargs)
+        self.add_links(response, links)
+        return response
+
+    def add_links(self, response, links):
+        """
+        Set the ``Link`` header of ``response`` to the current URL with each
+        ``(name, key, value)`` of ``links`` applied.
+        """
+        if not links:
+            return
 
         querystring = u'&'.join(
             u'{0}={1}'.format(quote(k), quote(v))
             for k, v in request.args.iteritems()
-            if k != 'page'
+            if k not in ('page', 'cursor')
         )
         if querystring:
             base_url = '{0}?{1}'.format(request.base_url, querystring)
         else:
             base_url = request.base_url + '?'
 
-        link_values = []
-        for name, page_no in links:
-            link_values.append(LINK_HEADER.format(
-                uri=base_url,
-                page=page_no,
-                name=name,
-            ))
-        if link_values:
-            response.headers['Link'] = ', '.join(link_values)
-        return response
+        response.headers['Link'] = ', '.join(
+            LINK_HEADER.format(uri=base_url, key=key, value=value, name=name)
+            for name, key, value in links
+        )
 
     def respond(self, context, status_code=200, serializers=None):
         return Response(
-            as_json(self.serialize(context, serializers)),
+            dumps(context, serializers),
             mimetype='application/json',
             status=status_code)
 
@@ -129,7 +272,12 @@ class APIView(Resource):
         return []
 
     def stream_response(self, channels):
-        stream = EventStream(channels=channels)
+        try:
+            last_event_id = int(request.headers['Last-Event-ID'])
+        except (KeyError, ValueError):
+            last_event_id = None
+
+        stream = EventStream(channels=channels, last_event_id=last_event_id)
         return Response(stream, mimetype='text/event-stream')
 
     def get_backend(self, app=current_app):
@@ -183,6 +183,15 @@ class BuildDetailsAPIView(APIView):
 
         return self.respond(context)
 
+    def get_cache_keys(self, build_id):
+        build = db.session.query(Build.id, Build.date_modified).filter(
+            Build.id == build_id,
+        ).first()
+        if build is None:
+            return None
+
+        return self.get_stream_channels(build.id.hex), build.date_modified
+
     def get_stream_channels(self, build_id):
         return [
             'builds:{0}'.format(build_id),
@@ -1,6 +1,8 @@
 from flask import session
 
 from changes.api.base import APIView
+from changes.api.cache import invalidate
+from changes.config import db
 from changes.db.utils import try_create
 from changes.models import Build, BuildSeen
 
@@ -18,5 +20,8 @@ class BuildMarkSeenAPIView(APIView):
             'build_id': build.id,
             'user_id': session['uid'],
         })
+        db.session.commit()
+
+        invalidate(['builds:{0}'.format(build.id.hex)])
 
         return '', 200
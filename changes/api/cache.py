@@ -0,0 +1,86 @@
+"""
+Caching of API responses.
+
+A cacheable view (see ``APIView.get_cache_keys``) names the keys its
+responses depend on (usually the pubsub channels which updates of its
+objects are published to) along with a version stamp of those objects. Each
+key has a generation counter which ``invalidate`` bumps whenever an update
+is published to it (see ``changes.events``), and the ETag of a response is
+derived from the request, the generations of its keys, the version stamp and
+the current period of ``API_CACHE_TTL`` seconds. As not everything a response
+depends on is invalidated (e.g. statistics relative to the current time), a
+client's copy is never considered current beyond the end of that period.
+
+Serialized bodies are kept under their ETag, so an entry is never updated in
+place: it's simply no longer looked up once anything it depends on changes,
+and expires after ``API_CACHE_TTL`` seconds.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import time
+
+from changes.config import db, redis
+from changes.models import Build, Project
+
+
+GENERATION_KEY = 'api:generation:{0}'
+
+RESPONSE_KEY = 'api:response:{0}'
+
+# how long (in seconds) a generation counter is kept after it was last
+# bumped; as an expired counter starts over this must be well beyond
+# API_CACHE_TTL
+GENERATION_TTL = 86400
+
+
+def get_etag(url, keys, version, ttl):
+    """
+    Return the ETag of the response to ``url`` given the current generation
+    of each of ``keys``, which changes at least every ``ttl`` seconds.
+    """
+    generations = redis.mget([GENERATION_KEY.format(k) for k in keys])
+    period = int(time.time() // ttl)
+
+    value = u'\n'.join(
+        [url, unicode(version), unicode(period)] + [g or '0' for g in generations]
+    )
+    return hashlib.md5(value.encode('utf-8')).hexdigest()
+
+
+def get_response(etag):
+    return redis.get(RESPONSE_KEY.format(etag))
+
+
+def set_response(etag, body, ttl):
+    redis.set(RESPONSE_KEY.format(etag), body, ex=ttl)
+
+
+def invalidate(keys):
+    """
+    Expire every cached response depending on any of ``keys``.
+    """
+    pipe = redis.pipeline()
+    for key in keys:
+        pipe.incr(GENERATION_KEY.format(key))
+        pipe.expire(GENERATION_KEY.format(key), GENERATION_TTL)
+    pipe.execute()
+
+
+def get_project_cache_keys(project_id):
+    """
+    Return the cache keys of a view of a project (by id or slug), versioned
+    by its most recent build, or None if it doesn't exist.
+    """
+    project = Project.get(project_id)
+    if project is None:
+        return None
+
+    version = db.session.query(Build.date_modified).filter(
+        Build.project_id == project.id,
+    ).order_by(Build.date_created.desc()).limit(1).scalar()
+
+    return [
+        'projects:{0}'.format(project.id.hex),
+        'projects:{0}:builds'.format(project.id.hex),
+    ], version
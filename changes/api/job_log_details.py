@@ -1,56 +1,58 @@
 from __future__ import absolute_import, division, unicode_literals
 
-from flask import Response, request
+from flask import Response, request, stream_with_context
 
 from changes.api.base import APIView
-from changes.models import LogSource, LogChunk
+from changes.models import LogSource
+from changes.storage.logs import find_tail_offset, get_source_store
 
 
-LOG_BATCH_SIZE = 50000  # in length of chars
+LOG_BATCH_SIZE = 50000  # in bytes
+
+
+def get_source(job_id, source_id):
+    source = LogSource.query.get(source_id)
+    if source is None or source.job_id.hex != job_id:
+        return None
+    return source
 
 
 class JobLogDetailsAPIView(APIView):
     def get(self, job_id, source_id):
         """
         Return chunks for a LogSource.
+
+        - ``offset``: the byte offset to read from (the default of -1 reads
+          the last ``limit`` bytes)
+        - ``limit``: the maximum number of bytes to return (0 for no limit)
+        - ``tail``: return the last N lines, ignoring offset and limit
         """
-        source = LogSource.query.get(source_id)
-        if source is None or source.job_id.hex != job_id:
+        source = get_source(job_id, source_id)
+        if source is None:
             return '', 404
 
         offset = int(request.args.get('offset', -1))
         limit = int(request.args.get('limit', LOG_BATCH_SIZE))
+        tail = request.args.get('tail')
 
-        queryset = LogChunk.query.filter(
-            LogChunk.source_id == source.id,
-        ).order_by(LogChunk.offset.desc())
-
-        if offset == -1:
-            # starting from the end so we need to know total size
-            tail = queryset.limit(1).first()
-
-            if tail is None:
-                logchunks = []
-            else:
-                if limit:
-                    queryset = queryset.filter(
-                        (LogChunk.offset + LogChunk.size) >= max(tail.offset + tail.size - limit, 0),
-                    )
-                logchunks = list(queryset)
+        store, size = get_source_store(source)
+
+        if size is None:
+            logchunks = []
         else:
-            queryset = queryset.filter(
-                (LogChunk.offset + LogChunk.size) >= offset,
-            )
-            if limit:
-                queryset = queryset.filter(
-                    LogChunk.offset <= offset + limit,
-                )
-            logchunks = list(queryset)
+            if tail:
+                offset = find_tail_offset(store, source, size, int(tail))
+                limit = 0
+            elif offset == -1:
+                offset = max(size - limit, 0) if limit else 0
 
-        logchunks.sort(key=lambda x: x.date_created)
+            logchunks = store.read(source, offset, limit)
 
         if logchunks:
             next_offset = logchunks[-1].offset + logchunks[-1].size
+        elif size is not None:
+            # the client has caught up, so it should keep polling from here
+            next_offset = max(offset, size)
         else:
             next_offset = 0
 
@@ -66,3 +68,51 @@ class JobLogDetailsAPIView(APIView):
             return Response(status=404)
 
         return ['logsources:{0}:{1}'.format(job_id, source.id.hex)]
+
+
+class JobLogRawAPIView(APIView):
+    def get(self, job_id, source_id):
+        """
+        Stream the raw text of a LogSource.
+
+        Supports ``Range: bytes=...`` requests (answered with
+        ``206 Partial Content``), as well as ``tail`` (the last N lines).
+        """
+        source = get_source(job_id, source_id)
+        if source is None:
+            return '', 404
+
+        store, size = get_source_store(source)
+        size = size or 0
+
+        status = 200
+        headers = {'Accept-Ranges': 'bytes'}
+
+        tail = request.args.get('tail')
+        if tail:
+            start, stop = find_tail_offset(store, source, size, int(tail)), size
+        elif request.range is not None:
+            byte_range = request.range.range_for_length(size)
+            if byte_range is None:
+                headers['Content-Range'] = 'bytes */{0}'.format(size)
+                return Response(status=416, headers=headers)
+
+            start, stop = byte_range
+            status = 206
+            headers['Content-Range'] = 'bytes {0}-{1}/{2}'.format(
+                start, stop - 1, size)
+        else:
+            start, stop = 0, size
+
+        def generate():
+            if start >= stop:
+                return
+            for _, _, data in store.iter_read(source, start, stop - start):
+                yield data
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/plain',
+            status=status,
+            headers=headers,
+        )
@@ -0,0 +1,48 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import re
+
+from flask import request
+
+from changes.api.base import APIView
+from changes.models import Job, LogSource
+from changes.storage.search import (
+    CONTEXT_LINES, MATCH_LIMIT, MAX_MATCH_LIMIT, search_logs)
+
+
+class JobLogSearchAPIView(APIView):
+    def get(self, job_id):
+        """
+        Search the logs of a job for lines matching a pattern.
+
+        - ``q``: the pattern to search for
+        - ``regex``: treat ``q`` as a regular expression
+        - ``context``: the number of lines to return either side of a match
+        - ``limit``: the maximum number of matches to return
+        """
+        job = Job.query.get(job_id)
+        if job is None:
+            return '', 404
+
+        pattern = request.args.get('q')
+        if not pattern:
+            return '', 400
+
+        sources = list(LogSource.query.filter(
+            LogSource.job_id == job.id,
+        ).order_by(LogSource.date_created.asc()))
+
+        try:
+            matches, has_more = search_logs(
+                sources, pattern,
+                regex=bool(request.args.get('regex')),
+                context=int(request.args.get('context', CONTEXT_LINES)),
+                limit=min(int(request.args.get('limit', MATCH_LIMIT)), MAX_MATCH_LIMIT),
+            )
+        except re.error:
+            return '', 400
+
+        return self.respond({
+            'matches': matches,
+            'hasMore': has_more,
+        })
@@ -21,6 +21,6 @@ class NodeJobIndexAPIView(APIView):
             JobStep.node_id == node.id,
         ).order_by(Job.date_created.desc())
 
-        return self.paginate(jobs, serializers={
+        return self.paginate(jobs, keyset=True, serializers={
             Job: JobWithBuildSerializer(),
         })
@@ -28,7 +28,7 @@ class ProjectBuildIndexAPIView(APIView):
                 Build.patch == None,  # NOQA
             )
 
-        return self.paginate(queryset)
+        return self.paginate(queryset, keyset=True)
 
     def get_stream_channels(self, project_id=None):
         project = Project.get(project_id)
@@ -37,4 +37,4 @@ class ProjectBuildSearchAPIView(APIView):
             *filters
         ).order_by(Build.date_created.desc())
 
-        return self.paginate(queryset)
+        return self.paginate(queryset, keyset=True)
@@ -2,6 +2,7 @@ from flask import request
 from sqlalchemy.orm import contains_eager, joinedload, subqueryload_all
 
 from changes.api.base import APIView
+from changes.api.cache import get_project_cache_keys, invalidate
 from changes.config import db
 from changes.models import (
     Project, Plan, Build, Source, Status, Result, ProjectOption
@@ -128,5 +129,11 @@ class ProjectDetailsAPIView(APIView):
         project.name = result['name']
         project.slug = result['slug']
         db.session.add(project)
+        db.session.commit()
+
+        invalidate(['projects:{0}'.format(project.id.hex)])
 
         return self.respond(project)
+
+    def get_cache_keys(self, project_id):
+        return get_project_cache_keys(project_id)
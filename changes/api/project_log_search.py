@@ -0,0 +1,65 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import re
+
+from flask import request
+
+from changes.api.base import APIView
+from changes.models import Build, Job, LogSource, Project
+from changes.storage.search import (
+    CONTEXT_LINES, MATCH_LIMIT, MAX_MATCH_LIMIT, search_logs)
+
+
+BUILD_LIMIT = 10
+MAX_BUILD_LIMIT = 50
+
+
+class ProjectLogSearchAPIView(APIView):
+    def get(self, project_id):
+        """
+        Search the logs of a project's most recent builds for lines matching
+        a pattern.
+
+        - ``q``: the pattern to search for
+        - ``regex``: treat ``q`` as a regular expression
+        - ``builds``: the number of recent builds to search
+        - ``context``: the number of lines to return either side of a match
+        - ``limit``: the maximum number of matches to return
+        """
+        project = Project.get(project_id)
+        if not project:
+            return '', 404
+
+        pattern = request.args.get('q')
+        if not pattern:
+            return '', 400
+
+        num_builds = min(int(request.args.get('builds', BUILD_LIMIT)), MAX_BUILD_LIMIT)
+
+        build_ids = [b.id for b in Build.query.filter(
+            Build.project_id == project.id,
+        ).order_by(Build.date_created.desc()).limit(num_builds)]
+
+        if build_ids:
+            sources = list(LogSource.query.join(
+                Job, LogSource.job_id == Job.id,
+            ).filter(
+                Job.build_id.in_(build_ids),
+            ).order_by(LogSource.date_created.desc()))
+        else:
+            sources = []
+
+        try:
+            matches, has_more = search_logs(
+                sources, pattern,
+                regex=bool(request.args.get('regex')),
+                context=int(request.args.get('context', CONTEXT_LINES)),
+                limit=min(int(request.args.get('limit', MATCH_LIMIT)), MAX_MATCH_LIMIT),
+            )
+        except re.error:
+            return '', 400
+
+        return self.respond({
+            'matches': matches,
+            'hasMore': has_more,
+        })
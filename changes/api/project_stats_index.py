@@ -5,6 +5,7 @@ from sqlalchemy.orm import joinedload
 from sqlalchemy.sql import func, literal
 
 from changes.api.base import APIView
+from changes.api.cache import get_project_cache_keys
 from changes.config import db
 from changes.constants import Status, Result
 from changes.models import TestGroup, Project, Build, Job, Source
@@ -204,3 +205,6 @@ class ProjectStatsIndexAPIView(APIView):
         }
 
         return self.respond(context)
+
+    def get_cache_keys(self, project_id):
+        return get_project_cache_keys(project_id)
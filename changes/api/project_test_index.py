@@ -4,6 +4,7 @@ from sqlalchemy import and_
 from sqlalchemy.orm import subqueryload
 
 from changes.api.base import APIView
+from changes.api.cache import get_project_cache_keys
 from changes.config import db
 from changes.constants import Result, Status
 from changes.models import Project, AggregateTestGroup, TestGroup, Job, Source
@@ -55,3 +56,6 @@ class ProjectTestIndexAPIView(APIView):
         }
 
         return self.respond(context)
+
+    def get_cache_keys(self, project_id):
+        return get_project_cache_keys(project_id)
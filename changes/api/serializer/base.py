@@ -1,41 +1,210 @@
+import json
+
+from collections import defaultdict
 from datetime import datetime
+from sqlalchemy import inspect
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.interfaces import MANYTOONE
+
+from changes.config import db
 
 _registry = {}
 
+# the serializer resolved for each concrete type (including subclasses of
+# registered types, and None for types without one)
+_type_cache = {}
+
+# types which are passed through as-is
+PRIMITIVE_TYPES = frozenset([str, unicode, int, long, float, bool, type(None)])
+
 
 def register(type):
     def wrapped(cls):
         _registry[type] = cls()
+        _type_cache.clear()
         return cls
     return wrapped
 
 
+def get_serializer(item, extended_registry):
+    cls = type(item)
+    if extended_registry:
+        serializer = extended_registry.get(cls)
+        if serializer is not None:
+            return serializer
+
+    try:
+        return _type_cache[cls]
+    except KeyError:
+        pass
+
+    serializer = _registry.get(cls)
+    if serializer is None:
+        for registered_cls, registered in _registry.iteritems():
+            if issubclass(cls, registered_cls):
+                serializer = registered
+                break
+    _type_cache[cls] = serializer
+    return serializer
+
+
 def serialize(item, extended_registry=None):
     if extended_registry is None:
         extended_registry = {}
 
-    if isinstance(item, (list, tuple, set, frozenset)):
-        return [serialize(o, extended_registry) for o in item]
+    cls = type(item)
+    if cls in PRIMITIVE_TYPES:
+        return item
+    elif isinstance(item, (list, tuple, set, frozenset)):
+        prefetch_batch(item, extended_registry)
+        return [
+            o if type(o) in PRIMITIVE_TYPES else serialize(o, extended_registry)
+            for o in item
+        ]
     elif isinstance(item, dict):
-        return dict((k, serialize(v, extended_registry)) for k, v in item.iteritems())
-    elif item is None:
-        return None
+        return dict(
+            (k, v if type(v) in PRIMITIVE_TYPES else serialize(v, extended_registry))
+            for k, v in item.iteritems()
+        )
     elif isinstance(item, (basestring, int, long, float, bool)):
         return item
 
-    serializer = extended_registry.get(type(item))
-    if serializer is None:
-        serializer = _registry.get(type(item))
+    serializer = get_serializer(item, extended_registry)
     if serializer:
         return serialize(serializer(item), extended_registry)
-    else:
-        for cls, serializer in _registry.iteritems():
-            if isinstance(item, cls):
-                return serialize(serializer(item), extended_registry)
     return item
 
 
+def dumps(item, extended_registry=None):
+    """
+    Encode ``item`` as JSON, equivalent to ``json.dumps(serialize(item))``.
+
+    Rather than building a tree of serialized dicts first, objects are
+    serialized as the (C accelerated) encoder reaches them.
+    """
+    if extended_registry is None:
+        extended_registry = {}
+
+    def default(obj):
+        if isinstance(obj, (set, frozenset)):
+            data = list(obj)
+        else:
+            serializer = get_serializer(obj, extended_registry)
+            if serializer is None:
+                raise TypeError('{0!r} is not JSON serializable'.format(obj))
+            data = serializer(obj)
+        prefetch_children(data, extended_registry)
+        return data
+
+    prefetch_children(item, extended_registry)
+    return json.dumps(item, default=default)
+
+
+def prefetch_children(data, extended_registry):
+    """
+    Prefetch ``data`` if it's a list, or the lists within it if it's a
+    dict, before the encoder descends into them.
+    """
+    if isinstance(data, (list, tuple, set, frozenset)):
+        prefetch_batch(data, extended_registry)
+    elif isinstance(data, dict):
+        for value in data.itervalues():
+            if isinstance(value, (list, tuple, set, frozenset, dict)):
+                prefetch_children(value, extended_registry)
+
+
+def prefetch_batch(items, extended_registry):
+    """
+    Load the relationships declared by the serializers of ``items`` (see
+    ``Serializer.prefetch``) for the whole batch.
+    """
+    by_type = defaultdict(list)
+    for item in items:
+        if isinstance(item, db.Model):
+            by_type[type(item)].append(item)
+
+    for instances in by_type.itervalues():
+        serializer = get_serializer(instances[0], extended_registry)
+        if serializer is not None and serializer.prefetch:
+            prefetch(instances, serializer.prefetch)
+
+
+def prefetch(instances, paths):
+    """
+    Load the many-to-one relationships named by ``paths`` (which may be
+    dotted, e.g. ``build.project``) for all of ``instances``, using a single
+    query per relationship.
+    """
+    for path in paths:
+        related = instances
+        for attr in path.split('.'):
+            related = _prefetch_attr(related, attr)
+            if not related:
+                break
+
+
+def _prefetch_attr(instances, attr):
+    """
+    Load ``attr`` for each of ``instances``, returning the (distinct) related
+    instances.
+    """
+    by_type = defaultdict(list)
+    for instance in instances:
+        by_type[type(instance)].append(instance)
+
+    results = {}
+    for cls, objs in by_type.iteritems():
+        mapper = inspect(cls)
+        if attr not in mapper.relationships:
+            continue
+
+        # anything but a simple foreign key is loaded as it's accessed
+        prop = mapper.relationships[attr]
+        if prop.direction is not MANYTOONE or prop.uselist:
+            continue
+
+        local_columns = list(prop.local_columns)
+        remote_columns = list(prop.remote_side)
+        primary_key = prop.mapper.primary_key
+        if len(local_columns) != 1 or len(remote_columns) != 1 or len(primary_key) != 1:
+            continue
+        if remote_columns[0] is not primary_key[0]:
+            continue
+
+        fk_attr = mapper.get_property_by_column(local_columns[0]).key
+        pk_attr = prop.mapper.get_property_by_column(remote_columns[0]).key
+
+        missing = set(
+            getattr(o, fk_attr) for o in objs
+            if attr not in o.__dict__ and getattr(o, fk_attr) is not None
+        )
+        if missing:
+            loaded = dict(
+                (getattr(r, pk_attr), r)
+                for r in db.session.query(prop.mapper).filter(
+                    remote_columns[0].in_(missing),
+                )
+            )
+        else:
+            loaded = {}
+
+        for o in objs:
+            if attr in o.__dict__:
+                value = o.__dict__[attr]
+            else:
+                value = loaded.get(getattr(o, fk_attr))
+                set_committed_value(o, attr, value)
+            if value is not None:
+                results[id(value)] = value
+
+    return results.values()
+
+
 class Serializer(object):
+    # the (many-to-one) relationships used by ``serialize``, loaded for an
+    # entire list at once; nested relationships may be given as dotted paths
+    prefetch = ()
+
     def __call__(self, obj):
         return self.serialize(obj)
 
@@ -5,6 +5,8 @@ from changes.utils.http import build_uri
 
 @register(AggregateTestGroup)
 class AggregateTestGroupSerializer(Serializer):
+    prefetch = ('parent',)
+
     def serialize(self, instance):
         if instance.parent:
             short_name = instance.name[len(instance.parent.name) + 1:]
@@ -28,6 +30,8 @@ class AggregateTestGroupSerializer(Serializer):
 
 
 class AggregateTestGroupWithJobSerializer(AggregateTestGroupSerializer):
+    prefetch = AggregateTestGroupSerializer.prefetch + ('first_job', 'last_job')
+
     def serialize(self, instance):
         data = super(AggregateTestGroupWithJobSerializer, self).serialize(instance)
         data.update({
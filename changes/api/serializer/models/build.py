@@ -5,6 +5,8 @@ from changes.utils.http import build_uri
 
 @register(Build)
 class BuildSerializer(Serializer):
+    prefetch = ('project', 'author', 'source')
+
     def serialize(self, instance):
         if instance.project_id:
             avg_build_time = instance.project.avg_build_time
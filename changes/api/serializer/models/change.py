@@ -5,6 +5,8 @@ from changes.utils.http import build_uri
 
 @register(Change)
 class ChangeSerializer(Serializer):
+    prefetch = ('project', 'author')
+
     def serialize(self, instance):
         result = {
             'id': instance.id.hex,
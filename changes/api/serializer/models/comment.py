@@ -4,6 +4,8 @@ from changes.models import Comment
 
 @register(Comment)
 class CommentSerializer(Serializer):
+    prefetch = ('user',)
+
     def serialize(self, instance):
         return {
             'id': instance.id.hex,
@@ -5,6 +5,8 @@ from changes.utils.http import build_uri
 
 @register(Job)
 class JobSerializer(Serializer):
+    prefetch = ('project',)
+
     def serialize(self, instance):
         if instance.project_id:
             avg_build_time = instance.project.avg_build_time
@@ -40,6 +42,9 @@ class JobSerializer(Serializer):
 
 
 class JobWithBuildSerializer(JobSerializer):
+    prefetch = JobSerializer.prefetch + (
+        'build', 'build.project', 'build.author', 'build.source')
+
     def serialize(self, instance):
         data = super(JobWithBuildSerializer, self).serialize(instance)
         data['build'] = instance.build
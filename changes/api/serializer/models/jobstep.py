@@ -4,6 +4,8 @@ from changes.models import JobStep
 
 @register(JobStep)
 class JobStepSerializer(Serializer):
+    prefetch = ('node',)
+
     def serialize(self, instance):
         return {
             'id': instance.id.hex,
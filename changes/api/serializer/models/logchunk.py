@@ -6,6 +6,8 @@ from changes.models.log import LogChunk
 
 @register(LogChunk)
 class LogChunkSerializer(Serializer):
+    prefetch = ('source',)
+
     def serialize(self, instance):
         conv = Ansi2HTMLConverter()
         formatted_text = conv.convert(instance.text, full=False)
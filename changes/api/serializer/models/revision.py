@@ -4,6 +4,8 @@ from changes.models.revision import Revision
 
 @register(Revision)
 class RevisionSerializer(Serializer):
+    prefetch = ('author',)
+
     def serialize(self, instance):
         return {
             'id': instance.sha,
@@ -6,6 +6,8 @@ from changes.utils.http import build_uri
 
 @register(TestGroup)
 class TestGroupSerializer(Serializer):
+    prefetch = ('parent',)
+
     def serialize(self, instance):
         if instance.parent:
             short_name = instance.name[len(instance.parent.name) + 1:]
@@ -26,6 +28,8 @@ class TestGroupSerializer(Serializer):
 
 
 class TestGroupWithJobSerializer(TestGroupSerializer):
+    prefetch = TestGroupSerializer.prefetch + ('job', 'job.project')
+
     def serialize(self, instance):
         data = super(TestGroupWithJobSerializer, self).serialize(instance)
         data['job'] = instance.job
@@ -2,41 +2,123 @@ from __future__ import absolute_import
 
 import gevent
 
-from collections import deque
+from collections import OrderedDict
+from gevent.event import Event
+from itertools import count
 
 from changes.config import pubsub
 
 
+# the interval (in seconds) at which a comment is sent to idle clients to
+# keep their connection open
+HEARTBEAT_INTERVAL = 15
+
+# the maximum number of events buffered for a client which has fallen behind,
+# beyond which its stream is closed (see ``EventStream.push``)
+MAX_PENDING = 100
+
+# events which carry the full state of an object, so any pending update for
+# the same object is superseded by a newer one
+COLLAPSIBLE_EVENTS = frozenset(['build.update', 'job.update'])
+
+
 class EventStream(object):
-    def __init__(self, channels, pubsub=pubsub):
+    def __init__(self, channels, pubsub=pubsub, heartbeat_interval=HEARTBEAT_INTERVAL,
+                 max_pending=MAX_PENDING, last_event_id=None):
         self.pubsub = pubsub
-        self.pending = deque()
+        self.pending = OrderedDict()
         self.channels = channels
         self.active = True
+        self.heartbeat_interval = heartbeat_interval
+        self.max_pending = max_pending
+
+        self._wakeup = Event()
+        self._counter = count()
 
         for channel in channels:
             self.pubsub.subscribe(channel, self.push)
 
+        if last_event_id is not None:
+            self.replay(last_event_id)
+
+    def replay(self, last_event_id):
+        """
+        Queue the events published since ``last_event_id`` (as sent by a
+        reconnecting client), along with anything already pending.
+        """
+        events = []
+        for channel in self.channels:
+            events.extend(self.pubsub.get_replay(channel, last_event_id))
+
+        # we're already subscribed, so an event may be both pending and
+        # replayed
+        events.extend(self.pending.values())
+        self.pending = OrderedDict()
+
+        seen = set()
+        for event in sorted(events, key=lambda e: e.get('seq')):
+            if event.get('seq') in seen:
+                continue
+            seen.add(event.get('seq'))
+            self.push(event)
+
     def __iter__(self):
-        while self.active:
-            # TODO(dcramer): figure out why we have to send this to ensure
-            # the connection is opened
-            yield "\n"
+        # TODO(dcramer): figure out why we have to send this to ensure
+        # the connection is opened
+        yield "\n"
+        while True:
+            if self.active:
+                self._wakeup.wait(self.heartbeat_interval)
+            if self.active and not self._wakeup.is_set():
+                yield ": ping\n\n"
+                continue
+
+            # anything pushed from here on will wake us up again
+            self._wakeup.clear()
             while self.pending:
-                event = self.pending.pop()
+                _, event = self.pending.popitem(last=False)
+                if event.get('seq'):
+                    yield "id: {}\n".format(event['seq'])
                 yield "event: {}\n".format(event['event'])
                 for line in event['data'].splitlines():
                     yield "data: {}\n".format(line)
                 yield "\n"
                 gevent.sleep(0)
-            gevent.sleep(0.3)
+
+            # whatever was pending when the stream was closed has been sent
+            if not self.active:
+                break
 
     def __del__(self):
         self.close()
 
     def push(self, message):
-        self.pending.append(message)
+        if not self.active:
+            return
+
+        if message['event'] in COLLAPSIBLE_EVENTS and message.get('id'):
+            # replace a pending update, moving it to the end so that events
+            # are still sent in sequence (and Last-Event-ID stays accurate)
+            key = (message['event'], message['id'])
+            self.pending.pop(key, None)
+        else:
+            key = next(self._counter)
+
+        if len(self.pending) >= self.max_pending:
+            # the client has fallen too far behind: rather than lose events,
+            # end the stream once those pending are sent so that the client
+            # reconnects and replays the rest using Last-Event-ID
+            self.close()
+            return
+
+        self.pending[key] = message
+        self._wakeup.set()
 
     def close(self):
+        if not self.active:
+            return
+
+        self.active = False
+        self._wakeup.set()
         for channel in self.channels:
             self.pubsub.unsubscribe(channel, self.push)
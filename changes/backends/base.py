@@ -1,3 +1,6 @@
+from changes.backends.http import get_http_client
+
+
 class UnrecoverableException(Exception):
     pass
 
@@ -6,6 +9,10 @@ class BaseBackend(object):
     def __init__(self, app):
         self.app = app
 
+    @property
+    def http(self):
+        return get_http_client(self.app)
+
     def create_job(self, job):
         raise NotImplementedError
 
@@ -0,0 +1,133 @@
+"""
+A shared HTTP client for talking to build backends.
+
+Every request made through the client reuses a pool of keep-alive connections
+per host, so repeated polls of the same Jenkins (or Koality) server don't pay
+for a new TCP and TLS handshake each time.
+"""
+from __future__ import absolute_import, division
+
+import logging
+import os
+import requests
+import time
+
+from collections import defaultdict
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from urlparse import urlparse
+
+
+# methods which are safe to retry after a failed connection attempt
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+
+class HttpStats(object):
+    """
+    Per-host request counts and timings for the current process.
+    """
+    def __init__(self):
+        self.num_requests = defaultdict(int)
+        self.num_errors = defaultdict(int)
+        self.total_time = defaultdict(float)
+
+    def record(self, host, duration, error=False):
+        self.num_requests[host] += 1
+        self.total_time[host] += duration
+        if error:
+            self.num_errors[host] += 1
+
+    def as_dict(self):
+        return dict(
+            (host, {
+                'requests': self.num_requests[host],
+                'errors': self.num_errors[host],
+                'avgTime': self.total_time[host] / self.num_requests[host],
+            })
+            for host in self.num_requests
+        )
+
+
+class HttpClient(object):
+    """
+    Wraps ``requests.Session``'s with pooled, keep-alive connections and
+    retries of failed connection attempts.
+
+    Only idempotent requests are retried, as retrying e.g. the POST which
+    starts a Jenkins build after a connection reset could start it twice.
+
+    >>> client = HttpClient()
+    >>> client.get('http://jenkins.example.com/api/json/', timeout=5)
+    """
+    def __init__(self, pool_connections=10, pool_maxsize=10, max_retries=2):
+        self.session = self._create_session(
+            pool_connections, pool_maxsize, max_retries)
+        self.unsafe_session = self._create_session(
+            pool_connections, pool_maxsize, 0)
+
+        self.stats = HttpStats()
+        self.logger = logging.getLogger('http')
+
+    def _create_session(self, pool_connections, pool_maxsize, max_retries):
+        session = requests.Session()
+
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=max_retries,
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def request(self, method, url, **kwargs):
+        host = urlparse(url).netloc
+
+        if method.upper() in IDEMPOTENT_METHODS:
+            session = self.session
+        else:
+            session = self.unsafe_session
+
+        start = time.time()
+        try:
+            response = session.request(method, url, **kwargs)
+        except Exception:
+            self.stats.record(host, time.time() - start, error=True)
+            raise
+
+        duration = time.time() - start
+        self.stats.record(host, duration)
+        self.logger.debug(
+            '%s %s returned %s in %dms', method, url, response.status_code,
+            duration * 1000)
+
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+def get_http_client(app=None):
+    """
+    Return the HttpClient shared by the current process.
+
+    Connection pools must not be shared across a fork (e.g. by Celery
+    workers), so a new client is created for each process.
+    """
+    if app is None:
+        app = current_app
+
+    pid = os.getpid()
+
+    client_pid, client = app.extensions.get('http-client', (None, None))
+    if client is None or client_pid != pid:
+        client = HttpClient(
+            pool_connections=app.config['HTTP_POOL_CONNECTIONS'],
+            pool_maxsize=app.config['HTTP_POOL_MAXSIZE'],
+            max_retries=app.config['HTTP_MAX_RETRIES'],
+        )
+        app.extensions['http-client'] = (pid, client)
+    return client
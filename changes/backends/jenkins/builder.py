@@ -3,31 +3,36 @@ from __future__ import absolute_import, division
 import json
 import logging
 import re
-import requests
 import time
 
-from cStringIO import StringIO
 from datetime import datetime
 from hashlib import sha1
 from flask import current_app
+from threading import Lock
+from urlparse import urlparse
 
 from changes.backends.base import BaseBackend, UnrecoverableException
 from changes.config import db
 from changes.constants import Result, Status
-from changes.db.utils import create_or_update, get_or_create
+from changes.db.utils import get_or_create
 from changes.events import publish_logchunk_update
 from changes.jobs.sync_artifact import sync_artifact
 from changes.jobs.sync_job_step import sync_job_step
 from changes.models import (
-    AggregateTestSuite, Artifact, TestResult, TestResultManager, TestSuite,
-    LogSource, LogChunk, Node, JobPhase, JobStep
+    Artifact, TestResult, TestResultManager, TestSuite,
+    LogSource, LogChunkWriter, Node, JobPhase, JobStep
 )
 from changes.handlers.xunit import XunitHandler
+from changes.storage.logs import get_log_store
+from changes.storage.search import get_index_prefix
 from changes.utils.agg import safe_agg
 from changes.utils.http import build_uri
 
 LOG_CHUNK_SIZE = 4096
 
+# the amount of data read from the socket at a time when streaming logs
+LOG_READ_SIZE = 65536
+
 RESULT_MAP = {
     'SUCCESS': Result.passed,
     'ABORTED': Result.aborted,
@@ -44,31 +49,98 @@ XUNIT_FILENAMES = ('junit.xml', 'xunit.xml', 'nosetests.xml')
 ID_XML_RE = re.compile(r'<id>(\d+)</id>')
 NUMBER_XML_RE = re.compile(r'<number>(\d+)</number>')
 
+# the fields of a build used when syncing a step (see _sync_step_from_active)
+BUILD_TREE = 'builds[number,building,result,timestamp,duration,builtOn,fullDisplayName,url,artifacts[fileName,relativePath,displayPath]]{{0,{limit}}}'
+
 
 def chunked(iterator, chunk_size):
     """
     Given an iterator, chunk it up into ~chunk_size, but be aware of newline
     termination as an intended goal.
+
+    Data is accumulated in a single buffer and only the (less than
+    chunk_size) remainder is moved after each input chunk, so large inputs
+    are not repeatedly re-copied.
     """
-    result = ''
+    buf = bytearray()
     for chunk in iterator:
-        result += chunk
-        while len(result) >= chunk_size:
-            newline_pos = result.rfind('\n', 0, chunk_size)
+        buf.extend(chunk)
+
+        start = 0
+        view = memoryview(buf)
+        while len(buf) - start >= chunk_size:
+            newline_pos = buf.rfind('\n', start, start + chunk_size)
             if newline_pos == -1:
-                newline_pos = chunk_size
+                end = start + chunk_size
             else:
-                newline_pos += 1
-            yield result[:newline_pos]
-            result = result[newline_pos:]
-    if result:
-        yield result
+                end = newline_pos + 1
+            yield view[start:end].tobytes()
+            start = end
+        # a bytearray can't be resized while a view on it exists
+        del view
+
+        if start:
+            del buf[:start]
+
+    if buf:
+        yield str(buf)
 
 
 class NotFound(Exception):
     pass
 
 
+class JobSnapshotCache(object):
+    """
+    A short-lived, per-process cache of the state of a Jenkins job's recent
+    builds, shared by every step syncing against that job.
+
+    Only one caller fetches a given snapshot at a time; others wait for (and
+    then reuse) its result. Snapshots are evicted once they expire, so the
+    cache only holds the jobs which are currently being synced.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.key_locks = {}
+        self.snapshots = {}
+
+    def get(self, key, ttl, fetch):
+        with self.lock:
+            self._evict_expired()
+            key_lock = self.key_locks.setdefault(key, Lock())
+
+        with key_lock:
+            date_expires, snapshot = self.snapshots.get(key, (0, None))
+            if snapshot is None or time.time() > date_expires:
+                snapshot = fetch()
+                self.snapshots[key] = (time.time() + ttl, snapshot)
+        return snapshot
+
+    def _evict_expired(self):
+        now = time.time()
+        for key, key_lock in self.key_locks.items():
+            date_expires, _ = self.snapshots.get(key, (0, None))
+            if date_expires >= now:
+                continue
+
+            # the snapshot is being (re)fetched
+            if not key_lock.acquire(False):
+                continue
+
+            try:
+                self.snapshots.pop(key, None)
+                del self.key_locks[key]
+            finally:
+                key_lock.release()
+
+    def clear(self):
+        with self.lock:
+            self.snapshots.clear()
+
+
+job_snapshots = JobSnapshotCache()
+
+
 class JenkinsBuilder(BaseBackend):
     provider = 'jenkins'
 
@@ -81,6 +153,11 @@ class JenkinsBuilder(BaseBackend):
         # disabled by default as it's expensive
         self.sync_log_artifacts = self.app.config.get('JENKINS_SYNC_LOG_ARTIFACTS', False)
         self.sync_xunit_artifacts = self.app.config.get('JENKINS_SYNC_XUNIT_ARTIFACTS', True)
+        # fetch the state of all recent builds of a job in a single request,
+        # shared by every step polling that job within JENKINS_BATCH_SYNC_TTL
+        self.batch_sync = self.app.config.get('JENKINS_BATCH_SYNC', False)
+        self.batch_sync_ttl = self.app.config.get('JENKINS_BATCH_SYNC_TTL', 3)
+        self.batch_sync_limit = self.app.config.get('JENKINS_BATCH_SYNC_LIMIT', 100)
 
     def _get_raw_response(self, path, method='GET', params=None, **kwargs):
         url = '{}/{}'.format(self.base_url, path.lstrip('/'))
@@ -94,7 +171,7 @@ class JenkinsBuilder(BaseBackend):
         params.setdefault('token', self.token)
 
         self.logger.info('Fetching %r', url)
-        resp = getattr(requests, method.lower())(url, params=params, **kwargs)
+        resp = self.http.request(method, url, params=params, **kwargs)
 
         if resp.status_code == 404:
             raise NotFound
@@ -152,12 +229,16 @@ class JenkinsBuilder(BaseBackend):
             build=build_no, artifact=artifact['relativePath'],
         )
 
-        resp = requests.get(url, stream=True, timeout=15)
+        resp = self.http.get(url, stream=True, timeout=15)
+        try:
+            # parse directly off of the socket so that we never hold the
+            # entire report in memory, and so parsing overlaps with the download
+            resp.raw.decode_content = True
 
-        # TODO(dcramer): requests doesnt seem to provide a non-binary file-like
-        # API, so we're stuffing it into StringIO
-        handler = XunitHandler(jobstep.job)
-        handler.process(StringIO(resp.content))
+            handler = XunitHandler(jobstep.job)
+            handler.process(resp.raw)
+        finally:
+            resp.close()
 
     def _sync_artifact_as_log(self, jobstep, job_name, build_no, artifact):
         job = jobstep.job
@@ -175,23 +256,29 @@ class JenkinsBuilder(BaseBackend):
             build=build_no, artifact=artifact['relativePath'],
         )
 
-        offset = 0
-        resp = requests.get(url, stream=True, timeout=15)
-        iterator = resp.iter_content()
-        for chunk in chunked(iterator, LOG_CHUNK_SIZE):
-            chunk_size = len(chunk)
-            chunk, _ = create_or_update(LogChunk, where={
-                'source': logsource,
-                'offset': offset,
-            }, values={
-                'job': job,
-                'project': job.project,
-                'size': chunk_size,
-                'text': chunk,
-            })
-            offset += chunk_size
-
-            publish_logchunk_update(chunk)
+        resp = self.http.get(url, stream=True, timeout=15)
+        try:
+            iterator = resp.iter_content(chunk_size=LOG_READ_SIZE)
+
+            writer = self._get_log_writer(logsource, offset=0)
+            for chunk in chunked(iterator, LOG_CHUNK_SIZE):
+                writer.write(chunk)
+            writer.close()
+        finally:
+            resp.close()
+
+    def _get_log_writer(self, logsource, offset):
+        index = self.app.config['LOG_SEARCH_INDEX']
+        return LogChunkWriter(
+            logsource,
+            offset=offset,
+            flush_size=self.app.config['LOG_FLUSH_SIZE'],
+            flush_interval=self.app.config['LOG_FLUSH_INTERVAL'],
+            publish=publish_logchunk_update,
+            store=get_log_store(self.app),
+            index=index,
+            index_prefix=get_index_prefix(logsource, offset) if index else '',
+        )
 
     def _sync_console_log(self, jobstep):
         job = jobstep.job
@@ -224,32 +311,28 @@ class JenkinsBuilder(BaseBackend):
             build=build_no,
         )
 
-        resp = requests.get(
+        resp = self.http.get(
             url, params={'start': offset}, stream=True, timeout=15)
-        log_length = int(resp.headers['X-Text-Size'])
-        # When you request an offset that doesnt exist in the build log, Jenkins
-        # will instead return the entire log. Jenkins also seems to provide us
-        # with X-Text-Size which indicates the total size of the log
-        if offset > log_length:
-            return
-
-        iterator = resp.iter_content()
-        # XXX: requests doesnt seem to guarantee chunk_size, so we force it
-        # with our own helper
-        for chunk in chunked(iterator, LOG_CHUNK_SIZE):
-            chunk_size = len(chunk)
-            chunk, _ = create_or_update(LogChunk, where={
-                'source': logsource,
-                'offset': offset,
-            }, values={
-                'job': job,
-                'project': job.project,
-                'size': chunk_size,
-                'text': chunk,
-            })
-            offset += chunk_size
-
-            publish_logchunk_update(chunk)
+        try:
+            log_length = int(resp.headers['X-Text-Size'])
+            # When you request an offset that doesnt exist in the build log,
+            # Jenkins will instead return the entire log. Jenkins also seems to
+            # provide us with X-Text-Size which indicates the total size of the
+            # log
+            if offset > log_length:
+                return
+
+            iterator = resp.iter_content(chunk_size=LOG_READ_SIZE)
+
+            writer = self._get_log_writer(logsource, offset=offset)
+            # XXX: requests doesnt seem to guarantee chunk_size, so we force it
+            # with our own helper
+            for chunk in chunked(iterator, LOG_CHUNK_SIZE):
+                writer.write(chunk)
+            writer.close()
+        finally:
+            # return the connection to the pool even if we stopped reading
+            resp.close()
 
         # We **must** track the log offset externally as Jenkins embeds encoded
         # links and we cant accurately predict the next `start` param.
@@ -262,6 +345,7 @@ class JenkinsBuilder(BaseBackend):
 
     def _process_test_report(self, job, test_report):
         test_list = []
+        suite_list = []
 
         if not test_report:
             return test_list
@@ -279,21 +363,7 @@ class JenkinsBuilder(BaseBackend):
                 'project': job.project,
             })
 
-            agg, created = get_or_create(AggregateTestSuite, where={
-                'project': job.project,
-                'name_sha': suite.name_sha,
-            }, defaults={
-                'name': suite.name,
-                'first_job_id': job.id,
-            })
-
-            # if not created:
-            #     db.session.query(AggregateTestSuite).filter(
-            #         AggregateTestSuite.id == agg.id,
-            #         AggregateTestSuite.last_job_id == agg.last_job_id,
-            #     ).update({
-            #         AggregateTestSuite.last_job_id: build.id,
-            #     }, synchronize_session=False)
+            suite_list.append(suite)
 
             for case in suite_data['cases']:
                 message = []
@@ -325,6 +395,9 @@ class JenkinsBuilder(BaseBackend):
                     result=result,
                 )
                 test_list.append(test_result)
+
+        TestResultManager(job).save_aggregate_suites(suite_list)
+
         return test_list
 
     def _sync_test_results(self, step, job_name, build_no):
@@ -336,9 +409,11 @@ class JenkinsBuilder(BaseBackend):
 
         test_list = self._process_test_report(step.job, test_report)
 
+        # each step (e.g. a downstream build of a factory job) contributes its
+        # own shard of results to the job
         manager = TestResultManager(step.job)
         with db.session.begin_nested():
-            manager.save(test_list)
+            manager.merge(test_list)
 
     def _find_job(self, job_name, job_id):
         """
@@ -434,6 +509,39 @@ class JenkinsBuilder(BaseBackend):
         elif item.get('executable'):
             return self._sync_step_from_active(step)
 
+    def _get_job_snapshot(self, job_name):
+        """
+        Return a mapping of build number to build details for the recent
+        builds of the given job.
+        """
+        def fetch():
+            try:
+                item = self._get_response('/job/{}'.format(job_name), params={
+                    'tree': BUILD_TREE.format(limit=self.batch_sync_limit),
+                })
+            except NotFound:
+                return {}
+            if not item:
+                return {}
+            return dict((b['number'], b) for b in item.get('builds', ()))
+
+        return job_snapshots.get(
+            (self.base_url, job_name), self.batch_sync_ttl, fetch)
+
+    def _get_build(self, job_name, build_no):
+        if self.batch_sync:
+            item = self._get_job_snapshot(job_name).get(int(build_no))
+            if item is not None:
+                return item
+            # fall through for builds which are too old (or too new) to be
+            # in the snapshot
+
+        try:
+            return self._get_response('/job/{}/{}'.format(
+                job_name, build_no))
+        except NotFound:
+            raise UnrecoverableException('Unable to find job in Jenkins')
+
     def _sync_step_from_active(self, step):
         try:
             job_name = step.data['job_name']
@@ -441,11 +549,7 @@ class JenkinsBuilder(BaseBackend):
         except KeyError:
             raise UnrecoverableException('Missing Jenkins job information')
 
-        try:
-            item = self._get_response('/job/{}/{}'.format(
-                job_name, build_no))
-        except NotFound:
-            raise UnrecoverableException('Unable to find job in Jenkins')
+        item = self._get_build(job_name, build_no)
 
         # TODO(dcramer): we're doing a lot of work here when we might
         # not need to due to it being sync'd previously
@@ -552,6 +656,20 @@ class JenkinsBuilder(BaseBackend):
                 'Unable to sync console log for job step %r',
                 step.id.hex)
 
+        self._log_http_stats(job_name, build_no)
+
+    def _log_http_stats(self, job_name, build_no):
+        # the counters cover every request this process has made to Jenkins
+        host = urlparse(self.base_url).netloc
+        stats = self.http.stats.as_dict().get(host)
+        if not stats:
+            return
+
+        self.logger.info(
+            'Synced %s #%s (%s: %d requests, %d errors, %dms average)',
+            job_name, build_no, host, stats['requests'], stats['errors'],
+            stats['avgTime'] * 1000)
+
     def sync_job(self, job):
         """
         Steps get created during the create_job and sync_step phases so we only
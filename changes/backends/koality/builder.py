@@ -1,7 +1,6 @@
 from __future__ import absolute_import, division
 
 import json
-import requests
 import sys
 
 from collections import defaultdict
@@ -56,7 +55,7 @@ class KoalityBuilder(BaseBackend):
         # TODO(dcramer): ensure SSL is usable
         kwargs.setdefault('verify', False)
         kwargs['params'].setdefault('key', self.api_key)
-        response = getattr(requests, method.lower())(url, **kwargs)
+        response = self.http.request(method, url, **kwargs)
         data = response.text
         try:
             return json.loads(data)
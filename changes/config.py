@@ -60,6 +60,9 @@ def create_app(_read_config=True, **config):
 
     app.config['API_TRACEBACKS'] = True
 
+    # how long (in seconds) cached API responses are kept
+    app.config['API_CACHE_TTL'] = 300
+
     app.config['CELERY_ACCEPT_CONTENT'] = ['changes_json']
     app.config['CELERY_ACKS_LATE'] = True
     app.config['CELERY_BROKER_URL'] = 'redis://localhost/0'
@@ -112,6 +115,14 @@ def create_app(_read_config=True, **config):
             'task': 'cleanup_builds',
             'schedule': timedelta(minutes=1),
         },
+        'snapshot-task-states': {
+            'task': 'snapshot_task_states',
+            'schedule': timedelta(seconds=30),
+        },
+        'reconcile-task-states': {
+            'task': 'reconcile_task_states',
+            'schedule': timedelta(minutes=5),
+        },
         # 'check-repos': {
         #     'task': 'check_repos',
         #     'schedule': timedelta(minutes=5),
@@ -119,6 +130,35 @@ def create_app(_read_config=True, **config):
     }
     app.config['CELERY_TIMEZONE'] = 'UTC'
 
+    # where the live state of tracked tasks is kept: 'database' or 'redis'
+    app.config['TASK_STATE_BACKEND'] = 'database'
+    app.config['TASK_STATE_OPTIONS'] = {}
+
+    # bounds (in seconds) for the adaptive delay between polls of a running
+    # job or step
+    app.config['POLL_COUNTDOWN_MIN'] = 5
+    app.config['POLL_COUNTDOWN_MAX'] = 60
+
+    # connection pooling for requests made to build backends (the number of
+    # hosts to keep pools for, and the number of connections per host)
+    app.config['HTTP_POOL_CONNECTIONS'] = 10
+    app.config['HTTP_POOL_MAXSIZE'] = 10
+    app.config['HTTP_MAX_RETRIES'] = 2
+
+    # log chunks are written (and published) in batches of this many bytes,
+    # or at least this often (in seconds) while a log is streaming
+    app.config['LOG_FLUSH_SIZE'] = 256 * 1024
+    app.config['LOG_FLUSH_INTERVAL'] = 1
+
+    # keep logs as compressed segments in blob storage rather than in the
+    # logchunk table (see changes.storage.logs), e.g. 'filesystem' with
+    # {'root': '/var/lib/changes/logs'}
+    app.config['LOG_STORAGE_BACKEND'] = None
+    app.config['LOG_STORAGE_OPTIONS'] = {}
+
+    # index logs for search (see changes.storage.search) as they're synced
+    app.config['LOG_SEARCH_INDEX'] = True
+
     app.config['SENTRY_DSN'] = None
 
     app.config['JENKINS_URL'] = None
@@ -217,7 +257,8 @@ def configure_api_routes(app):
     from changes.api.change_details import ChangeDetailsAPIView
     from changes.api.change_index import ChangeIndexAPIView
     from changes.api.job_details import JobDetailsAPIView
-    from changes.api.job_log_details import JobLogDetailsAPIView
+    from changes.api.job_log_details import JobLogDetailsAPIView, JobLogRawAPIView
+    from changes.api.job_log_search import JobLogSearchAPIView
     from changes.api.jobphase_index import JobPhaseIndexAPIView
     from changes.api.node_details import NodeDetailsAPIView
     from changes.api.node_job_index import NodeJobIndexAPIView
@@ -227,6 +268,7 @@ def configure_api_routes(app):
     from changes.api.project_commit_details import ProjectCommitDetailsAPIView
     from changes.api.project_commit_index import ProjectCommitIndexAPIView
     from changes.api.project_index import ProjectIndexAPIView
+    from changes.api.project_log_search import ProjectLogSearchAPIView
     from changes.api.project_stats_index import ProjectStatsIndexAPIView
     from changes.api.project_test_details import ProjectTestDetailsAPIView
     from changes.api.project_test_index import ProjectTestIndexAPIView
@@ -247,6 +289,8 @@ def configure_api_routes(app):
     api.add_resource(BuildTestIndexAPIView, '/builds/<build_id>/tests/')
     api.add_resource(JobDetailsAPIView, '/jobs/<job_id>/')
     api.add_resource(JobLogDetailsAPIView, '/jobs/<job_id>/logs/<source_id>/')
+    api.add_resource(JobLogRawAPIView, '/jobs/<job_id>/logs/<source_id>/raw/')
+    api.add_resource(JobLogSearchAPIView, '/jobs/<job_id>/logs/search/')
     api.add_resource(JobPhaseIndexAPIView, '/jobs/<job_id>/phases/')
     api.add_resource(ChangeIndexAPIView, '/changes/')
     api.add_resource(ChangeDetailsAPIView, '/changes/<change_id>/')
@@ -259,6 +303,7 @@ def configure_api_routes(app):
     api.add_resource(ProjectBuildSearchAPIView, '/projects/<project_id>/builds/search/')
     api.add_resource(ProjectCommitIndexAPIView, '/projects/<project_id>/commits/')
     api.add_resource(ProjectCommitDetailsAPIView, '/projects/<project_id>/commits/<commit_id>/')
+    api.add_resource(ProjectLogSearchAPIView, '/projects/<project_id>/logs/search/')
     api.add_resource(ProjectStatsIndexAPIView, '/projects/<project_id>/stats/')
     api.add_resource(ProjectTestIndexAPIView, '/projects/<project_id>/tests/')
     api.add_resource(ProjectTestDetailsAPIView, '/projects/<project_id>/tests/<test_id>/')
@@ -309,27 +354,35 @@ def configure_debug_routes(app):
 def configure_jobs(app):
     from changes.jobs.check_repos import check_repos
     from changes.jobs.cleanup_builds import cleanup_builds
+    from changes.jobs.compact_logs import compact_logs
     from changes.jobs.create_job import create_job
     from changes.jobs.notify_listeners import (
         notify_build_finished, notify_job_finished)
+    from changes.jobs.publish_object_update import publish_object_update
     from changes.jobs.sync_artifact import sync_artifact
     from changes.jobs.sync_build import sync_build
     from changes.jobs.sync_job import sync_job
     from changes.jobs.sync_job_step import sync_job_step
     from changes.jobs.sync_repo import sync_repo
+    from changes.jobs.task_state import (
+        reconcile_task_states, snapshot_task_states)
     from changes.jobs.update_project_stats import (
         update_project_stats, update_project_plan_stats)
 
     queue.register('check_repos', check_repos)
     queue.register('cleanup_builds', cleanup_builds)
+    queue.register('compact_logs', compact_logs)
     queue.register('create_job', create_job)
     queue.register('notify_build_finished', notify_build_finished)
     queue.register('notify_job_finished', notify_job_finished)
+    queue.register('publish_object_update', publish_object_update)
     queue.register('sync_artifact', sync_artifact)
     queue.register('sync_build', sync_build)
     queue.register('sync_job', sync_job)
     queue.register('sync_job_step', sync_job_step)
     queue.register('sync_repo', sync_repo)
+    queue.register('reconcile_task_states', reconcile_task_states)
+    queue.register('snapshot_task_states', snapshot_task_states)
     queue.register('update_project_stats', update_project_stats)
     queue.register('update_project_plan_stats', update_project_plan_stats)
 
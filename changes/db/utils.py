@@ -2,6 +2,18 @@ from changes.config import db
 
 from sqlalchemy.exc import IntegrityError
 
+# the maximum number of rows sent in a single INSERT statement
+BULK_INSERT_BATCH_SIZE = 1000
+
+
+def bulk_insert(table, rows, batch_size=BULK_INSERT_BATCH_SIZE):
+    """
+    Insert ``rows`` (a list of dicts keyed by column name) into ``table``
+    using multi-row INSERT statements of at most ``batch_size`` rows.
+    """
+    for idx in xrange(0, len(rows), batch_size):
+        db.session.execute(table.insert().values(rows[idx:idx + batch_size]))
+
 
 def try_create(model, where, defaults=None):
     if defaults is None:
@@ -1,52 +1,92 @@
+import hashlib
+
 from changes.api.base import as_json
-from changes.config import pubsub
+from changes.api.cache import invalidate
+from changes.config import pubsub, queue, redis
+
+
+# updates of an object within this many seconds of the last one published
+# are coalesced into a single update, sent once the window has passed
+DEBOUNCE_WINDOW = 1
+
+# how long (in seconds) the digest of the last update of an object is kept
+DIGEST_TTL = 3600
+
+
+def publish_update(event, target, channels, force=False):
+    """
+    Publish ``target`` to each of ``channels``, serializing it only once.
+
+    Cached API responses depending on any of ``channels`` are invalidated.
+
+    Nothing is sent if the payload matches the last one published for
+    ``target``. Updates within ``DEBOUNCE_WINDOW`` of the last one are
+    deferred to a single ``publish_object_update`` task, unless ``force``
+    is set.
+
+    Returns whether the update was published.
+    """
+    data = as_json(target)
+    key = '{0}:{1}'.format(event, target.id.hex)
+    digest = hashlib.md5(data).hexdigest()
 
+    if redis.get('events:digest:{0}'.format(key)) == digest:
+        return False
 
-def publish_build_update(target):
+    debounce_key = 'events:debounce:{0}'.format(key)
+    if not force and not redis.set(debounce_key, '', px=DEBOUNCE_WINDOW * 1000, nx=True):
+        if redis.set('events:deferred:{0}'.format(key), '', px=DEBOUNCE_WINDOW * 1000, nx=True):
+            queue.delay('publish_object_update', kwargs={
+                'event': event,
+                'object_id': target.id.hex,
+            }, countdown=DEBOUNCE_WINDOW)
+        return False
+
+    redis.set('events:digest:{0}'.format(key), digest, ex=DIGEST_TTL)
+
+    invalidate(channels)
+
+    pubsub.publish_many(channels, {
+        'id': target.id.hex,
+        'data': data,
+        'event': event,
+    })
+    return True
+
+
+def publish_build_update(target, force=False):
     channels = [
         'builds:{build_id}'.format(
             build_id=target.id.hex,
         ),
         'projects:{project_id}:builds'.format(
-            project_id=target.project.id.hex,
+            project_id=target.project_id.hex,
         ),
     ]
-    if target.author:
+    if target.author_id:
         channels.append('authors:{author_id}:builds'.format(
-            author_id=target.author.id.hex,
+            author_id=target.author_id.hex,
         ))
 
-    if not target.source.patch and target.source.revision_sha:
+    if not target.source.patch_id and target.source.revision_sha:
         channels.append('revisions:{revision_id}:builds'.format(
-            revision_id=target.revision_sha,
+            revision_id=target.source.revision_sha,
         ))
 
-    for channel in channels:
-        json = as_json(target)
+    return publish_update('build.update', target, channels, force=force)
 
-        pubsub.publish(channel, {
-            'data': json,
-            'event': 'build.update',
-        })
 
-
-def publish_job_update(target):
+def publish_job_update(target, force=False):
     channels = [
         'jobs:{job_id}'.format(
             job_id=target.id.hex,
         ),
         'builds:{build_id}:jobs'.format(
-            build_id=target.build.id.hex,
+            build_id=target.build_id.hex,
         ),
     ]
 
-    for channel in channels:
-        json = as_json(target)
-
-        pubsub.publish(channel, {
-            'data': json,
-            'event': 'job.update',
-        })
+    return publish_update('job.update', target, channels, force=force)
 
 
 def publish_change_update(target):
@@ -6,15 +6,40 @@ import redis
 
 from collections import defaultdict
 from flask import _app_ctx_stack
-from fnmatch import fnmatch
 from gevent.pool import Pool
 from uuid import uuid4
 
 
 default_config = {
     'REDIS_URL': 'redis://localhost:6379',
+    # the number of recent messages kept per channel (and for how many
+    # seconds) so that reconnecting clients can catch up
+    'PUBSUB_REPLAY_SIZE': 100,
+    'PUBSUB_REPLAY_TTL': 300,
 }
 
+SEQUENCE_KEY = 'pubsub:seq'
+
+REPLAY_KEY = 'pubsub:replay:{0}'
+
+# Assigns the message (a JSON object) the next sequence number, adds it to
+# the channel's replay buffer and publishes it, atomically so that sequence
+# numbers are published in order.
+PUBLISH_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+local payload
+if ARGV[1] == '{}' then
+    payload = '{"seq": ' .. seq .. '}'
+else
+    payload = '{"seq": ' .. seq .. ', ' .. string.sub(ARGV[1], 2)
+end
+redis.call('LPUSH', KEYS[2], payload)
+redis.call('LTRIM', KEYS[2], 0, tonumber(ARGV[3]) - 1)
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+redis.call('PUBLISH', ARGV[2], payload)
+return seq
+"""
+
 
 def get_state(app):
     """Gets the state for the application"""
@@ -24,46 +49,84 @@ def get_state(app):
     return app.extensions['pubsub']
 
 
+def is_pattern(channel):
+    return any(c in channel for c in '*?[')
+
+
 class _PubSubState(object):
-    # TODO(dcramer): currently we listen to all messages based on the idea
-    # that at least one connected client needs to know
+    """
+    Subscribes to Redis for only those channels (and patterns) which have
+    local callbacks, so a process only receives the messages someone it's
+    serving is listening for.
+    """
     def __init__(self, ext, app):
         self.ext = ext
         self.app = app
 
         self._gpool = Pool()
 
-        self._callbacks = defaultdict(set)
+        # exact channels and patterns are kept apart as Redis tells us which
+        # of our patterns matched a message, so either is a dict lookup
+        self._channels = defaultdict(set)
+        self._patterns = defaultdict(set)
         self._channel = 't_' + uuid4().hex
 
         self._redis = self.get_connection()
         self._pubsub = self._redis.pubsub()
-
-        self._spawn(self._redis_listen)
+        self._listener = None
+        self._publish_script = self._redis.register_script(PUBLISH_SCRIPT)
 
     def get_connection(self):
         return redis.from_url(self.app.config['REDIS_URL'])
 
     def publish(self, channel, data):
-        self._spawn(self._publish_msg, channel, data)
+        self.publish_many([channel], data)
+
+    def publish_many(self, channels, data):
+        """
+        Publish the same message to several channels, encoding it once and
+        sending it in a single round trip.
+        """
+        self._spawn(self._publish_msg, channels, json.dumps(data))
         gevent.sleep(0)
 
     def subscribe(self, channel, callback):
-        self._callbacks[channel].add(callback)
+        if is_pattern(channel):
+            callbacks = self._patterns[channel]
+            if not callbacks:
+                self._pubsub.psubscribe(channel)
+        else:
+            callbacks = self._channels[channel]
+            if not callbacks:
+                self._pubsub.subscribe(channel)
+        callbacks.add(callback)
+
+        # the listener exits once it has no subscriptions left
+        if self._listener is None:
+            self._listener = self._gpool.spawn(self._redis_listen)
+            self._listener.link_exception(self._log_error)
+
         self.app.logger.info(
-            'Channel {%s} has %d subscriber(s)', channel,
-            len(self._callbacks[channel]))
+            'Channel {%s} has %d subscriber(s)', channel, len(callbacks))
         gevent.sleep(0)
 
     def unsubscribe(self, channel, callback):
-        try:
-            self._callbacks[channel].remove(callback)
-        except KeyError:
+        if is_pattern(channel):
+            registry, unsubscribe = self._patterns, self._pubsub.punsubscribe
+        else:
+            registry, unsubscribe = self._channels, self._pubsub.unsubscribe
+
+        callbacks = registry.get(channel)
+        if not callbacks or callback not in callbacks:
             return
 
+        callbacks.remove(callback)
+        if not callbacks:
+            del registry[channel]
+            unsubscribe(channel)
+
         self.app.logger.info(
-            'Channel {%s} has %d subscriber(s)',
-            channel, len(self._callbacks[channel]))
+            'Channel {%s} has %d subscriber(s)', channel, len(callbacks))
         gevent.sleep(0)
 
     def _spawn(self, *args, **kwargs):
@@ -72,35 +135,66 @@ class _PubSubState(object):
     def _log_error(self, greenlet):
         self.app.logger.error(unicode(greenlet.exception))
 
-    def _publish_msg(self, channel, data):
-        self._redis.publish(channel, json.dumps(data))
+    def get_replay(self, channel, since):
+        """
+        Return the buffered messages of ``channel`` with a sequence number
+        greater than ``since``, oldest first.
+        """
+        if is_pattern(channel):
+            return []
+
+        results = []
+        for payload in self._redis.lrange(REPLAY_KEY.format(channel), 0, -1):
+            data = json.loads(payload)
+            if data['seq'] > since:
+                results.append(data)
+        results.reverse()
+        return results
+
+    def _publish_msg(self, channels, payload):
+        pipe = self._redis.pipeline()
+        for channel in channels:
+            self._publish_script(
+                keys=[SEQUENCE_KEY, REPLAY_KEY.format(channel)],
+                args=[
+                    payload, channel,
+                    self.app.config['PUBSUB_REPLAY_SIZE'],
+                    self.app.config['PUBSUB_REPLAY_TTL'],
+                ],
+                client=pipe,
+            )
+        pipe.execute()
 
     def _process_msg(self, msg):
-        if msg.get('type') in ('psubscribe', 'psubscribe'):
+        if msg.get('type') == 'message':
+            callbacks = self._channels.get(msg['channel'])
+        elif msg.get('type') == 'pmessage':
+            callbacks = self._patterns.get(msg['pattern'])
+        else:
+            return
+
+        # the last callback may have left while the message was in flight
+        if not callbacks:
             return
 
-        channel = msg['channel']
         data = json.loads(msg['data'])
-        # XXX(dcramer): this code can be run concurrently so its important
-        # to note that callbacks can change size/contents during iteration
-        for pattern, callbacks in self._callbacks.items():
-            if not fnmatch(channel, pattern):
-                continue
-            # because callbacks is shared, we copy the set into a new list
-            # to ensure it doesnt change during iteration
-            for cb in list(callbacks):
-                self._spawn(cb, data)
-            gevent.sleep(0)
+        # XXX(dcramer): callbacks can change size/contents during iteration,
+        # so we copy the set into a new list
+        for cb in list(callbacks):
+            self._spawn(cb, data)
+        gevent.sleep(0)
 
     def _redis_listen(self):
-        self._pubsub.psubscribe('*')
-        for msg in self._pubsub.listen():
-            try:
-                self._spawn(self._process_msg, msg)
-            except Exception as exc:
-                self.app.logger.warn(
-                    'Could not process message: %s', exc, exc_info=True)
-            gevent.sleep(0)
+        try:
+            for msg in self._pubsub.listen():
+                try:
+                    self._process_msg(msg)
+                except Exception as exc:
+                    self.app.logger.warn(
+                        'Could not process message: %s', exc, exc_info=True)
+                gevent.sleep(0)
+        finally:
+            self._listener = None
 
 
 class PubSub(object):
@@ -135,8 +229,14 @@ class PubSub(object):
     def publish(self, *args, **kwargs):
         return self.get_app().extensions['pubsub'].publish(*args, **kwargs)
 
+    def publish_many(self, *args, **kwargs):
+        return self.get_app().extensions['pubsub'].publish_many(*args, **kwargs)
+
     def subscribe(self, *args, **config):
         return self.get_app().extensions['pubsub'].subscribe(*args, **config)
 
     def unsubscribe(self, *args, **config):
         return self.get_app().extensions['pubsub'].unsubscribe(*args, **config)
+
+    def get_replay(self, *args, **kwargs):
+        return self.get_app().extensions['pubsub'].get_replay(*args, **kwargs)
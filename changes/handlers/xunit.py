@@ -8,57 +8,95 @@ from changes.models import TestResult, TestResultManager
 
 from .base import ArtifactHandler
 
+# the number of TestResult's yielded by XunitHandler.iter_tests at a time
+BATCH_SIZE = 1000
+
 
 class XunitHandler(ArtifactHandler):
     def process(self, fp):
+        """
+        Merge the tests of ``fp`` into the job's test tree, returning the
+        number of tests.
+
+        The report is parsed incrementally, but as the shape of the tree
+        depends on every test in it the tests are merged in a single
+        transaction once the whole report has been read.
+        """
         test_list = self.get_tests(fp)
 
+        # a job may have several xunit artifacts (e.g. one per shard), so merge
+        # them into the existing tree rather than replacing it
         manager = TestResultManager(self.job)
         with db.session.begin_nested():
-            manager.save(test_list)
+            manager.merge(test_list)
 
-        return test_list
+        return len(test_list)
 
     def get_tests(self, fp):
+        results = []
+        for batch in self.iter_tests(fp):
+            results.extend(batch)
+        return results
+
+    def iter_tests(self, fp, batch_size=BATCH_SIZE):
+        """
+        Incrementally parse ``fp`` (any object with a ``read`` method, such as
+        a streaming HTTP response), yielding lists of at most ``batch_size``
+        TestResult's.
+
+        Each ``<testcase>`` element is discarded as soon as it has been
+        processed so memory usage does not grow with the size of the report.
+        """
         # TODO(dcramer): needs to handle TestSuite's
-        job = self.job
-        root = etree.fromstring(fp.read())
+        batch = []
+        for _, node in etree.iterparse(fp, events=('end',), tag='testcase'):
+            batch.append(self._parse_testcase(node))
 
-        results = []
-        for node in root.iter('testcase'):
-            # classname, name, time
-            attrs = dict(node.items())
-            # AFAIK the spec says only one tag can be present
-            # http://windyroad.com.au/dl/Open%20Source/JUnit.xsd
-            try:
-                r_node = list(node.iterchildren())[0]
-            except IndexError:
-                result = Result.passed
-                message = ''
+            # free the element, as well as any references to siblings which
+            # have already been processed
+            node.clear()
+            while node.getprevious() is not None:
+                del node.getparent()[0]
+
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def _parse_testcase(self, node):
+        # classname, name, time
+        attrs = dict(node.items())
+        # AFAIK the spec says only one tag can be present
+        # http://windyroad.com.au/dl/Open%20Source/JUnit.xsd
+        try:
+            r_node = list(node.iterchildren())[0]
+        except IndexError:
+            result = Result.passed
+            message = ''
+        else:
+            # TODO(cramer): whitelist tags that are not statuses
+            if r_node.tag == 'failure':
+                result = Result.failed
+            elif r_node.tag == 'skipped':
+                result = Result.skipped
+            elif r_node.tag == 'error':
+                result = Result.failed
             else:
-                # TODO(cramer): whitelist tags that are not statuses
-                if r_node.tag == 'failure':
-                    result = Result.failed
-                elif r_node.tag == 'skipped':
-                    result = Result.skipped
-                elif r_node.tag == 'error':
-                    result = Result.failed
-                else:
-                    result = None
-
-                message = r_node.text
-
-            # no matching status tags were found
-            if result is None:
-                result = Result.passed
-
-            results.append(TestResult(
-                job=job,
-                name=attrs['name'],
-                package=attrs['classname'] or None,
-                duration=float(attrs['time']) * 1000,
-                result=result,
-                message=message,
-            ))
+                result = None
 
-        return results
+            message = r_node.text
+
+        # no matching status tags were found
+        if result is None:
+            result = Result.passed
+
+        return TestResult(
+            job=self.job,
+            name=attrs['name'],
+            package=attrs['classname'] or None,
+            duration=float(attrs['time']) * 1000,
+            result=result,
+            message=message,
+        )
@@ -0,0 +1,44 @@
+from flask import current_app
+
+from changes.config import db
+from changes.constants import Status
+from changes.models import Job, LogSource
+from changes.models.log import LOG_FLUSH_SIZE
+from changes.storage.logs import DatabaseLogStore, get_log_store
+from changes.utils.locking import lock
+
+
+@lock
+def compact_logs(job_id):
+    """
+    Merge the (many, small) log chunks synced while a job was running into
+    chunks of ``LOG_FLUSH_SIZE`` bytes, or move them into segment storage
+    if ``LOG_STORAGE_BACKEND`` is configured.
+    """
+    job = Job.query.get(job_id)
+    if not job:
+        return
+
+    if job.status != Status.finished:
+        return
+
+    segment_store = get_log_store()
+    chunk_store = DatabaseLogStore()
+
+    sources = list(LogSource.query.filter(
+        LogSource.job_id == job.id,
+    ))
+
+    num_chunks = 0
+    for source in sources:
+        if segment_store is not None:
+            num_chunks += segment_store.import_chunks(source, LOG_FLUSH_SIZE)
+        else:
+            num_chunks += chunk_store.compact(source, LOG_FLUSH_SIZE)[0]
+
+    # the originals are replaced in a single transaction so readers never
+    # see a partially compacted log
+    db.session.commit()
+
+    current_app.logger.info(
+        'Compacted %d log chunks of job %s', num_chunks, job.id.hex)
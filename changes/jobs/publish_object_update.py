@@ -0,0 +1,22 @@
+from changes.events import publish_build_update, publish_job_update
+from changes.models import Build, Job
+
+
+PUBLISHERS = {
+    'build.update': (Build, publish_build_update),
+    'job.update': (Job, publish_job_update),
+}
+
+
+def publish_object_update(event, object_id):
+    """
+    Publish the current state of an object whose updates were debounced
+    (see ``changes.events.publish_update``).
+    """
+    model, publish = PUBLISHERS[event]
+
+    instance = model.query.get(object_id)
+    if not instance:
+        return
+
+    publish(instance, force=True)
@@ -1,9 +1,11 @@
+from flask import current_app
+
 from changes.config import db, queue
 from changes.constants import Result, Status
 from changes.events import publish_build_update
 from changes.models import Build, Job
 from changes.utils.agg import safe_agg
-from changes.queue.task import tracked_task
+from changes.queue.task import flush_poll_stats, tracked_task, WAIT_COUNTDOWN
 
 
 @tracked_task
@@ -64,8 +66,14 @@ def sync_build(build_id):
 
     publish_build_update(build)
 
+    # jobs wake us up as they finish, so there's no need to poll aggressively
     if not is_finished:
-        raise sync_build.NotFinished
+        raise sync_build.NotFinished(countdown=WAIT_COUNTDOWN)
+
+    num_polls, num_saved = flush_poll_stats(build.id)
+    current_app.logger.info(
+        'Build %s finished after %d backend polls (%d saved by adaptive polling)',
+        build.id, num_polls, num_saved)
 
     queue.delay('notify_build_finished', kwargs={
         'build_id': build.id.hex,
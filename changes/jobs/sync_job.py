@@ -6,11 +6,30 @@ from changes.backends.base import UnrecoverableException
 from changes.config import db, queue
 from changes.constants import Status, Result
 from changes.events import publish_job_update
-from changes.models import Job, JobPlan, Plan
-from changes.queue.task import tracked_task
+from changes.models import Job, JobPlan, Plan, ProjectPlan
+from changes.queue.task import get_poll_countdown, tracked_task
 from changes.utils.agg import safe_agg
 
 
+COMPACT_LOGS_COUNTDOWN = 60
+
+
+def get_expected_duration(job, plan_id=None):
+    """
+    Return the expected duration (in milliseconds) of the given job, based on
+    the history of its plan (or otherwise its project).
+    """
+    if plan_id:
+        project_plan = ProjectPlan.query.filter(
+            ProjectPlan.project_id == job.project_id,
+            ProjectPlan.plan_id == plan_id,
+        ).first()
+        if project_plan and project_plan.avg_build_time:
+            return project_plan.avg_build_time
+
+    return job.project.avg_build_time
+
+
 @tracked_task
 def sync_job(job_id):
     job = Job.query.get(job_id)
@@ -88,12 +107,20 @@ def sync_job(job_id):
     publish_job_update(job)
 
     if not is_finished:
-        raise sync_job.NotFinished
+        raise sync_job.NotFinished(countdown=get_poll_countdown(
+            job.date_started,
+            get_expected_duration(job, job_plan.plan_id if job_plan else None),
+        ))
 
     queue.delay('notify_job_finished', kwargs={
         'job_id': job.id.hex,
     })
 
+    # let any in-flight log syncs of the job settle first
+    queue.delay('compact_logs', kwargs={
+        'job_id': job.id.hex,
+    }, countdown=COMPACT_LOGS_COUNTDOWN)
+
     if job_plan:
         queue.delay('update_project_plan_stats', kwargs={
             'project_id': job.project_id.hex,
@@ -5,8 +5,11 @@ from sqlalchemy.orm import subqueryload_all
 from changes.backends.base import UnrecoverableException
 from changes.constants import Status, Result
 from changes.config import db
+from changes.jobs.sync_job import get_expected_duration
 from changes.models import JobStep, JobPlan, Plan
-from changes.queue.task import tracked_task
+from changes.queue.task import (
+    get_poll_countdown, record_poll, tracked_task, WAIT_COUNTDOWN
+)
 
 
 def get_build_step(job_id):
@@ -49,9 +52,19 @@ def sync_job_step(step_id):
     db.session.commit()
 
     if step.status != Status.finished:
-        is_finished = False
-    else:
-        is_finished = sync_job_step.verify_all_children() == Status.finished
+        job_plan = JobPlan.query.filter(
+            JobPlan.job_id == step.job_id,
+        ).first()
 
-    if not is_finished:
-        raise sync_job_step.NotFinished
+        countdown = get_poll_countdown(
+            step.date_started,
+            get_expected_duration(step.job, job_plan.plan_id if job_plan else None),
+        )
+        record_poll(step.job.build_id, countdown)
+
+        raise sync_job_step.NotFinished(countdown=countdown)
+
+    # the step itself is done, so we're only waiting on artifacts which will
+    # wake us up as they finish
+    if sync_job_step.verify_all_children() != Status.finished:
+        raise sync_job_step.NotFinished(countdown=WAIT_COUNTDOWN)
@@ -0,0 +1,20 @@
+from flask import current_app
+
+from changes.queue.store import get_task_store
+
+
+def snapshot_task_states():
+    """
+    Write any task state changes which have only been recorded in the task
+    store (e.g. Redis) to the database.
+    """
+    num_written = get_task_store().snapshot()
+    if num_written:
+        current_app.logger.info('Snapshotted %d task states', num_written)
+
+
+def reconcile_task_states():
+    """
+    Resolve any differences between the task store and the database.
+    """
+    get_task_store().reconcile()
@@ -25,6 +25,7 @@ class Build(db.Model):
     __tablename__ = 'build'
     __table_args__ = (
         Index('idx_buildfamily_project_id', 'project_id'),
+        Index('idx_build_project_date_created', 'project_id', 'date_created', 'id'),
         Index('idx_buildfamily_repository_sha', 'repository_id', 'revision_sha'),
         Index('idx_buildfamily_author_id', 'author_id'),
         Index('idx_buildfamily_patch_id', 'patch_id'),
@@ -1,12 +1,22 @@
+import time
 import uuid
 
 from datetime import datetime
 from sqlalchemy import Column, DateTime, ForeignKey, String, Text, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import relationship
 from sqlalchemy.schema import Index, UniqueConstraint
 
 from changes.config import db
 from changes.db.types.guid import GUID
+from changes.db.utils import bulk_insert, create_or_update
+from changes.utils.trigrams import get_trigrams
+
+# the default number of bytes (and seconds) a LogChunkWriter buffers before
+# writing
+LOG_FLUSH_SIZE = 256 * 1024
+LOG_FLUSH_INTERVAL = 1
 
 
 class LogSource(db.Model):
@@ -68,3 +78,239 @@ class LogChunk(db.Model):
             self.id = uuid.uuid4()
         if self.date_created is None:
             self.date_created = datetime.utcnow()
+
+
+class LogSegment(db.Model):
+    """
+    A compressed, append-only piece of a LogSource kept outside of the
+    database (see ``changes.storage.logs``).
+
+    Segments index the byte range ``[offset, offset + size)`` of the log.
+    """
+    __tablename__ = 'logsegment'
+    __table_args__ = (
+        UniqueConstraint('source_id', 'offset', name='unq_logsegment_source_offset'),
+    )
+
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    source_id = Column(GUID, ForeignKey('logsource.id', ondelete="CASCADE"), nullable=False)
+    offset = Column(Integer, nullable=False)
+    # size is the uncompressed length of the segment
+    size = Column(Integer, nullable=False)
+    key = Column(String(128), nullable=False)
+    date_created = Column(DateTime, default=datetime.utcnow)
+
+    source = relationship('LogSource')
+
+    def __init__(self, **kwargs):
+        super(LogSegment, self).__init__(**kwargs)
+        if self.id is None:
+            self.id = uuid.uuid4()
+        if self.date_created is None:
+            self.date_created = datetime.utcnow()
+
+
+class LogSearchBlock(db.Model):
+    """
+    A trigram index of the byte range ``[offset, offset + size)`` of a
+    LogSource, used to find the parts of logs which may match a search.
+    """
+    __tablename__ = 'logsearchblock'
+    __table_args__ = (
+        Index('idx_logsearchblock_trigrams', 'trigrams', postgresql_using='gin'),
+        UniqueConstraint('source_id', 'offset', name='unq_logsearchblock_source_offset'),
+    )
+
+    id = Column(GUID, primary_key=True, default=uuid.uuid4)
+    source_id = Column(GUID, ForeignKey('logsource.id', ondelete="CASCADE"), nullable=False)
+    offset = Column(Integer, nullable=False)
+    size = Column(Integer, nullable=False)
+    trigrams = Column(ARRAY(Integer), nullable=False)
+    date_created = Column(DateTime, default=datetime.utcnow)
+
+    source = relationship('LogSource')
+
+    def __init__(self, **kwargs):
+        super(LogSearchBlock, self).__init__(**kwargs)
+        if self.id is None:
+            self.id = uuid.uuid4()
+        if self.date_created is None:
+            self.date_created = datetime.utcnow()
+
+    @classmethod
+    def index(cls, source, offset, text):
+        """
+        Index ``text``, the part of ``source`` starting at ``offset``.
+        """
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+
+        block, _ = create_or_update(cls, where={
+            'source_id': source.id,
+            'offset': offset,
+        }, values={
+            'size': len(text),
+            'trigrams': get_trigrams(text),
+        })
+        return block
+
+
+class LogChunkWriter(object):
+    """
+    Buffers the chunks of a LogSource and writes them using multi-row
+    INSERTs, calling ``publish`` with a single (unsaved) LogChunk spanning
+    everything written by each flush.
+
+    Chunks which already exist (e.g. when a log is re-synced) are updated in
+    place, keyed by ``unq_logchunk_source_offset``.
+
+    If a LogSegmentStore is given as ``store`` each flush is instead written
+    as a single segment. With ``index`` each flush is also added to the
+    search index as a LogSearchBlock, up to its last newline: a partial line
+    is carried over to the next block so that no line is split between two
+    blocks. A writer continuing an existing log must be given the start of
+    the line it continues as ``index_prefix``.
+
+    >>> writer = LogChunkWriter(source, offset=0)
+    >>> for text in chunked(iterator, LOG_CHUNK_SIZE):
+    >>>     writer.write(text)
+    >>> writer.close()
+    """
+    def __init__(self, source, offset=0, flush_size=LOG_FLUSH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL, publish=None, store=None,
+                 index=False, index_prefix=''):
+        self.source = source
+        self.offset = offset
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.publish = publish
+        self.store = store
+        self.index = index
+        self.index_offset = offset - len(index_prefix)
+        self.index_buffer = index_prefix
+
+        self.pending = []
+        self.pending_size = 0
+        self.last_flush = time.time()
+
+    def write(self, text):
+        self.pending.append((self.offset, text))
+        self.offset += len(text)
+        self.pending_size += len(text)
+
+        if self.pending_size >= self.flush_size:
+            self.flush()
+        elif time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def close(self):
+        self.flush()
+
+        # the log may yet be continued (see ``index_prefix``), in which case
+        # the block of its last line is replaced
+        if self.index and self.index_buffer:
+            LogSearchBlock.index(self.source, self.index_offset, self.index_buffer)
+
+    def flush(self):
+        self.last_flush = time.time()
+
+        if not self.pending:
+            return
+
+        pending = self.pending
+        self.pending = []
+        self.pending_size = 0
+
+        # the source (and the rows it refers to) may not have been written yet
+        db.session.flush()
+
+        rows = [
+            {
+                'id': uuid.uuid4(),
+                'job_id': self.source.job_id,
+                'project_id': self.source.project_id,
+                'source_id': self.source.id,
+                'offset': offset,
+                'size': len(text),
+                'text': text,
+                'date_created': datetime.utcnow(),
+            }
+            for offset, text in pending
+        ]
+
+        if self.store is not None:
+            segment = self.store.append(
+                self.source, rows[0]['offset'], ''.join(r['text'] for r in rows))
+            rows[0]['id'] = segment.id
+        else:
+            self._save(rows)
+
+        if self.index:
+            self._index(''.join(r['text'] for r in rows))
+
+        if self.publish:
+            self.publish(LogChunk(
+                id=rows[0]['id'],
+                job=self.source.job,
+                project=self.source.project,
+                source=self.source,
+                offset=rows[0]['offset'],
+                size=sum(r['size'] for r in rows),
+                text=''.join(r['text'] for r in rows),
+            ))
+
+    def _index(self, text):
+        text = self.index_buffer + text
+
+        end = text.rfind('\n') + 1
+        # a single line longer than a flush is indexed as it comes rather
+        # than buffered indefinitely
+        if not end and len(text) >= self.flush_size:
+            end = len(text)
+
+        if end:
+            LogSearchBlock.index(self.source, self.index_offset, text[:end])
+            self.index_offset += end
+        self.index_buffer = text[end:]
+
+    def _save(self, rows):
+        existing = dict(db.session.query(
+            LogChunk.offset, LogChunk.id,
+        ).filter(
+            LogChunk.source_id == self.source.id,
+            LogChunk.offset >= rows[0]['offset'],
+            LogChunk.offset <= rows[-1]['offset'],
+        ))
+
+        new_rows = []
+        for row in rows:
+            if row['offset'] not in existing:
+                new_rows.append(row)
+                continue
+
+            row['id'] = existing[row['offset']]
+            LogChunk.query.filter(
+                LogChunk.id == row['id'],
+            ).update({
+                LogChunk.size: row['size'],
+                LogChunk.text: row['text'],
+            }, synchronize_session=False)
+
+        if not new_rows:
+            return
+
+        try:
+            with db.session.begin_nested():
+                bulk_insert(LogChunk.__table__, new_rows)
+        except IntegrityError:
+            # another process wrote some of these chunks concurrently
+            for row in new_rows:
+                create_or_update(LogChunk, where={
+                    'source_id': row['source_id'],
+                    'offset': row['offset'],
+                }, values={
+                    'job_id': row['job_id'],
+                    'project_id': row['project_id'],
+                    'size': row['size'],
+                    'text': row['text'],
+                })
@@ -1,16 +1,28 @@
 from __future__ import absolute_import, division
 
 import re
+import uuid
+import zlib
 
 from collections import defaultdict
 from datetime import datetime
 from hashlib import sha1
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import aliased
 
 from changes.config import db
 from changes.constants import Result
-from changes.db.utils import get_or_create
-from changes.models.aggregatetest import AggregateTestGroup
-from changes.models.test import TestGroup, TestCase
+from changes.db.utils import BULK_INSERT_BATCH_SIZE, bulk_insert
+from changes.models.aggregatetest import AggregateTestGroup, AggregateTestSuite
+from changes.models.test import TestGroup, TestCase, test_group_m2m_table
+
+# test lists at least this large are written using multi-row INSERTs rather
+# than through the ORM
+BULK_SAVE_THRESHOLD = 1000
+
+# the first key of the advisory locks taken by TestResultManager.lock_aggregates
+# (the second being the project)
+AGGREGATE_LOCK_ID = 1
 
 
 class TestResult(object):
@@ -50,6 +62,171 @@ class TestResult(object):
         return TestCase.calculate_name_sha(self.package, self.name)
 
 
+class TestTreeNode(object):
+    """
+    A single prefix of one or more test ids within a TestTree.
+    """
+    __slots__ = (
+        'name', 'sep', 'parent', 'children', 'leaf_tests', 'tests', 'leaves',
+        'suite', 'num_tests', 'num_failed', 'duration', 'result',
+    )
+
+    def __init__(self, name, sep, parent=None, suite=None):
+        self.name = name
+        self.sep = sep
+        self.parent = parent
+        self.children = {}
+        # tests directly beneath this node which have no children of their
+        # own, keyed by the last component of their id
+        self.leaf_tests = {}
+        # tests whose id is exactly this node's name
+        self.tests = []
+        # equivalent to the values of ``count_leaves_with_tests``
+        self.leaves = set()
+        self.suite = suite
+        # aggregates over every test strictly below this node
+        self.num_tests = 0
+        self.num_failed = 0
+        self.duration = 0
+        self.result = Result.unknown
+
+    @property
+    def num_leaves(self):
+        return len(self.leaves)
+
+    @property
+    def is_group(self):
+        """
+        A node becomes a TestGroup if it has children and it was not
+        collapsed into its parent.
+        """
+        return bool((self.children or self.leaf_tests) and self.leaves)
+
+
+class TestTree(object):
+    """
+    A prefix trie of test ids which, in a single pass over ``test_list``,
+    computes the same group hierarchy that ``TestResultManager.regroup_tests``,
+    ``count_leaves_with_tests`` and ``find_parent`` produce, along with each
+    group's test count, failure count, duration and result.
+
+    Tests are partitioned by their separator, so each separator gets its own
+    set of root nodes.
+    """
+    def __init__(self, test_list):
+        self.roots = {}
+        for test in test_list:
+            self.add(test)
+
+    def add(self, test):
+        t_id, sep, result = test.id, test.sep, test.result
+        duration = test.duration or 0
+        failed = 1 if result == Result.failed else 0
+
+        parts = t_id.split(sep)
+        name = parts.pop()
+
+        children = self.roots.setdefault(sep, {})
+        node = None
+        for part in parts:
+            child = children.get(part)
+            if child is None:
+                child = children[part] = TestTreeNode(
+                    part if node is None else node.name + sep + part,
+                    sep, node, test.suite)
+                if node is not None and part in node.leaf_tests:
+                    # a test is now nested beneath an existing leaf
+                    child.tests = node.leaf_tests.pop(part)
+                    child.leaves.add(child.name)
+
+            node = child
+            node.num_tests += 1
+            node.duration += duration
+            node.num_failed += failed
+            if result is not node.result and result > node.result:
+                node.result = result
+
+            children = node.children
+
+        if node is None:
+            # a top level test which has no parent
+            node = children.get(name)
+            if node is None:
+                node = children[name] = TestTreeNode(
+                    name, sep, None, test.suite)
+            node.tests.append(test)
+            parent = node
+        elif name in children:
+            children[name].tests.append(test)
+            children[name].leaves.add(t_id)
+            parent = node
+        else:
+            node.leaf_tests.setdefault(name, []).append(test)
+            parent = node
+
+        # collapse parents which only have a single child (see
+        # count_leaves_with_tests)
+        parent.leaves.add(t_id)
+        while len(parent.leaves) > 1 and parent.parent is not None:
+            parent = parent.parent
+            parent.leaves.add(parent.name)
+
+    def walk(self):
+        """
+        Yield ``(node, parent_group)`` for every node in the tree, where
+        ``parent_group`` is the closest ancestor which is a group (or None).
+
+        Nodes are visited depth first, so parents are always yielded before
+        their children.
+        """
+        stack = [
+            (node, None)
+            for children in self.roots.itervalues()
+            for node in children.itervalues()
+        ]
+        while stack:
+            node, parent = stack.pop()
+            yield node, parent
+            children = node.children
+            if not children:
+                continue
+            if node.leaves:
+                parent = node
+            stack.extend((child, parent) for child in children.itervalues())
+
+    def iter_groups(self):
+        """
+        Yield ``(node, parent_group)`` for every node which should be stored
+        as a TestGroup branch.
+
+        As with ``find_parent``, a branch is only attached to its immediate
+        parent, so branches beneath a collapsed parent become roots.
+        """
+        for node, _ in self.walk():
+            if node.is_group:
+                parent = node.parent
+                if parent is not None and not parent.is_group:
+                    parent = None
+                yield node, parent
+
+    def iter_leaves(self):
+        """
+        Yield ``(tests, parent_group)`` for every test id which should be
+        stored as a TestGroup leaf, where ``tests`` are all of the tests
+        sharing that id.
+
+        Tests without a parent group, and tests whose id is also the name of
+        a group, do not get a leaf.
+        """
+        for node, parent in self.walk():
+            if node.leaves and node.leaf_tests:
+                parent = node
+            if parent is None:
+                continue
+            for tests in node.leaf_tests.itervalues():
+                yield tests, parent
+
+
 class TestResultManager(object):
     def __init__(self, job):
         self.job = job
@@ -120,30 +297,156 @@ class TestResultManager(object):
 
         return group
 
-    def create_aggregate_test_leaf(self, test, parent):
+    def save_aggregate_groups(self, group_list):
+        """
+        Ensure an AggregateTestGroup exists for every ``(name, parent_name)``
+        in ``group_list`` and mark this job as the last to have run it.
+
+        ``group_list`` must be ordered such that parents come before their
+        children. Existing groups are resolved with a single query, and any
+        missing groups are inserted in bulk.
+
+        Returns a mapping of name => AggregateTestGroup.id.
+        """
         job = self.job
-        project = job.project
-        name_sha = test.name_sha
+        if not group_list:
+            return {}
 
-        agg, created = get_or_create(AggregateTestGroup, where={
-            'project': project,
-            'name_sha': name_sha,
-            'suite_id': None,  # TODO
-        }, defaults={
-            'name': test.id,
-            'parent': parent,
-            'first_job_id': job.id,
-            'last_job_id': job.id,
-        })
-        # if not created:
-        #     db.session.query(AggregateTestGroup).filter(
-        #         AggregateTestGroup.id == agg.id,
-        #         AggregateTestGroup.last_job_id == agg.last_job_id,
-        #     ).update({
-        #         AggregateTestGroup.last_job_id: job.id,
-        #     }, synchronize_session=False)
-
-        return agg
+        agg_ids = self._get_aggregate_group_ids(
+            [name for name, _ in group_list])
+
+        missing = [
+            (name, parent_name)
+            for name, parent_name in group_list
+            if name not in agg_ids
+        ]
+        if missing:
+            # aggregate groups are stored without a suite, and as NULLs never
+            # conflict unq_aggtestgroup_key can't stop concurrent jobs from
+            # inserting the same group, so look again holding the lock
+            self.lock_aggregates()
+            agg_ids.update(self._get_aggregate_group_ids(
+                [name for name, _ in missing]))
+            missing = [
+                (name, parent_name)
+                for name, parent_name in missing
+                if name not in agg_ids
+            ]
+
+        if agg_ids:
+            db.session.query(AggregateTestGroup).filter(
+                AggregateTestGroup.id.in_(agg_ids.values()),
+            ).update({
+                AggregateTestGroup.last_job_id: job.id,
+            }, synchronize_session=False)
+
+        date_created = datetime.utcnow()
+        new_rows = []
+        for name, parent_name in missing:
+            agg_id = uuid.uuid4()
+            new_rows.append({
+                'id': agg_id,
+                'project_id': job.project_id,
+                'suite_id': None,  # TODO
+                'parent_id': agg_ids.get(parent_name),
+                'name_sha': sha1(name).hexdigest(),
+                'name': name,
+                'first_job_id': job.id,
+                'last_job_id': job.id,
+                'date_created': date_created,
+            })
+            agg_ids[name] = agg_id
+
+        bulk_insert(AggregateTestGroup.__table__, new_rows)
+
+        return agg_ids
+
+    def save_aggregate_suites(self, suite_list):
+        """
+        Ensure an AggregateTestSuite exists for every TestSuite in
+        ``suite_list`` and mark this job as the last to have run it.
+
+        Returns a mapping of name_sha => AggregateTestSuite.id.
+        """
+        job = self.job
+        if not suite_list:
+            return {}
+
+        suites_by_sha = dict((s.name_sha, s) for s in suite_list)
+
+        agg_ids = self._get_aggregate_suite_ids(suites_by_sha.keys())
+
+        missing = [
+            suite for name_sha, suite in sorted(suites_by_sha.iteritems())
+            if name_sha not in agg_ids
+        ]
+        if missing:
+            self.lock_aggregates()
+            agg_ids.update(self._get_aggregate_suite_ids(
+                [suite.name_sha for suite in missing]))
+            missing = [
+                suite for suite in missing
+                if suite.name_sha not in agg_ids
+            ]
+
+        if agg_ids:
+            db.session.query(AggregateTestSuite).filter(
+                AggregateTestSuite.id.in_(agg_ids.values()),
+            ).update({
+                AggregateTestSuite.last_job_id: job.id,
+            }, synchronize_session=False)
+
+        date_created = datetime.utcnow()
+        new_rows = []
+        for suite in missing:
+            agg_id = uuid.uuid4()
+            new_rows.append({
+                'id': agg_id,
+                'project_id': job.project_id,
+                'name_sha': suite.name_sha,
+                'name': suite.name,
+                'first_job_id': job.id,
+                'last_job_id': job.id,
+                'date_created': date_created,
+            })
+            agg_ids[suite.name_sha] = agg_id
+
+        bulk_insert(AggregateTestSuite.__table__, new_rows)
+
+        return agg_ids
+
+    def lock_aggregates(self):
+        """
+        Serialize the creation of the project's aggregate groups and suites
+        with any other job until the end of the current transaction.
+        """
+        db.session.execute(select([func.pg_advisory_xact_lock(
+            AGGREGATE_LOCK_ID, zlib.crc32(self.job.project_id.bytes),
+        )]))
+
+    def _get_aggregate_group_ids(self, names):
+        names_by_sha = dict((sha1(name).hexdigest(), name) for name in names)
+
+        return dict(
+            (names_by_sha[name_sha], agg_id)
+            for name_sha, agg_id in db.session.query(
+                AggregateTestGroup.name_sha, AggregateTestGroup.id,
+            ).filter(
+                AggregateTestGroup.project_id == self.job.project_id,
+                AggregateTestGroup.suite_id == None,  # NOQA TODO
+                AggregateTestGroup.name_sha.in_(names_by_sha.keys()),
+            )
+        )
+
+    def _get_aggregate_suite_ids(self, name_shas):
+        return dict(
+            db.session.query(
+                AggregateTestSuite.name_sha, AggregateTestSuite.id,
+            ).filter(
+                AggregateTestSuite.project_id == self.job.project_id,
+                AggregateTestSuite.name_sha.in_(name_shas),
+            )
+        )
 
     def clear(self):
         """
@@ -157,23 +460,24 @@ class TestResultManager(object):
             TestGroup.job_id == self.job.id,
         ).delete(synchronize_session=False)
 
-    def save(self, test_list):
+    def save(self, test_list, bulk=None):
+        """
+        Persist ``test_list`` along with its TestGroup tree.
+
+        If ``bulk`` is not specified, large lists (see ``BULK_SAVE_THRESHOLD``)
+        are written using ``save_bulk``.
+        """
+        if bulk is None:
+            bulk = len(test_list) >= BULK_SAVE_THRESHOLD
+        if bulk:
+            return self.save_bulk(test_list)
+
         job = self.job
         project = job.project
         groups_by_id = {}
         tests_by_id = {}
-        # agg_groups_by_id = {}
-
-        # Eliminate useless parents (parents which only have a single child)
-        leaf_counts = self.count_leaves_with_tests(test_list)
-
-        # collect all test groups
-        grouped_tests = self.regroup_tests(test_list)
-        grouped_tests = [
-            (k, t)
-            for k, t in grouped_tests
-            if leaf_counts.get(k[0], 0) >= 1
-        ]
+        # (name, parent_name) for every group, parents first
+        tree = []
 
         # create all test cases
         for test in test_list:
@@ -193,80 +497,629 @@ class TestResultManager(object):
 
             tests_by_id[test.id] = testcase
 
-        # Create branches
-        for (name, sep), _ in grouped_tests:
-            parent = self.find_parent(name, sep, groups_by_id)
+        test_tree = TestTree(test_list)
 
+        # Create branches
+        for node, parent in test_tree.iter_groups():
             group = TestGroup(
                 job=job,
-                name_sha=sha1(name).hexdigest(),
-                suite=test.suite,
-                name=name,
+                name_sha=sha1(node.name).hexdigest(),
+                suite=node.suite,
+                name=node.name,
                 project=project,
-                num_leaves=leaf_counts.get(name),
-                parent=parent,
+                duration=node.duration,
+                result=node.result,
+                num_failed=node.num_failed,
+                num_tests=node.num_tests,
+                num_leaves=node.num_leaves,
+                parent=groups_by_id[parent.name] if parent else None,
             )
             db.session.add(group)
 
-            groups_by_id[name] = group
+            groups_by_id[node.name] = group
+            tree.append((node.name, parent.name if parent else None))
+
+        # Create leaves
+        for tests, parent in test_tree.iter_leaves():
+            test = tests[0]
+            leaf = self.create_test_leaf(
+                test, groups_by_id[parent.name], tests_by_id[test.id])
+
+            groups_by_id[leaf.name] = leaf
+            tree.append((leaf.name, parent.name))
+
+        self.save_aggregate_groups(tree)
+
+    def save_bulk(self, test_list):
+        """
+        Identical in outcome to ``save``, but the entire group tree is computed
+        in memory and the ``test``, ``testgroup`` and ``testgroup_test`` rows
+        are written with a handful of multi-row INSERTs rather than one ORM
+        object (and flush) per node.
+
+        Returns the number of rows written.
+        """
+        # rows we insert reference the job and suites directly, so they must
+        # exist in the database first
+        db.session.flush()
+
+        testcase_rows, testcase_ids = self._get_testcase_rows(test_list)
+
+        test_tree = TestTree(test_list)
+
+        branch_rows = []
+        groups_by_id = {}
+        tree = []
+        for node, parent in test_tree.iter_groups():
+            row = self._get_branch_row(
+                node, groups_by_id[parent.name]['id'] if parent else None)
+            branch_rows.append(row)
+            groups_by_id[node.name] = row
+            tree.append((node.name, parent.name if parent else None))
+
+        leaf_rows = []
+        link_rows = []
+        for tests, parent in test_tree.iter_leaves():
+            test = tests[0]
+            row = self._get_leaf_row(test, groups_by_id[parent.name]['id'])
+            leaf_rows.append(row)
+            tree.append((test.id, parent.name))
 
-            # agg, created = get_or_create(AggregateTestGroup, where={
-            #     'project': project,
-            #     'name_sha': group.name_sha,
-            #     'suite_id': None,  # TODO
-            # }, defaults={
-            #     'name': name,
-            #     'parent': self.find_parent(name, sep, agg_groups_by_id),
-            #     'first_job_id': job.id,
-            #     'last_job_id': job.id,
-            # })
+            link_rows.append({
+                'group_id': row['id'],
+                'test_id': testcase_ids[test.id],
+            })
 
-            # if not created:
-            #     db.session.query(AggregateTestGroup).filter(
-            #         AggregateTestGroup.id == agg.id,
-            #         AggregateTestGroup.last_job_id == agg.last_job_id,
-            #     ).update({
-            #         AggregateTestGroup.last_job_id: job.id,
-            #     }, synchronize_session=False)
+        bulk_insert(TestCase.__table__, testcase_rows)
+        bulk_insert(TestGroup.__table__, branch_rows)
+        bulk_insert(TestGroup.__table__, leaf_rows)
+        bulk_insert(test_group_m2m_table, link_rows)
 
-            # agg_groups_by_id[name] = agg
+        self.save_aggregate_groups(tree)
 
-        for (name, sep), tests in reversed(grouped_tests):
-            branch = groups_by_id[name]
-            # agg_branch = agg_groups_by_id[name]
+        return len(testcase_rows) + len(branch_rows) + len(leaf_rows) + len(link_rows)
+
+    def merge(self, test_list):
+        """
+        Merge ``test_list`` (e.g. the results of a single shard) into this
+        job's existing TestGroup tree.
 
-            g_duration = 0
-            g_failed = 0
-            g_total = 0
+        Existing groups which are ancestors of the new tests have their
+        ``num_tests``, ``num_failed``, ``duration`` and ``result`` updated in
+        place, and any missing groups and leaves are inserted. As whether a
+        group is collapsed into its parent depends on every test beneath it
+        (see ``TestTree.add``), the ``num_leaves`` of each ancestor is
+        recomputed from the tests and groups directly beneath it, so the
+        resulting tree is the same as if every shard had been saved at once.
+        Only the groups along the paths of the new tests (and their immediate
+        children) are read, so the cost of a merge is proportional to
+        ``test_list`` rather than to the whole job.
+
+        Tests which the job already has (by suite and name) are replaced, so
+        merging the same results again leaves the tree unchanged.
+
+        Returns the number of rows written.
+        """
+        # rows we insert reference the job and suites directly, so they must
+        # exist in the database first
+        db.session.flush()
 
-            # Create any leaves which do not exist yet
-            for test in tests:
-                testcase = tests_by_id[test.id]
+        replaced = self._remove_existing_tests(test_list)
+
+        testcase_rows, testcase_ids = self._get_testcase_rows(test_list)
+        if not testcase_rows:
+            return 0
+
+        test_tree = TestTree(test_list)
+        nodes_by_name = dict(
+            (node.name, node) for node, _ in test_tree.walk())
+
+        # every prefix of the new test ids (including the ids themselves),
+        # mapped to the first test beneath it
+        paths = {}
+        # the ids of the new tests directly beneath each prefix
+        new_tests = defaultdict(set)
+        for test in test_list:
+            sep = test.sep
+            parts = test.id.split(sep)
+            for idx in xrange(1, len(parts) + 1):
+                paths.setdefault(sep.join(parts[:idx]), test)
+            if len(parts) > 1:
+                new_tests[sep.join(parts[:-1])].add(test.id)
 
-                if test.id not in groups_by_id:
-                    leaf = self.create_test_leaf(test, branch, testcase)
+        path_children = defaultdict(list)
+        for name, test in paths.iteritems():
+            if test.sep in name:
+                path_children[name.rsplit(test.sep, 1)[0]].append(name)
 
-                    groups_by_id[leaf.name] = leaf
+        groups, leaves = self._get_existing_groups(paths)
+        num_leaf_rows, branches = self._get_existing_children(groups)
 
-                # if test.id not in agg_groups_by_id:
-                #     leaf = self.create_aggregate_test_leaf(test, agg_branch)
+        suite_ids = dict(
+            (name, self._get_suite_id(test)) for name, test in paths.iteritems())
+        for name, group in groups.iteritems():
+            for branch in branches[group.id]:
+                suite_ids.setdefault(branch.name, group.suite_id)
+        existing_tests = self._get_existing_tests(suite_ids)
 
-                #     agg_groups_by_id[leaf.name] = leaf
+        descendants = self._get_existing_descendants(dict(
+            (name, test) for name, test in paths.iteritems()
+            if name not in groups
+        ))
+
+        def has_descendants(name):
+            return bool(
+                path_children[name] or name in groups or descendants[name])
+
+        # recompute the leaves of every prefix, deepest first, in the same
+        # way as TestTree.add: the tests directly beneath it, plus itself if
+        # it's a test or any of its children has more than one leaf
+        num_leaves = {}
+        for name in sorted(paths, key=lambda n: n.count(paths[n].sep), reverse=True):
+            count = len(new_tests[name])
+            promoted = name in existing_tests or name in testcase_ids
+
+            group = groups.get(name)
+            if group is not None:
+                count += num_leaf_rows[group.id]
+                for branch in branches[group.id]:
+                    count += branch.name in existing_tests
+                    if branch.name not in paths and branch.num_leaves > 1:
+                        promoted = True
+
+            if any(num_leaves[c] > 1 for c in path_children[name]):
+                promoted = True
+
+            num_leaves[name] = count + int(promoted)
+
+        group_ids = dict((name, group.id) for name, group in groups.iteritems())
+        new_groups = sorted((
+            name for name in paths
+            if name not in groups and has_descendants(name) and num_leaves[name]
+        ), key=lambda n: n.count(paths[n].sep))
+        for name in new_groups:
+            group_ids[name] = uuid.uuid4()
+
+        def get_parent(name):
+            sep = paths[name].sep
+            if sep not in name:
+                return None
+            parent = name.rsplit(sep, 1)[0]
+            return parent if parent in group_ids else None
+
+        # update the counters and leaves of every existing group which the
+        # new tests fall beneath
+        for name, group in groups.iteritems():
+            values = {}
+
+            node = nodes_by_name.get(name)
+            if node is not None and node.num_tests:
+                values.update({
+                    TestGroup.num_tests: TestGroup.num_tests + node.num_tests,
+                    TestGroup.num_failed: TestGroup.num_failed + node.num_failed,
+                    TestGroup.duration: TestGroup.duration + node.duration,
+                    TestGroup.result: func.greatest(
+                        TestGroup.result, node.result.value),
+                })
+            if num_leaves[name] != group.num_leaves:
+                values[TestGroup.num_leaves] = num_leaves[name]
+
+            if values:
+                db.session.query(TestGroup).filter(
+                    TestGroup.id == group.id,
+                ).update(values, synchronize_session=False)
+
+        # a test which now has tests beneath it is no longer a leaf
+        stale_ids = [
+            leaf.id for name, leaf in leaves.iteritems() if has_descendants(name)
+        ]
+        if stale_ids:
+            db.session.execute(test_group_m2m_table.delete().where(
+                test_group_m2m_table.c.group_id.in_(stale_ids),
+            ))
+            TestGroup.query.filter(
+                TestGroup.id.in_(stale_ids),
+            ).delete(synchronize_session=False)
 
-                g_duration += testcase.duration
-                g_total += 1
-                if testcase.result == Result.failed:
-                    g_failed += 1
+        branch_rows = []
+        reparent_ids = defaultdict(list)
+        tree = []
+        folded = []
+        for name in new_groups:
+            test = paths[name]
+            node = nodes_by_name.get(name)
+            if node is None:
+                node = TestTreeNode(name, test.sep, suite=test.suite)
 
-                if branch.result:
-                    branch.result = max(branch.result, testcase.result)
-                elif testcase.result:
-                    branch.result = testcase.result
+            parent = get_parent(name)
+            row = self._get_branch_row(
+                node, group_ids[parent] if parent else None)
+            row['id'] = group_ids[name]
+            row['num_leaves'] = num_leaves[name]
+            branch_rows.append(row)
+            tree.append((name, parent))
+
+            folded.extend(self._fold_existing_descendants(
+                row, descendants[name], reparent_ids))
+
+        # tests named after a folded group are beneath the new group too, but
+        # aren't counted by the folded group itself
+        folded_tests = self._get_existing_tests(dict(
+            (group.name, group.suite_id) for _, group in folded))
+        for row, group in folded:
+            for test in folded_tests.get(group.name, ()):
+                row['num_tests'] += 1
+                row['num_failed'] += 1 if test.result == Result.failed else 0
+                row['duration'] += test.duration or 0
+                row['result'] = max(row['result'], test.result)
+
+        leaf_rows = []
+        link_rows = []
+        seen = set()
+        for test in test_list:
+            t_id, sep = test.id, test.sep
+            if t_id in seen or sep not in t_id or has_descendants(t_id):
+                continue
+            seen.add(t_id)
+
+            parent = t_id.rsplit(sep, 1)[0]
+            row = self._get_leaf_row(test, group_ids[parent])
+            leaf_rows.append(row)
+            tree.append((t_id, parent))
+
+            link_rows.append({
+                'group_id': row['id'],
+                'test_id': testcase_ids[t_id],
+            })
+
+        bulk_insert(TestCase.__table__, testcase_rows)
+        bulk_insert(TestGroup.__table__, branch_rows)
+        bulk_insert(TestGroup.__table__, leaf_rows)
+        bulk_insert(test_group_m2m_table, link_rows)
+
+        for parent_id, ids in reparent_ids.iteritems():
+            db.session.query(TestGroup).filter(
+                TestGroup.id.in_(ids),
+            ).update({
+                TestGroup.parent_id: parent_id,
+            }, synchronize_session=False)
+
+        self.save_aggregate_groups(tree)
+
+        # a replaced test may have been all that held up the result of the
+        # groups above it
+        self._update_results([
+            (suite_id, name) for (suite_id, name), result in replaced.iteritems()
+            if name not in nodes_by_name or result > nodes_by_name[name].result
+        ])
+
+        return len(testcase_rows) + len(branch_rows) + len(leaf_rows) + len(link_rows)
+
+    def _remove_existing_tests(self, test_list):
+        """
+        Delete the tests of ``test_list`` which the job already has, along
+        with their leaves, and take them out of the counters of the groups
+        above them (``num_leaves`` is left to ``merge`` to recompute).
+
+        Returns a mapping of ``(suite_id, name)`` => the worst result removed
+        from beneath each of those groups.
+        """
+        job = self.job
+
+        tests_by_key = dict(
+            ((self._get_suite_id(t), t.name_sha), t) for t in test_list)
+
+        removed = []
+        for idx in xrange(0, len(test_list), BULK_INSERT_BATCH_SIZE):
+            batch = test_list[idx:idx + BULK_INSERT_BATCH_SIZE]
+            removed.extend(
+                row for row in db.session.query(
+                    TestCase.id, TestCase.suite_id, TestCase.name_sha,
+                    TestCase.duration, TestCase.result,
+                ).filter(
+                    TestCase.job_id == job.id,
+                    TestCase.name_sha.in_([t.name_sha for t in batch]),
+                )
+                if (row.suite_id, row.name_sha) in tests_by_key
+            )
+        if not removed:
+            return {}
+
+        # (suite_id, name) => [num_tests, num_failed, duration, result]
+        deltas = {}
+        for row in removed:
+            test = tests_by_key[(row.suite_id, row.name_sha)]
+            parts = test.id.split(test.sep)
+            for idx in xrange(1, len(parts)):
+                delta = deltas.setdefault(
+                    (row.suite_id, test.sep.join(parts[:idx])),
+                    [0, 0, 0, Result.unknown])
+                delta[0] += 1
+                delta[1] += 1 if row.result == Result.failed else 0
+                delta[2] += row.duration or 0
+                delta[3] = max(delta[3], row.result)
+
+        removed_ids = [row.id for row in removed]
+        leaves = list(db.session.query(
+            TestGroup.id,
+        ).join(
+            test_group_m2m_table, test_group_m2m_table.c.group_id == TestGroup.id,
+        ).filter(
+            test_group_m2m_table.c.test_id.in_(removed_ids),
+            TestGroup.num_leaves == 0,
+        ))
+
+        db.session.execute(test_group_m2m_table.delete().where(
+            test_group_m2m_table.c.test_id.in_(removed_ids),
+        ))
+        if leaves:
+            TestGroup.query.filter(
+                TestGroup.id.in_([l.id for l in leaves]),
+            ).delete(synchronize_session=False)
+        TestCase.query.filter(
+            TestCase.id.in_(removed_ids),
+        ).delete(synchronize_session=False)
+
+        for (suite_id, name), delta in deltas.iteritems():
+            db.session.query(TestGroup).filter(
+                TestGroup.job_id == job.id,
+                TestGroup.suite_id == suite_id,
+                TestGroup.name_sha == sha1(name).hexdigest(),
+            ).update({
+                TestGroup.num_tests: TestGroup.num_tests - delta[0],
+                TestGroup.num_failed: TestGroup.num_failed - delta[1],
+                TestGroup.duration: TestGroup.duration - delta[2],
+            }, synchronize_session=False)
+
+        return dict((key, delta[3]) for key, delta in deltas.iteritems())
+
+    def _update_results(self, groups):
+        """
+        Recompute the result of each ``(suite_id, name)`` of ``groups`` from
+        the leaves beneath it.
+        """
+        leaf = aliased(TestGroup)
+        for suite_id, name in groups:
+            db.session.query(TestGroup).filter(
+                TestGroup.job_id == self.job.id,
+                TestGroup.suite_id == suite_id,
+                TestGroup.name_sha == sha1(name).hexdigest(),
+            ).update({
+                TestGroup.result: select([
+                    func.coalesce(func.max(leaf.result), Result.unknown.value),
+                ]).where(and_(
+                    leaf.job_id == self.job.id,
+                    leaf.suite_id == suite_id,
+                    leaf.num_leaves == 0,
+                    func.substr(leaf.name, 1, len(name) + 1).in_([
+                        name + '.', name + '/',
+                    ]),
+                )).as_scalar(),
+            }, synchronize_session=False)
+
+    def _get_existing_groups(self, paths):
+        """
+        Return the existing branches and leaves named by ``paths`` (a mapping
+        of name => test), each as a mapping of name => row.
+        """
+        branches = {}
+        leaves = {}
+
+        names = paths.keys()
+        for idx in xrange(0, len(names), BULK_INSERT_BATCH_SIZE):
+            batch = names[idx:idx + BULK_INSERT_BATCH_SIZE]
+            for group in db.session.query(
+                TestGroup.id, TestGroup.suite_id, TestGroup.name,
+                TestGroup.num_leaves,
+            ).filter(
+                TestGroup.job_id == self.job.id,
+                TestGroup.name_sha.in_([sha1(n).hexdigest() for n in batch]),
+            ):
+                test = paths.get(group.name)
+                if test is None or group.suite_id != self._get_suite_id(test):
+                    continue
+                if group.num_leaves:
+                    branches[group.name] = group
+                else:
+                    leaves[group.name] = group
+        return branches, leaves
+
+    def _get_existing_children(self, groups):
+        """
+        Return the number of leaves directly beneath each of ``groups``, along
+        with the branches directly beneath them, keyed by group id.
+        """
+        num_leaves = defaultdict(int)
+        branches = defaultdict(list)
+
+        group_ids = [g.id for g in groups.itervalues()]
+        for idx in xrange(0, len(group_ids), BULK_INSERT_BATCH_SIZE):
+            batch = group_ids[idx:idx + BULK_INSERT_BATCH_SIZE]
+
+            for parent_id, count in db.session.query(
+                TestGroup.parent_id, func.count(TestGroup.id),
+            ).filter(
+                TestGroup.parent_id.in_(batch),
+                TestGroup.num_leaves == 0,
+            ).group_by(TestGroup.parent_id):
+                num_leaves[parent_id] = count
+
+            for group in db.session.query(
+                TestGroup.parent_id, TestGroup.name, TestGroup.num_leaves,
+            ).filter(
+                TestGroup.parent_id.in_(batch),
+                TestGroup.num_leaves > 0,
+            ):
+                branches[group.parent_id].append(group)
+        return num_leaves, branches
+
+    def _get_existing_tests(self, suite_ids):
+        """
+        Return the existing tests whose ids are in ``suite_ids`` (a mapping of
+        test id => suite id), as a mapping of test id => [rows].
+        """
+        tests = defaultdict(list)
+
+        names = suite_ids.keys()
+        for idx in xrange(0, len(names), BULK_INSERT_BATCH_SIZE):
+            batch = names[idx:idx + BULK_INSERT_BATCH_SIZE]
+            for test in db.session.query(
+                TestCase.suite_id, TestCase.package, TestCase.name,
+                TestCase.duration, TestCase.result,
+            ).filter(
+                TestCase.job_id == self.job.id,
+                TestCase.name_sha.in_([sha1(n).hexdigest() for n in batch]),
+            ):
+                if test.package:
+                    t_id = '%s.%s' % (test.package, test.name)
                 else:
-                    branch.result = Result.unknown
+                    t_id = test.name
+                if t_id in suite_ids and suite_ids[t_id] == test.suite_id:
+                    tests[t_id].append(test)
+        return tests
+
+    def _get_existing_descendants(self, paths):
+        """
+        Return the existing branches beneath each of ``paths`` (a mapping of
+        name => test), as a mapping of name => [rows].
+        """
+        descendants = defaultdict(list)
+
+        names = paths.keys()
+        for idx in xrange(0, len(names), BULK_INSERT_BATCH_SIZE):
+            batch = names[idx:idx + BULK_INSERT_BATCH_SIZE]
 
-            branch.duration = g_duration
-            branch.num_failed = g_failed
-            branch.num_tests = g_total
+            # prefixes are matched by length so that each is a single lookup
+            names_by_prefix = {}
+            prefixes_by_length = defaultdict(list)
+            for name in batch:
+                prefix = name + paths[name].sep
+                names_by_prefix[prefix] = name
+                prefixes_by_length[len(prefix)].append(prefix)
 
-            db.session.add(branch)
+            for group in db.session.query(
+                TestGroup.id, TestGroup.suite_id, TestGroup.name,
+                TestGroup.num_tests, TestGroup.num_failed,
+                TestGroup.duration, TestGroup.result,
+            ).filter(
+                TestGroup.job_id == self.job.id,
+                TestGroup.num_leaves > 0,
+                or_(*[
+                    func.substr(TestGroup.name, 1, length).in_(prefixes)
+                    for length, prefixes in prefixes_by_length.iteritems()
+                ]),
+            ):
+                for length in prefixes_by_length:
+                    name = names_by_prefix.get(group.name[:length])
+                    if name is None:
+                        continue
+                    if group.suite_id == self._get_suite_id(paths[name]):
+                        descendants[name].append(group)
+        return descendants
+
+    def _fold_existing_descendants(self, row, descendants, reparent_ids):
+        """
+        A group created by ``merge`` may sit above groups which were created
+        by an earlier merge (when it was collapsed). Fold their counters into
+        the new group's ``row``, and record those directly beneath it in
+        ``reparent_ids``.
+
+        Returns ``(row, group)`` for each group which was folded.
+        """
+        name = row['name']
+        names = set(d.name for d in descendants)
+
+        folded = []
+        for group in descendants:
+            sep = group.name[len(name)]
+            # only the outermost existing groups below this one are counted,
+            # as they already include everything below them
+            parent_name = group.name.rsplit(sep, 1)[0]
+            if any(n in names for n in self._iter_prefixes(
+                    parent_name, sep, name)):
+                continue
+
+            row['num_tests'] += group.num_tests
+            row['num_failed'] += group.num_failed
+            row['duration'] += group.duration or 0
+            row['result'] = max(row['result'], group.result)
+            folded.append((row, group))
+
+            if parent_name == name:
+                reparent_ids[row['id']].append(group.id)
+        return folded
+
+    def _iter_prefixes(self, name, sep, stop):
+        """
+        Yield ``name`` and each of its ancestors, stopping before ``stop``.
+        """
+        while name != stop and name.startswith(stop + sep):
+            yield name
+            name = name.rsplit(sep, 1)[0]
+
+    def _get_suite_id(self, obj):
+        """
+        Return the id of the suite of a TestResult or TestTreeNode.
+        """
+        return obj.suite.id if obj.suite else None
+
+    def _get_testcase_rows(self, test_list):
+        job = self.job
+
+        testcase_rows = []
+        testcase_ids = {}
+        for test in test_list:
+            testcase_id = uuid.uuid4()
+            testcase_rows.append({
+                'id': testcase_id,
+                'job_id': job.id,
+                'project_id': job.project_id,
+                'suite_id': test.suite.id if test.suite else None,
+                'label_sha': test.name_sha,
+                'name': test.name,
+                'package': test.package,
+                'duration': test.duration,
+                'message': test.message,
+                'result': test.result,
+                'date_created': test.date_created,
+            })
+            testcase_ids[test.id] = testcase_id
+        return testcase_rows, testcase_ids
+
+    def _get_branch_row(self, node, parent_id):
+        job = self.job
+
+        return {
+            'id': uuid.uuid4(),
+            'job_id': job.id,
+            'project_id': job.project_id,
+            'suite_id': node.suite.id if node.suite else None,
+            'parent_id': parent_id,
+            'name_sha': sha1(node.name).hexdigest(),
+            'name': node.name,
+            'duration': node.duration,
+            'result': node.result,
+            'num_tests': node.num_tests,
+            'num_failed': node.num_failed,
+            'num_leaves': node.num_leaves,
+            'date_created': datetime.utcnow(),
+        }
+
+    def _get_leaf_row(self, test, parent_id):
+        job = self.job
+
+        return {
+            'id': uuid.uuid4(),
+            'job_id': job.id,
+            'project_id': job.project_id,
+            'suite_id': test.suite.id if test.suite else None,
+            'parent_id': parent_id,
+            'name_sha': test.name_sha,
+            'name': test.id,
+            'duration': test.duration,
+            'result': test.result,
+            'num_tests': 1,
+            'num_failed': 1 if test.result == Result.failed else 0,
+            'num_leaves': 0,
+            'date_created': datetime.utcnow(),
+        }
@@ -0,0 +1,587 @@
+"""
+Storage for the live state of tracked tasks.
+
+By default state lives in the ``task`` table. Setting ``TASK_STATE_BACKEND``
+to ``'redis'`` keeps live state (status, retries and parent/child membership)
+in Redis instead, and Postgres only receives periodic write-behind snapshots
+(see ``snapshot_task_states`` and ``reconcile_task_states``).
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+
+from datetime import datetime
+from flask import current_app
+from redis.exceptions import ResponseError
+from sqlalchemy.sql import bindparam, text
+from uuid import UUID, uuid4
+
+from changes.config import db, redis
+from changes.constants import Result, Status
+from changes.db.types.enum import Enum
+from changes.db.types.guid import GUID
+from changes.db.utils import get_or_create, try_create
+from changes.models import Task
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# the number of tasks written to Postgres per snapshot query
+SNAPSHOT_BATCH_SIZE = 500
+
+# Expires any stale children and counts the remaining pending ones in a single
+# statement. The outer query sees the table as it was before the update, so
+# expired rows are excluded from it explicitly.
+CHECK_CHILDREN_SQL = """
+WITH expired AS (
+    UPDATE task
+    SET status = :finished, result = :aborted, date_modified = :date_modified
+    WHERE parent_id = :parent_id
+    AND status != :finished
+    AND date_modified < :expire_before
+    RETURNING 1
+)
+SELECT (SELECT count(*) FROM expired),
+       count(*),
+       count(CASE WHEN date_modified < :run_before THEN 1 END)
+FROM task
+WHERE parent_id = :parent_id
+AND status != :finished
+AND date_modified >= :expire_before
+"""
+
+
+def format_id(value):
+    if value is None:
+        return ''
+    if isinstance(value, UUID):
+        return value.hex
+    return UUID(value).hex
+
+
+class TaskStore(object):
+    """
+    Tracks the state of Task's.
+
+    Tasks are identified by ``(task_name, parent_id, task_id)`` and are
+    returned as (possibly transient) ``Task`` instances.
+    """
+    def get_or_create(self, task_name, parent_id, task_id, data):
+        raise NotImplementedError
+
+    def create(self, task_name, parent_id, task_id, data):
+        raise NotImplementedError
+
+    def mark_in_progress(self, task_name, parent_id, task_id, retry=False):
+        raise NotImplementedError
+
+    def mark_finished(self, task_name, parent_id, task_id, date_started,
+                      date_finished):
+        raise NotImplementedError
+
+    def get_children(self, parent_id):
+        raise NotImplementedError
+
+    def check_children(self, parent_id, run_before, expire_before,
+                       date_modified):
+        """
+        Expire any unfinished children which haven't checked in since
+        ``expire_before`` and find the ones which need to be requeued as they
+        haven't checked in since ``run_before``.
+
+        Returns a tuple of ``(num_expired, num_pending, need_run)``.
+        """
+        need_expire = []
+        need_run = []
+        num_pending = 0
+
+        for task in self.get_children(parent_id):
+            if task.status == Status.finished:
+                continue
+
+            if task.date_modified < expire_before:
+                need_expire.append(task)
+                continue
+
+            num_pending += 1
+
+            if task.date_modified < run_before and 'kwargs' in task.data:
+                need_run.append(task)
+
+        if need_expire:
+            self.expire(need_expire, date_modified)
+
+        return len(need_expire), num_pending, need_run
+
+    def find(self, task_id):
+        """
+        Return all tasks with the given ``task_id`` (regardless of their name
+        or parent).
+        """
+        raise NotImplementedError
+
+    def expire(self, task_list, date_modified):
+        """
+        Mark the given tasks as aborted.
+        """
+        raise NotImplementedError
+
+    def touch(self, task_list, date_modified):
+        """
+        Record that the given tasks have been requeued.
+        """
+        raise NotImplementedError
+
+    def snapshot(self):
+        """
+        Persist any pending state to the database.
+        """
+
+    def reconcile(self):
+        """
+        Resolve any differences between this store and the database.
+        """
+
+
+class DatabaseTaskStore(TaskStore):
+    def _filter(self, task_name, parent_id, task_id):
+        return Task.query.filter(
+            Task.task_name == task_name,
+            Task.parent_id == parent_id,
+            Task.task_id == task_id,
+        )
+
+    def get_or_create(self, task_name, parent_id, task_id, data):
+        return get_or_create(Task, where={
+            'task_name': task_name,
+            'parent_id': parent_id,
+            'task_id': task_id,
+        }, defaults={
+            'data': data,
+            'status': Status.queued,
+        })
+
+    def create(self, task_name, parent_id, task_id, data):
+        return try_create(Task, where={
+            'task_name': task_name,
+            'parent_id': parent_id,
+            'task_id': task_id,
+            'status': Status.queued,
+            'data': data,
+        })
+
+    def mark_in_progress(self, task_name, parent_id, task_id, retry=False):
+        values = {
+            Task.date_modified: datetime.utcnow(),
+            Task.status: Status.in_progress,
+        }
+        if retry:
+            values[Task.num_retries] = Task.num_retries + 1
+
+        self._filter(task_name, parent_id, task_id).update(
+            values, synchronize_session=False)
+
+    def mark_finished(self, task_name, parent_id, task_id, date_started,
+                      date_finished):
+        self._filter(task_name, parent_id, task_id).update({
+            Task.date_started: date_started,
+            Task.date_finished: date_finished,
+            Task.date_modified: date_finished,
+            Task.status: Status.finished,
+        }, synchronize_session=False)
+
+    def get_children(self, parent_id):
+        return list(Task.query.filter(
+            Task.parent_id == parent_id,
+        ))
+
+    def check_children(self, parent_id, run_before, expire_before,
+                       date_modified):
+        # rather than loading every child, let Postgres do the counting and
+        # only fetch the (usually few) rows which need requeueing
+        # (raw statements don't autoflush like ORM queries do)
+        db.session.flush()
+
+        query = text(CHECK_CHILDREN_SQL).bindparams(
+            bindparam('parent_id', parent_id, type_=GUID),
+            bindparam('finished', Status.finished, type_=Enum(Status)),
+            bindparam('aborted', Result.aborted, type_=Enum(Result)),
+            bindparam('date_modified', date_modified),
+            bindparam('run_before', run_before),
+            bindparam('expire_before', expire_before),
+        )
+        num_expired, num_pending, num_stale = db.session.execute(query).fetchone()
+
+        if num_stale:
+            need_run = [
+                t for t in Task.query.filter(
+                    Task.parent_id == parent_id,
+                    Task.status != Status.finished,
+                    Task.date_modified < run_before,
+                    Task.date_modified >= expire_before,
+                )
+                if 'kwargs' in t.data
+            ]
+        else:
+            need_run = []
+
+        return num_expired, num_pending, need_run
+
+    def find(self, task_id):
+        return list(Task.query.filter(
+            Task.task_id == task_id,
+        ))
+
+    def expire(self, task_list, date_modified):
+        Task.query.filter(
+            Task.id.in_([t.id for t in task_list]),
+        ).update({
+            Task.date_modified: date_modified,
+            Task.status: Status.finished,
+            Task.result: Result.aborted,
+        }, synchronize_session=False)
+
+    def touch(self, task_list, date_modified):
+        Task.query.filter(
+            Task.id.in_([t.id for t in task_list]),
+        ).update({
+            Task.date_modified: date_modified,
+        }, synchronize_session=False)
+
+
+class RedisTaskStore(TaskStore):
+    """
+    Keeps live task state in Redis:
+
+    - ``task:<name>:<parent_id>:<task_id>`` is a hash of the task's columns
+    - ``task:children:<parent_id>`` is the set of ``<name>:<task_id>``
+      children of a task
+    - ``task:ids:<task_id>`` is the set of task keys sharing a task_id
+    - ``task:dirty`` is the set of task keys which have changed since the last
+      snapshot
+    """
+    DIRTY_KEY = 'task:dirty'
+
+    def __init__(self, ttl=86400):
+        # finished tasks are dropped from Redis after ``ttl`` seconds, by
+        # which point they will have been snapshotted
+        self.ttl = ttl
+        self.logger = logging.getLogger('changes.queue.store')
+
+    def _key(self, task_name, parent_id, task_id):
+        return 'task:{0}:{1}:{2}'.format(
+            task_name, format_id(parent_id), format_id(task_id))
+
+    def _children_key(self, parent_id):
+        return 'task:children:{0}'.format(format_id(parent_id))
+
+    def _ids_key(self, task_id):
+        return 'task:ids:{0}'.format(format_id(task_id))
+
+    def _to_hash(self, task):
+        values = {
+            'task_name': task.task_name,
+            'parent_id': format_id(task.parent_id),
+            'task_id': format_id(task.task_id),
+            'status': task.status.value,
+            'result': task.result.value,
+            'num_retries': task.num_retries or 0,
+            # data is a MutableDict (rather than a dict) once it's been set
+            'data': json.dumps(dict(task.data or {})),
+        }
+        for name in ('date_started', 'date_finished', 'date_created', 'date_modified'):
+            value = getattr(task, name)
+            values[name] = value.strftime(DATE_FORMAT) if value else ''
+        return values
+
+    def _from_hash(self, values):
+        # a task which is still being created only has its identity field
+        if not values or 'task_name' not in values:
+            return None
+
+        task = Task(
+            task_name=values['task_name'],
+            parent_id=UUID(values['parent_id']) if values['parent_id'] else None,
+            task_id=UUID(values['task_id']),
+            status=Status(int(values['status'])),
+            result=Result(int(values['result'])),
+            num_retries=int(values['num_retries']),
+            data=json.loads(values['data']),
+        )
+        for name in ('date_started', 'date_finished', 'date_created', 'date_modified'):
+            value = values.get(name)
+            setattr(task, name, datetime.strptime(value, DATE_FORMAT) if value else None)
+        return task
+
+    def _save(self, pipe, task):
+        key = self._key(task.task_name, task.parent_id, task.task_id)
+        children_key = self._children_key(task.parent_id)
+        pipe.hmset(key, self._to_hash(task))
+        pipe.sadd(children_key, '{0}:{1}'.format(
+            task.task_name, format_id(task.task_id)))
+        pipe.expire(children_key, self.ttl)
+        pipe.sadd(self._ids_key(task.task_id), key)
+        pipe.expire(self._ids_key(task.task_id), self.ttl)
+        pipe.sadd(self.DIRTY_KEY, key)
+
+    def _update(self, task_name, parent_id, task_id, values, incr=None):
+        key = self._key(task_name, parent_id, task_id)
+        if not redis.exists(key):
+            # fall back to the last snapshot (e.g. if Redis was flushed)
+            if self._load(task_name, parent_id, task_id) is None:
+                self.logger.warning('Unable to find task %s', key)
+                return
+
+        for name, value in values.items():
+            if isinstance(value, datetime):
+                values[name] = value.strftime(DATE_FORMAT)
+            elif isinstance(value, (Status, Result)):
+                values[name] = value.value
+
+        pipe = redis.pipeline()
+        pipe.hmset(key, values)
+        for name, amount in (incr or {}).iteritems():
+            pipe.hincrby(key, name, amount)
+        pipe.sadd(self.DIRTY_KEY, key)
+        if values.get('status') == Status.finished.value:
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def _load(self, task_name, parent_id, task_id):
+        task = Task.query.filter(
+            Task.task_name == task_name,
+            Task.parent_id == parent_id,
+            Task.task_id == task_id,
+        ).first()
+        if task is None:
+            return None
+
+        pipe = redis.pipeline()
+        self._save(pipe, task)
+        pipe.execute()
+        return task
+
+    def _new_task(self, task_name, parent_id, task_id, data):
+        return Task(
+            task_name=task_name,
+            parent_id=UUID(format_id(parent_id)) if parent_id else None,
+            task_id=UUID(format_id(task_id)),
+            status=Status.queued,
+            num_retries=0,
+            data=data,
+        )
+
+    def get(self, task_name, parent_id, task_id):
+        return self._from_hash(redis.hgetall(
+            self._key(task_name, parent_id, task_id)))
+
+    def get_or_create(self, task_name, parent_id, task_id, data):
+        task = self.get(task_name, parent_id, task_id)
+        if task is not None:
+            return task, False
+
+        task = self._load(task_name, parent_id, task_id)
+        if task is not None:
+            return task, False
+
+        task = self.create(task_name, parent_id, task_id, data)
+        if task is not None:
+            return task, True
+
+        # another process created the task concurrently, and may not have
+        # written all of it yet
+        task = self.get(task_name, parent_id, task_id)
+        if task is None:
+            task = self._new_task(task_name, parent_id, task_id, data)
+        return task, False
+
+    def create(self, task_name, parent_id, task_id, data):
+        task = self._new_task(task_name, parent_id, task_id, data)
+
+        key = self._key(task_name, parent_id, task_id)
+        # HSETNX on the identity field guards against concurrent creation
+        if not redis.hsetnx(key, 'task_id', format_id(task_id)):
+            return None
+
+        pipe = redis.pipeline()
+        self._save(pipe, task)
+        pipe.execute()
+        return task
+
+    def mark_in_progress(self, task_name, parent_id, task_id, retry=False):
+        self._update(task_name, parent_id, task_id, {
+            'date_modified': datetime.utcnow(),
+            'status': Status.in_progress,
+        }, incr={'num_retries': 1} if retry else None)
+
+    def mark_finished(self, task_name, parent_id, task_id, date_started,
+                      date_finished):
+        self._update(task_name, parent_id, task_id, {
+            'date_started': date_started,
+            'date_finished': date_finished,
+            'date_modified': date_finished,
+            'status': Status.finished,
+        })
+
+    def get_children(self, parent_id):
+        members = redis.smembers(self._children_key(parent_id))
+        if not members:
+            return []
+
+        pipe = redis.pipeline()
+        for member in members:
+            task_name, task_id = member.rsplit(':', 1)
+            pipe.hgetall(self._key(task_name, parent_id, task_id))
+        return filter(None, map(self._from_hash, pipe.execute()))
+
+    def find(self, task_id):
+        keys = redis.smembers(self._ids_key(task_id))
+        if not keys:
+            # fall back to the last snapshot (e.g. if Redis was flushed)
+            return list(Task.query.filter(
+                Task.task_id == task_id,
+            ))
+
+        pipe = redis.pipeline()
+        for key in keys:
+            pipe.hgetall(key)
+        return filter(None, map(self._from_hash, pipe.execute()))
+
+    def expire(self, task_list, date_modified):
+        for task in task_list:
+            self._update(task.task_name, task.parent_id, task.task_id, {
+                'date_modified': date_modified,
+                'status': Status.finished,
+                'result': Result.aborted,
+            })
+
+    def touch(self, task_list, date_modified):
+        for task in task_list:
+            self._update(task.task_name, task.parent_id, task.task_id, {
+                'date_modified': date_modified,
+            })
+
+    def snapshot(self):
+        """
+        Write every task which has changed since the last snapshot to the
+        ``task`` table.
+
+        Returns the number of tasks written.
+        """
+        # move the dirty set aside so that changes made while we're writing
+        # are picked up by the next snapshot rather than lost
+        pending_key = '{0}:{1}'.format(self.DIRTY_KEY, uuid4().hex)
+        try:
+            redis.rename(self.DIRTY_KEY, pending_key)
+        except ResponseError:
+            # the dirty set does not exist, so there's nothing to do
+            return 0
+
+        keys = list(redis.smembers(pending_key))
+        num_written = 0
+        for idx in xrange(0, len(keys), SNAPSHOT_BATCH_SIZE):
+            pipe = redis.pipeline()
+            for key in keys[idx:idx + SNAPSHOT_BATCH_SIZE]:
+                pipe.hgetall(key)
+            task_list = filter(None, map(self._from_hash, pipe.execute()))
+            num_written += self._write(task_list)
+
+        redis.delete(pending_key)
+        return num_written
+
+    def _write(self, task_list):
+        if not task_list:
+            return 0
+
+        existing = dict(
+            ((t.task_name, t.parent_id, t.task_id), t)
+            for t in Task.query.filter(
+                Task.task_id.in_([t.task_id for t in task_list]),
+            )
+        )
+
+        for task in task_list:
+            instance = existing.get((task.task_name, task.parent_id, task.task_id))
+            if instance is None:
+                db.session.add(task)
+                continue
+
+            for name in ('status', 'result', 'num_retries', 'data', 'date_started',
+                         'date_finished', 'date_modified'):
+                setattr(instance, name, getattr(task, name))
+            db.session.add(instance)
+
+        db.session.commit()
+        return len(task_list)
+
+    def reconcile(self):
+        """
+        Compare unfinished tasks in the database with Redis:
+
+        - tasks missing from Redis (e.g. after a Redis restart) are loaded from
+          the database
+        - tasks which differ and are not pending a snapshot are queued for one,
+          as Redis holds the authoritative state
+
+        Returns a tuple of ``(num_loaded, num_resynced)``.
+        """
+        num_loaded, num_resynced = 0, 0
+
+        task_list = list(Task.query.filter(
+            Task.status != Status.finished,
+        ))
+        if not task_list:
+            return num_loaded, num_resynced
+
+        keys = [self._key(t.task_name, t.parent_id, t.task_id) for t in task_list]
+
+        pipe = redis.pipeline()
+        for key in keys:
+            pipe.hgetall(key)
+            pipe.sismember(self.DIRTY_KEY, key)
+        results = pipe.execute()
+
+        pipe = redis.pipeline()
+        for task, key, values, is_dirty in zip(task_list, keys, results[::2], results[1::2]):
+            if not values:
+                self._save(pipe, task)
+                num_loaded += 1
+                continue
+
+            if is_dirty:
+                continue
+
+            current = self._from_hash(values)
+            if (current.status, current.result, current.num_retries) != \
+                    (task.status, task.result, task.num_retries):
+                pipe.sadd(self.DIRTY_KEY, key)
+                num_resynced += 1
+        pipe.execute()
+
+        if num_loaded or num_resynced:
+            self.logger.warning(
+                'Reconciled task state (%d loaded, %d resynced)',
+                num_loaded, num_resynced)
+
+        return num_loaded, num_resynced
+
+
+TASK_STORES = {
+    'database': DatabaseTaskStore,
+    'redis': RedisTaskStore,
+}
+
+
+def get_task_store(app=None):
+    """
+    Return the TaskStore configured by ``TASK_STATE_BACKEND``.
+    """
+    if app is None:
+        app = current_app
+
+    store = app.extensions.get('task-store')
+    if store is None:
+        store_cls = TASK_STORES[app.config['TASK_STATE_BACKEND']]
+        store = app.extensions['task-store'] = store_cls(
+            **app.config['TASK_STATE_OPTIONS'])
+    return store
@@ -3,18 +3,40 @@ from __future__ import absolute_import
 import logging
 
 from datetime import datetime, timedelta
+from flask import current_app
 from threading import local, Lock
+from uuid import uuid4
 
-from changes.config import db, queue
-from changes.constants import Result, Status
-from changes.db.utils import try_create, get_or_create
-from changes.models import Task
+from changes.config import db, queue, redis
+from changes.constants import Status
+from changes.queue.store import format_id, get_task_store
 from changes.utils.locking import lock
 
 
 RETRY_COUNTDOWN = 60
 CONTINUE_COUNTDOWN = 5
 
+# tasks which are only waiting on their children are woken up as soon as a
+# child finishes, so they only need to poll as a safety net
+WAIT_COUNTDOWN = 60
+WAKEUP_COUNTDOWN = 1
+
+# collapse wakeups from children which finish at (roughly) the same time into
+# a single run of the parent
+WAKEUP_DEBOUNCE = 5
+
+# continuations and wakeups are enqueued with a new token, and runs holding
+# anything but the latest token of their task are dropped, so waking a task up
+# replaces its next run rather than starting another chain of runs
+TOKEN_TTL = 86400
+
+# running tasks poll again after this fraction of their expected remaining
+# time (bounded by POLL_COUNTDOWN_MIN and POLL_COUNTDOWN_MAX)
+POLL_REMAINING_RATIO = 0.25
+
+POLL_STATS_KEY = 'poll-stats'
+POLL_STATS_TTL = 86400
+
 RUN_TIMEOUT = timedelta(minutes=5)
 EXPIRE_TIMEOUT = timedelta(minutes=30)
 
@@ -25,14 +47,74 @@ def needs_requeued(task):
     return task.date_modified < run_datetime
 
 
-def needs_expired(task):
-    current_datetime = datetime.utcnow()
-    expire_datetime = current_datetime - EXPIRE_TIMEOUT
-    return task.date_modified < expire_datetime
+def get_poll_countdown(date_started, expected_duration):
+    """
+    Return the number of seconds until a running task should poll again.
+
+    Tasks poll sparsely while they're far from their expected finish, and
+    densely as they approach (or overrun) it. ``expected_duration`` is in
+    milliseconds, matching ``avg_build_time``.
+    """
+    min_countdown = current_app.config.get('POLL_COUNTDOWN_MIN', CONTINUE_COUNTDOWN)
+    max_countdown = current_app.config.get('POLL_COUNTDOWN_MAX', WAIT_COUNTDOWN)
+
+    if not (date_started and expected_duration):
+        return min_countdown
+
+    elapsed = (datetime.utcnow() - date_started).total_seconds()
+    remaining = expected_duration / 1000.0 - elapsed
+
+    countdown = int(remaining * POLL_REMAINING_RATIO)
+    return max(min_countdown, min(max_countdown, countdown))
+
+
+def record_poll(build_id, countdown):
+    """
+    Record a poll of the build's backend, along with how many polls a fixed
+    CONTINUE_COUNTDOWN schedule would have needed over the same period.
+    """
+    key = '{0}:{1}'.format(POLL_STATS_KEY, format_id(build_id))
+    try:
+        pipe = redis.pipeline()
+        pipe.hincrby(key, 'polls', 1)
+        pipe.hincrbyfloat(key, 'baseline', float(countdown) / CONTINUE_COUNTDOWN)
+        pipe.expire(key, POLL_STATS_TTL)
+        pipe.execute()
+    except Exception as exc:
+        logging.getLogger('jobs').exception(unicode(exc))
+
+
+def flush_poll_stats(build_id):
+    """
+    Add the poll counts of a finished build to the global totals (the
+    ``poll-stats`` hash), returning ``(num_polls, num_saved)``.
+    """
+    key = '{0}:{1}'.format(POLL_STATS_KEY, format_id(build_id))
+    try:
+        pipe = redis.pipeline()
+        pipe.hgetall(key)
+        pipe.delete(key)
+        values = pipe.execute()[0]
+
+        num_polls = int(values.get('polls', 0))
+        num_saved = max(int(round(float(values.get('baseline', 0)))) - num_polls, 0)
+
+        pipe = redis.pipeline()
+        pipe.hincrby(POLL_STATS_KEY, 'builds', 1)
+        pipe.hincrby(POLL_STATS_KEY, 'polls', num_polls)
+        pipe.hincrby(POLL_STATS_KEY, 'saved', num_saved)
+        pipe.execute()
+    except Exception as exc:
+        logging.getLogger('jobs').exception(unicode(exc))
+        return 0, 0
+
+    return num_polls, num_saved
 
 
 class NotFinished(Exception):
-    pass
+    def __init__(self, countdown=None):
+        Exception.__init__(self)
+        self.countdown = countdown
 
 
 class TrackedTask(local):
@@ -48,6 +130,10 @@ class TrackedTask(local):
     >>>        raise func.NotFinished
     >>>
     >>>    elif random.randint(0, 1) == 1:
+    >>>        # wait on children, which will wake us up when they finish
+    >>>        raise func.NotFinished(countdown=WAIT_COUNTDOWN)
+    >>>
+    >>>    elif random.randint(0, 1) == 1:
     >>>        # cause an exception to retry
     >>>        raise Exception
     >>>
@@ -63,6 +149,7 @@ class TrackedTask(local):
         self.task_name = func.__name__
         self.parent_id = None
         self.task_id = None
+        self.token = None
         self.lock = Lock()
         self.logger = logging.getLogger('jobs.{0}'.format(self.task_name))
 
@@ -72,29 +159,53 @@ class TrackedTask(local):
         self.__code__ = getattr(func, '__code__', None)
 
     def __call__(self, **kwargs):
-        with self.lock:
+        # the lock is per thread, so it's only ever held here when a child
+        # running eagerly (i.e. in this thread) wakes us up, in which case we
+        # notice it finished once it returns
+        if not self.lock.acquire(False):
+            self.logger.info(
+                'Dropping nested run: %s %s', self.task_name, kwargs.get('task_id'))
+            return
+
+        try:
             self._run(kwargs)
+        finally:
+            self.lock.release()
 
     def _run(self, kwargs):
         self.task_id = kwargs.pop('task_id', None)
+        token = kwargs.pop('task_token', None)
         if not self.task_id:
             self.logger.warning('Missing task_id for job: %r', kwargs)
             self.func(**kwargs)
             return
 
+        if self._is_superseded(token):
+            self.logger.info(
+                'Dropping superseded run: %s %s', self.task_name, self.task_id)
+            self.task_id = None
+            return
+
         self.parent_id = kwargs.pop('parent_task_id', None)
         self.kwargs = kwargs
 
         date_started = datetime.utcnow()
 
+        self._clear_wakeup()
+
+        # the latest token of this task when the run started, which is our own
+        # unless we were enqueued without one (e.g. on our first run), so that
+        # _continue can tell whether a child has woken us up since
+        self.token = token or self._get_token(self.task_id)
+
         try:
             self.func(**kwargs)
 
-        except NotFinished:
+        except NotFinished as exc:
             self.logger.info(
                 'Task marked as not finished: %s %s', self.task_name, self.task_id)
 
-            self._continue(kwargs)
+            self._continue(kwargs, countdown=exc.countdown)
 
         except Exception as exc:
             db.session.rollback()
@@ -111,55 +222,134 @@ class TrackedTask(local):
             date_finished = datetime.utcnow()
 
             try:
-                self._update({
-                    Task.date_started: date_started,
-                    Task.date_finished: date_finished,
-                    Task.date_modified: date_finished,
-                    Task.status: Status.finished,
-                })
+                self.store.mark_finished(
+                    self.task_name, self.parent_id, self.task_id,
+                    date_started=date_started,
+                    date_finished=date_finished,
+                )
             except Exception as exc:
                 self.logger.exception(unicode(exc))
                 raise
 
             db.session.commit()
+
+            self._wake_parent()
         finally:
             db.session.expire_all()
 
             self.task_id = None
             self.parent_id = None
+            self.token = None
             self.kwargs = kwargs
 
-    def _update(self, kwargs):
-        """
-        Update's the state of this Task.
-
-        >>> task._update(status=Status.finished)
-        """
-        assert self.task_id
+    @property
+    def store(self):
+        return get_task_store()
 
-        Task.query.filter(
-            Task.task_name == self.task_name,
-            Task.parent_id == self.parent_id,
-            Task.task_id == self.task_id,
-        ).update(kwargs, synchronize_session=False)
+    def _continue(self, kwargs, countdown=None):
+        if countdown is None:
+            countdown = CONTINUE_COUNTDOWN
 
-    def _continue(self, kwargs):
         kwargs['task_id'] = self.task_id
         kwargs['parent_task_id'] = self.parent_id
 
-        self._update({
-            Task.date_modified: datetime.utcnow(),
-            Task.status: Status.in_progress,
-        })
+        self.store.mark_in_progress(
+            self.task_name, self.parent_id, self.task_id)
 
         db.session.commit()
 
+        # a child which finished while we were running has already replaced
+        # our next run, so make sure we don't wait out the whole countdown
+        if self._get_token(self.task_id) not in (None, self.token):
+            countdown = min(countdown, WAKEUP_COUNTDOWN)
+
+        self._schedule(self.task_name, kwargs, countdown)
+
+    def _token_key(self, task_id):
+        return 'task:token:{0}'.format(format_id(task_id))
+
+    def _is_superseded(self, token):
+        """
+        Return whether a newer run of the current task has been scheduled
+        since the run holding ``token``.
+        """
+        if token is None:
+            return False
+
+        # an expired token never holds up a run
+        current = self._get_token(self.task_id)
+        return current is not None and current != token
+
+    def _get_token(self, task_id):
+        try:
+            return redis.get(self._token_key(task_id))
+        except Exception as exc:
+            self.logger.exception(unicode(exc))
+            return None
+
+    def _schedule(self, task_name, kwargs, countdown):
+        """
+        Enqueue a run of the task ``kwargs['task_id']`` which supersedes any
+        run of it that's already scheduled.
+        """
+        token = uuid4().hex
+        try:
+            redis.set(self._token_key(kwargs['task_id']), token, ex=TOKEN_TTL)
+        except Exception as exc:
+            self.logger.exception(unicode(exc))
+        else:
+            kwargs = dict(kwargs, task_token=token)
+
         queue.delay(
-            self.task_name,
+            task_name,
             kwargs=kwargs,
-            countdown=CONTINUE_COUNTDOWN,
+            countdown=countdown,
         )
 
+    def _wakeup_key(self, task_id):
+        return 'task:wakeup:{0}'.format(format_id(task_id))
+
+    def _clear_wakeup(self):
+        try:
+            redis.delete(self._wakeup_key(self.task_id))
+        except Exception as exc:
+            self.logger.exception(unicode(exc))
+
+    def _wake_parent(self):
+        """
+        Enqueue the parent of this task so it notices the child finishing
+        without waiting for its next poll. The wakeup replaces the run which
+        the parent had already scheduled.
+        """
+        if not self.parent_id:
+            return
+
+        try:
+            pipe = redis.pipeline()
+            pipe.setnx(self._wakeup_key(self.parent_id), '')
+            pipe.expire(self._wakeup_key(self.parent_id), WAKEUP_DEBOUNCE)
+            if not pipe.execute()[0]:
+                return
+
+            for task in self.store.find(self.parent_id):
+                if task.status == Status.finished:
+                    continue
+
+                if 'kwargs' not in task.data:
+                    continue
+
+                parent_kwargs = task.data['kwargs'].copy()
+                parent_kwargs['task_id'] = task.task_id.hex
+                if task.parent_id:
+                    parent_kwargs['parent_task_id'] = task.parent_id.hex
+                else:
+                    parent_kwargs['parent_task_id'] = None
+
+                self._schedule(task.task_name, parent_kwargs, WAKEUP_COUNTDOWN)
+        except Exception as exc:
+            # the parent will still notice on its next poll
+            self.logger.exception(unicode(exc))
+
     def _retry(self):
         """
         Retry this task and update it's state.
@@ -169,11 +359,8 @@ class TrackedTask(local):
         # TODO(dcramer): this needs to handle too-many-retries itself
         assert self.task_id
 
-        self._update({
-            Task.date_modified: datetime.utcnow(),
-            Task.status: Status.in_progress,
-            Task.num_retries: Task.num_retries + 1,
-        })
+        self.store.mark_in_progress(
+            self.task_name, self.parent_id, self.task_id, retry=True)
 
         db.session.commit()
 
@@ -204,16 +391,10 @@ class TrackedTask(local):
             if k not in ('task_id', 'parent_task_id')
         )
 
-        task, created = get_or_create(Task, where={
-            'task_name': self.task_name,
-            'parent_id': kwargs.get('parent_task_id'),
-            'task_id': kwargs['task_id'],
-        }, defaults={
-            'data': {
-                'kwargs': fn_kwargs,
-            },
-            'status': Status.queued,
-        })
+        task, created = self.store.get_or_create(
+            self.task_name, kwargs.get('parent_task_id'), kwargs['task_id'],
+            data={'kwargs': fn_kwargs},
+        )
 
         if created or needs_requeued(task):
             db.session.commit()
@@ -240,15 +421,10 @@ class TrackedTask(local):
             if k not in ('task_id', 'parent_task_id')
         )
 
-        try_create(Task, where={
-            'task_name': self.task_name,
-            'parent_id': kwargs.get('parent_task_id'),
-            'task_id': kwargs['task_id'],
-            'status': Status.queued,
-            'data': {
-                'kwargs': fn_kwargs,
-            },
-        })
+        self.store.create(
+            self.task_name, kwargs.get('parent_task_id'), kwargs['task_id'],
+            data={'kwargs': fn_kwargs},
+        )
 
         db.session.commit()
 
@@ -259,38 +435,16 @@ class TrackedTask(local):
         )
 
     def verify_all_children(self):
-        task_list = list(Task.query.filter(
-            Task.parent_id == self.task_id
-        ))
-
         current_datetime = datetime.utcnow()
 
-        need_expire = set()
-        need_run = set()
-
-        has_pending = False
-
-        for task in task_list:
-            if task.status == Status.finished:
-                continue
-
-            if needs_expired(task):
-                need_expire.add(task)
-                continue
-
-            has_pending = True
-
-            if needs_requeued(task) and 'kwargs' in task.data:
-                need_run.add(task)
+        num_expired, num_pending, need_run = self.store.check_children(
+            self.task_id,
+            run_before=current_datetime - RUN_TIMEOUT,
+            expire_before=current_datetime - EXPIRE_TIMEOUT,
+            date_modified=current_datetime,
+        )
 
-        if need_expire:
-            Task.query.filter(
-                Task.id.in_([n.id for n in need_expire]),
-            ).update({
-                Task.date_modified: current_datetime,
-                Task.status: Status.finished,
-                Task.result: Result.aborted,
-            }, synchronize_session=False)
+        if num_expired:
             db.session.commit()
 
         if need_run:
@@ -300,14 +454,10 @@ class TrackedTask(local):
                 child_kwargs['task_id'] = task.task_id.hex
                 queue.delay(task.task_name, kwargs=child_kwargs)
 
-            Task.query.filter(
-                Task.id.in_([n.id for n in need_run]),
-            ).update({
-                Task.date_modified: current_datetime,
-            }, synchronize_session=False)
+            self.store.touch(need_run, current_datetime)
             db.session.commit()
 
-        if has_pending:
+        if num_pending:
             status = Status.in_progress
 
         else:
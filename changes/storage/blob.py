@@ -0,0 +1,90 @@
+"""
+Simple key/value blob storage, used to keep large (and mostly immutable) data
+such as build logs out of Postgres.
+"""
+from __future__ import absolute_import
+
+import errno
+import os
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+class BlobStorage(object):
+    def put(self, key, data):
+        raise NotImplementedError
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class FileSystemStorage(BlobStorage):
+    """
+    Stores each blob as a file beneath ``root``. Writes go through a
+    temporary file so readers never observe a partially written blob.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def put(self, key, data):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+        tmp_path = '{0}.tmp.{1}'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as fp:
+            fp.write(data)
+        os.rename(tmp_path, path)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as fp:
+                return fp.read()
+        except IOError as exc:
+            if exc.errno == errno.ENOENT:
+                raise BlobNotFound(key)
+            raise
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+
+class MemoryStorage(BlobStorage):
+    """
+    An in-process stand-in for an object store (e.g. for tests).
+    """
+    def __init__(self):
+        self.blobs = {}
+
+    def put(self, key, data):
+        self.blobs[key] = data
+
+    def get(self, key):
+        try:
+            return self.blobs[key]
+        except KeyError:
+            raise BlobNotFound(key)
+
+    def delete(self, key):
+        self.blobs.pop(key, None)
+
+
+BLOB_STORAGES = {
+    'filesystem': FileSystemStorage,
+    'memory': MemoryStorage,
+}
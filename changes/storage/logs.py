@@ -0,0 +1,338 @@
+"""
+Storage for build logs.
+
+Logs are read by byte range through a LogStore. DatabaseLogStore reads the
+``logchunk`` table, which holds a row per chunk of output. LogSegmentStore
+instead writes logs as append-only, zlib-compressed segments to a
+BlobStorage, indexed by a ``LogSegment`` row per segment mapping its byte
+range within the LogSource.
+
+Segments are enabled by setting ``LOG_STORAGE_BACKEND`` (see
+``BLOB_STORAGES``); sources which have no segments are still read from the
+``logchunk`` table.
+"""
+from __future__ import absolute_import
+
+import uuid
+import zlib
+
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import func
+
+from changes.config import db
+from changes.db.utils import bulk_insert, create_or_update
+from changes.models import LogChunk, LogSegment
+from changes.models.log import LOG_FLUSH_SIZE
+from changes.storage.blob import BLOB_STORAGES
+
+
+# the number of log chunks fetched from the database at a time when reading
+READ_BATCH_SIZE = 100
+
+# the amount of the log scanned (backwards) at a time to find the start of
+# its last N lines
+TAIL_WINDOW = 65536
+
+
+class LogStore(object):
+    """
+    Reads the log of a LogSource by byte range.
+    """
+    def get_size(self, source):
+        """
+        Return the total size of the log, or None if nothing is stored.
+        """
+        raise NotImplementedError
+
+    def iter_read(self, source, offset=0, limit=None):
+        """
+        Yield ``(chunk_id, offset, data)`` for the bytes of the log between
+        ``offset`` and ``offset + limit``, in offset order.
+        """
+        raise NotImplementedError
+
+    def read(self, source, offset=0, limit=None):
+        """
+        Return the log between ``offset`` and ``offset + limit`` as a list of
+        (unsaved) LogChunk's.
+        """
+        return [
+            LogChunk(
+                id=chunk_id,
+                job_id=source.job_id,
+                project_id=source.project_id,
+                source=source,
+                offset=chunk_offset,
+                size=len(data),
+                # offsets are in bytes, so a slice may split a character
+                text=data.decode('utf-8', 'replace'),
+            )
+            for chunk_id, chunk_offset, data in self.iter_read(source, offset, limit)
+        ]
+
+
+class DatabaseLogStore(LogStore):
+    """
+    Reads logs from the ``logchunk`` table, using ``unq_logchunk_source_offset``
+    to find the chunks in a range.
+    """
+    def get_size(self, source):
+        tail = LogChunk.query.filter(
+            LogChunk.source_id == source.id,
+        ).order_by(LogChunk.offset.desc()).first()
+        if tail is None:
+            return None
+        return tail.offset + tail.size
+
+    def iter_read(self, source, offset=0, limit=None):
+        # the chunk containing ``offset`` is the last one starting at or
+        # before it
+        first = db.session.query(LogChunk.offset).filter(
+            LogChunk.source_id == source.id,
+            LogChunk.offset <= offset,
+        ).order_by(LogChunk.offset.desc()).first()
+
+        queryset = LogChunk.query.filter(
+            LogChunk.source_id == source.id,
+            LogChunk.offset >= (first.offset if first else offset),
+        ).order_by(LogChunk.offset.asc())
+        if limit:
+            queryset = queryset.filter(
+                LogChunk.offset < offset + limit,
+            )
+
+        position = offset
+        for chunk in queryset.yield_per(READ_BATCH_SIZE):
+            data = chunk.text
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+
+            if chunk.offset + len(data) <= position:
+                continue
+
+            start = max(position - chunk.offset, 0)
+            if limit:
+                end = min(len(data), offset + limit - chunk.offset)
+            else:
+                end = len(data)
+
+            yield chunk.id, chunk.offset + start, data[start:end]
+            position = chunk.offset + end
+
+    def compact(self, source, chunk_size=LOG_FLUSH_SIZE):
+        """
+        Merge the adjacent chunks of ``source`` into chunks of roughly
+        ``chunk_size`` bytes, returning the number of chunks before and
+        after. Each merged chunk starts at the offset of the first chunk it
+        replaces, so existing offsets remain valid.
+        """
+        num_before = 0
+        num_after = 0
+        for run in iter_chunk_runs(source, chunk_size):
+            num_before += len(run)
+            num_after += 1
+            if len(run) == 1:
+                continue
+
+            LogChunk.query.filter(
+                LogChunk.id.in_([r[0] for r in run]),
+            ).delete(synchronize_session=False)
+
+            bulk_insert(LogChunk.__table__, [{
+                'id': uuid.uuid4(),
+                'job_id': source.job_id,
+                'project_id': source.project_id,
+                'source_id': source.id,
+                'offset': run[0][1],
+                'size': sum(r[2] for r in run),
+                'text': ''.join(r[3] for r in run),
+                'date_created': datetime.utcnow(),
+            }])
+
+        return num_before, num_after
+
+
+class LogSegmentStore(LogStore):
+    def __init__(self, storage):
+        self.storage = storage
+
+    def get_key(self, source, offset):
+        return '{0}/{1}/{2:012d}.z'.format(
+            source.job_id.hex, source.id.hex, offset)
+
+    def append(self, source, offset, text):
+        """
+        Write ``text`` as the segment of ``source`` starting at ``offset``,
+        replacing any existing segment at the same offset.
+        """
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+
+        key = self.get_key(source, offset)
+        self.storage.put(key, zlib.compress(text))
+
+        segment, _ = create_or_update(LogSegment, where={
+            'source_id': source.id,
+            'offset': offset,
+        }, values={
+            'size': len(text),
+            'key': key,
+        })
+        return segment
+
+    def get_size(self, source):
+        return db.session.query(
+            func.max(LogSegment.offset + LogSegment.size),
+        ).filter(
+            LogSegment.source_id == source.id,
+        ).scalar()
+
+    def iter_read(self, source, offset=0, limit=None):
+        queryset = LogSegment.query.filter(
+            LogSegment.source_id == source.id,
+            (LogSegment.offset + LogSegment.size) > offset,
+        ).order_by(LogSegment.offset.asc())
+        if limit:
+            queryset = queryset.filter(
+                LogSegment.offset < offset + limit,
+            )
+
+        position = offset
+        for segment in queryset:
+            # segments may overlap if a log was re-synced with different
+            # flush boundaries
+            if segment.offset + segment.size <= position:
+                continue
+
+            data = zlib.decompress(self.storage.get(segment.key))
+
+            start = max(position - segment.offset, 0)
+            if limit:
+                end = min(segment.size, offset + limit - segment.offset)
+            else:
+                end = segment.size
+
+            yield segment.id, segment.offset + start, data[start:end]
+            position = segment.offset + end
+
+    def import_chunks(self, source, segment_size=LOG_FLUSH_SIZE):
+        """
+        Move the ``logchunk`` rows of ``source`` into segments of roughly
+        ``segment_size`` bytes, returning the number of chunks moved.
+        """
+        num_chunks = 0
+        for run in iter_chunk_runs(source, segment_size):
+            self.append(source, run[0][1], ''.join(r[3] for r in run))
+            num_chunks += len(run)
+
+        LogChunk.query.filter(
+            LogChunk.source_id == source.id,
+        ).delete(synchronize_session=False)
+
+        return num_chunks
+
+    def delete(self, source):
+        for segment in LogSegment.query.filter(LogSegment.source_id == source.id):
+            self.storage.delete(segment.key)
+            db.session.delete(segment)
+
+
+def iter_chunk_runs(source, max_size):
+    """
+    Yield runs of adjacent ``logchunk`` rows of ``source``, as lists of
+    ``(id, offset, size, text)``, each totalling roughly ``max_size`` bytes.
+    Runs never span a gap (or an overlap) in the log.
+    """
+    queryset = db.session.query(
+        LogChunk.id, LogChunk.offset, LogChunk.size, LogChunk.text,
+    ).filter(
+        LogChunk.source_id == source.id,
+    ).order_by(LogChunk.offset.asc())
+
+    run = []
+    run_size = 0
+    for chunk_id, offset, size, text in queryset.yield_per(500):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+
+        if run and offset != run[0][1] + run_size:
+            yield run
+            run = []
+            run_size = 0
+
+        run.append((chunk_id, offset, size, text))
+        run_size += size
+
+        if run_size >= max_size:
+            yield run
+            run = []
+            run_size = 0
+
+    if run:
+        yield run
+
+
+def get_log_store(app=None):
+    """
+    Return the LogSegmentStore configured by ``LOG_STORAGE_BACKEND``, or None
+    if logs are kept in the ``logchunk`` table.
+    """
+    if app is None:
+        app = current_app
+
+    backend = app.config['LOG_STORAGE_BACKEND']
+    if not backend:
+        return None
+
+    store = app.extensions.get('log-store')
+    if store is None:
+        storage = BLOB_STORAGES[backend](**app.config['LOG_STORAGE_OPTIONS'])
+        store = app.extensions['log-store'] = LogSegmentStore(storage)
+    return store
+
+
+def get_source_store(source, app=None):
+    """
+    Return the LogStore holding the log of ``source``, along with the size of
+    the log (None if it's empty).
+    """
+    store = get_log_store(app)
+    if store is not None:
+        size = store.get_size(source)
+        if size is not None:
+            return store, size
+
+    store = DatabaseLogStore()
+    return store, store.get_size(source)
+
+
+def find_tail_offset(store, source, size, num_lines):
+    """
+    Return the offset at which the last ``num_lines`` lines of the log begin.
+    """
+    if num_lines <= 0:
+        return size
+
+    end = size
+    while end > 0:
+        start = max(end - TAIL_WINDOW, 0)
+        data = ''.join(d for _, _, d in store.iter_read(source, start, end - start))
+
+        pos = len(data)
+        # the log's final newline ends its last line rather than starting one
+        if end == size and data.endswith('\n'):
+            pos -= 1
+
+        while True:
+            idx = data.rfind('\n', 0, pos)
+            if idx == -1:
+                break
+            num_lines -= 1
+            if num_lines == 0:
+                return start + idx + 1
+            pos = idx
+
+        end = start
+
+    return 0
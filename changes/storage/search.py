@@ -0,0 +1,218 @@
+"""
+Search over build logs.
+
+Each flush of a LogChunkWriter is indexed as a ``LogSearchBlock`` holding
+the trigrams of that part of the log, with its boundaries aligned to lines so
+that a line is always found within a single block. A search first finds the
+blocks which contain every trigram required by the pattern (a GIN lookup),
+and only then reads those byte ranges through the source's LogStore to match
+lines.
+
+Sources without any blocks (logs synced before indexing was enabled, see
+``index_source``) are scanned in full, a line at a time.
+"""
+from __future__ import absolute_import
+
+import re
+
+from collections import deque
+
+from changes.config import db
+from changes.models import LogSearchBlock
+from changes.models.log import LOG_FLUSH_SIZE
+from changes.storage.logs import find_tail_offset, get_source_store
+from changes.utils.trigrams import get_pattern_trigrams
+
+
+# the default number of lines returned either side of a match
+CONTEXT_LINES = 2
+
+# the default and maximum number of matches returned by a search
+MATCH_LIMIT = 100
+MAX_MATCH_LIMIT = 1000
+
+
+def compile_pattern(pattern, regex=False):
+    """
+    Return a compiled (unicode) regular expression for ``pattern``, raising
+    ``re.error`` if it's invalid.
+    """
+    if not regex:
+        pattern = re.escape(pattern)
+    return re.compile(pattern, re.UNICODE)
+
+
+def iter_lines(store, source, offset=0, limit=None):
+    """
+    Yield ``(offset, line)`` for each line of the log between ``offset`` and
+    ``offset + limit``, including its newline (if any).
+    """
+    position = offset
+    partial = ''
+    for _, _, data in store.iter_read(source, offset, limit):
+        if partial:
+            data = partial + data
+
+        start = 0
+        while True:
+            end = data.find('\n', start) + 1
+            if not end:
+                break
+            yield position, data[start:end]
+            position += end - start
+            start = end
+        partial = data[start:]
+
+    if partial:
+        yield position, partial
+
+
+def get_index_prefix(source, offset):
+    """
+    Return the part of the line of ``source`` containing ``offset`` which
+    precedes it, i.e. the ``index_prefix`` of a LogChunkWriter continuing the
+    log at ``offset``.
+    """
+    if not offset:
+        return ''
+
+    store, size = get_source_store(source)
+    if size is None:
+        return ''
+
+    start = find_tail_offset(store, source, offset, 1)
+    data = ''.join(d for _, _, d in store.iter_read(source, start, offset - start))
+    if data.endswith('\n'):
+        return ''
+    return data
+
+
+def index_source(source, block_size=LOG_FLUSH_SIZE):
+    """
+    Build the search index of an existing log from blocks of whole lines of
+    roughly ``block_size`` bytes, returning the number of blocks indexed.
+    """
+    store, size = get_source_store(source)
+    if size is None:
+        return 0
+
+    LogSearchBlock.query.filter(
+        LogSearchBlock.source_id == source.id,
+    ).delete(synchronize_session=False)
+
+    num_blocks = 0
+    block_offset = 0
+    block = []
+    pending_size = 0
+    for offset, line in iter_lines(store, source):
+        block.append(line)
+        pending_size += len(line)
+        if pending_size >= block_size:
+            LogSearchBlock.index(source, block_offset, ''.join(block))
+            num_blocks += 1
+            block_offset = offset + len(line)
+            block = []
+            pending_size = 0
+
+    if block:
+        LogSearchBlock.index(source, block_offset, ''.join(block))
+        num_blocks += 1
+    return num_blocks
+
+
+def match_lines(source, lines, matcher, context):
+    """
+    Yield a match, in order, for each of ``lines`` (as given by
+    ``iter_lines``) of ``source`` matching ``matcher``. Context never extends
+    beyond ``lines``.
+    """
+    before = deque(maxlen=context)
+    # matches still missing some of their following lines
+    waiting = deque()
+
+    for offset, line in lines:
+        text = line.rstrip('\n').decode('utf-8', 'replace')
+
+        for match in waiting:
+            match['after'].append(text)
+        while waiting and len(waiting[0]['after']) >= context:
+            yield waiting.popleft()
+
+        if matcher.search(text):
+            match = {
+                'source': source,
+                'offset': offset,
+                'text': text,
+                'before': list(before),
+                'after': [],
+            }
+            if context:
+                waiting.append(match)
+            else:
+                yield match
+
+        before.append(text)
+
+    for match in waiting:
+        yield match
+
+
+def search_logs(sources, pattern, regex=False, context=CONTEXT_LINES,
+                limit=MATCH_LIMIT):
+    """
+    Search ``sources`` for lines matching ``pattern``, returning a list of
+    up to ``limit`` matches (ordered by source, then offset) along with
+    whether there were more.
+    """
+    matcher = compile_pattern(pattern, regex)
+    trigrams = get_pattern_trigrams(pattern, regex)
+
+    sources_by_id = dict((s.id, s) for s in sources)
+    if not sources_by_id:
+        return [], False
+
+    indexed_ids = set(r[0] for r in db.session.query(
+        LogSearchBlock.source_id,
+    ).filter(
+        LogSearchBlock.source_id.in_(sources_by_id.keys()),
+    ).distinct())
+
+    candidates = {}
+    if indexed_ids:
+        queryset = db.session.query(
+            LogSearchBlock.source_id, LogSearchBlock.offset, LogSearchBlock.size,
+        ).filter(
+            LogSearchBlock.source_id.in_(indexed_ids),
+        )
+        if trigrams:
+            queryset = queryset.filter(LogSearchBlock.trigrams.contains(trigrams))
+
+        for source_id, offset, size in queryset:
+            candidates.setdefault(source_id, []).append((offset, size))
+
+    for source_id in set(sources_by_id) - indexed_ids:
+        candidates[source_id] = [(0, None)]
+
+    results = []
+    for source in sources:
+        if source.id not in candidates:
+            continue
+
+        store, size = get_source_store(source)
+        if size is None:
+            continue
+
+        # blocks may overlap if a log was re-synced with different flush
+        # boundaries
+        seen = set()
+        for offset, block_size in sorted(candidates[source.id]):
+            lines = iter_lines(store, source, offset, block_size)
+            for match in match_lines(source, lines, matcher, context):
+                if match['offset'] in seen:
+                    continue
+                seen.add(match['offset'])
+                if len(results) == limit:
+                    return results, True
+                results.append(match)
+
+    return results, False
@@ -352,3 +352,23 @@ class APITestCase(TestCase):
             mock.Mock(return_value=self.mock_backend))
         self.patcher.start()
         self.addCleanup(self.patcher.stop)
+
+    def count_queries(self, path):
+        """
+        Return the number of queries needed to serve ``path``, starting from
+        an empty session so nothing comes from the identity map.
+
+        The session is emptied again afterwards, so the objects the test
+        created beforehand can still be used.
+        """
+        from changes.testutils.helpers import capture_queries
+
+        db.session.flush()
+        db.session.expunge_all()
+
+        with capture_queries() as queries:
+            resp = self.client.get(path)
+        assert resp.status_code == 200
+
+        db.session.expunge_all()
+        return len(queries)
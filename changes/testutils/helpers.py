@@ -1,5 +1,7 @@
-from changes.config import queue
+from changes.config import db, queue
+from contextlib import contextmanager
 from functools import wraps
+from sqlalchemy import event
 
 
 def eager_tasks(func):
@@ -11,3 +13,24 @@ def eager_tasks(func):
         finally:
             queue.celery.conf.CELERY_ALWAYS_EAGER = False
     return wrapped
+
+
+@contextmanager
+def capture_queries():
+    """
+    Record the SQL statements executed within the block.
+
+    >>> with capture_queries() as queries:
+    >>>     resp = self.client.get(path)
+    >>> assert len(queries) == 3
+    """
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        queries.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield queries
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
@@ -0,0 +1,61 @@
+"""
+Helpers for trigram indexes, which are used to narrow down the data that
+has to be scanned to match a pattern (see ``LogSearchBlock``).
+
+Trigrams are case-insensitive and are stored as (signed, 32-bit) CRC32
+hashes, so any match found through them has to be verified.
+"""
+from __future__ import absolute_import
+
+import sre_constants
+import sre_parse
+import zlib
+
+
+def hash_trigram(value):
+    return zlib.crc32(value)
+
+
+def get_trigrams(text):
+    """
+    Return the hashes of every trigram within a line of ``text``.
+    """
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    text = text.lower()
+
+    trigrams = set()
+    for line in text.split('\n'):
+        trigrams.update(line[i:i + 3] for i in xrange(len(line) - 2))
+    return sorted(set(hash_trigram(t) for t in trigrams))
+
+
+def get_pattern_trigrams(pattern, regex=False):
+    """
+    Return the hashes of trigrams which must be present in any text matching
+    ``pattern``. An empty list means the pattern can't be narrowed down.
+    """
+    if not regex:
+        return get_trigrams(pattern)
+
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (sre_constants.error, OverflowError):
+        return []
+
+    # only literals in the top-level sequence are guaranteed to be present
+    # (anything within a branch, repeat or group may not be)
+    literals = []
+    current = []
+    for op, value in parsed:
+        if op == sre_constants.LITERAL:
+            current.append(unichr(value))
+        else:
+            literals.append(u''.join(current))
+            current = []
+    literals.append(u''.join(current))
+
+    trigrams = set()
+    for literal in literals:
+        trigrams.update(get_trigrams(literal))
+    return sorted(trigrams)
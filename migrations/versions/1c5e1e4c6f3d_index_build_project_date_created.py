@@ -0,0 +1,22 @@
+"""Index build.project_id, date_created
+
+Revision ID: 1c5e1e4c6f3d
+Revises: 3d1a2c5e9f04
+Create Date: 2014-02-12 10:41:18.530217
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1c5e1e4c6f3d'
+down_revision = '3d1a2c5e9f04'
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index(
+        'idx_build_project_date_created', 'build', ['project_id', 'date_created', 'id'])
+
+
+def downgrade():
+    op.drop_index('idx_build_project_date_created', 'build')
@@ -0,0 +1,33 @@
+"""Add LogSegment
+
+Revision ID: 2b8459f07a7c
+Revises: 4e68c2a3d269
+Create Date: 2014-02-10 14:02:11.361740
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2b8459f07a7c'
+down_revision = '4e68c2a3d269'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'logsegment',
+        sa.Column('id', sa.GUID(), nullable=False),
+        sa.Column('source_id', sa.GUID(), nullable=False),
+        sa.Column('offset', sa.Integer(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(length=128), nullable=False),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['source_id'], ['logsource.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('source_id', 'offset', name='unq_logsegment_source_offset'),
+    )
+
+
+def downgrade():
+    op.drop_table('logsegment')
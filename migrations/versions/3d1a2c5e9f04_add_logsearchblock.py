@@ -0,0 +1,37 @@
+"""Add LogSearchBlock
+
+Revision ID: 3d1a2c5e9f04
+Revises: 2b8459f07a7c
+Create Date: 2014-02-11 11:24:37.192811
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3d1a2c5e9f04'
+down_revision = '2b8459f07a7c'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.create_table(
+        'logsearchblock',
+        sa.Column('id', sa.GUID(), nullable=False),
+        sa.Column('source_id', sa.GUID(), nullable=False),
+        sa.Column('offset', sa.Integer(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('trigrams', postgresql.ARRAY(sa.Integer()), nullable=False),
+        sa.Column('date_created', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['source_id'], ['logsource.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('source_id', 'offset', name='unq_logsearchblock_source_offset'),
+    )
+    op.create_index(
+        'idx_logsearchblock_trigrams', 'logsearchblock', ['trigrams'],
+        postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_table('logsearchblock')
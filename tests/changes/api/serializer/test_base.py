@@ -0,0 +1,59 @@
+import json
+
+from datetime import datetime
+from uuid import UUID
+
+from changes.api.serializer import Serializer, dumps, get_serializer, serialize
+from changes.api.serializer.models.build import BuildSerializer
+from changes.constants import Status
+from changes.models import Build, Project, Source
+
+
+class CustomDateTime(datetime):
+    pass
+
+
+class BuildNameSerializer(Serializer):
+    def serialize(self, instance):
+        return instance.label
+
+
+def create_build():
+    return Build(
+        id=UUID(hex='33846695b2774b29a71795a009e8168a'),
+        label='Hello world',
+        project=Project(slug='test', name='test'),
+        source=Source(revision_sha='1e7958a368f44b0eb5a57372a9910d50'),
+        status=Status.finished,
+        date_created=datetime(2013, 9, 19, 22, 15, 22),
+    )
+
+
+def test_get_serializer():
+    build = create_build()
+    assert isinstance(get_serializer(build, {}), BuildSerializer)
+
+    # subclasses of registered types are resolved (and cached)
+    value = CustomDateTime(2013, 9, 19)
+    assert get_serializer(value, {}) is get_serializer(value, {})
+    assert serialize(value) == '2013-09-19T00:00:00'
+
+    assert get_serializer(object(), {}) is None
+
+    serializer = BuildNameSerializer()
+    assert get_serializer(build, {Build: serializer}) is serializer
+
+
+def test_dumps():
+    build = create_build()
+    context = {
+        'build': build,
+        'builds': [build, build],
+        'tags': ('foo', 1, None),
+        'nested': {'status': Status.finished},
+    }
+
+    assert json.loads(dumps(context)) == json.loads(json.dumps(serialize(context)))
+
+    data = json.loads(dumps([build], {Build: BuildNameSerializer()}))
+    assert data == ['Hello world']
@@ -1,10 +1,13 @@
+import mock
+
 from datetime import datetime
 
 from changes.config import db
 from changes.constants import Status
 from changes.models import TestCase
 from changes.testutils import APITestCase, TestCase as BaseTestCase
-from changes.api.build_details import find_changed_tests
+from changes.api.build_details import BuildDetailsAPIView, find_changed_tests
+from changes.events import publish_build_update
 
 
 class FindChangedTestsTest(BaseTestCase):
@@ -75,3 +78,51 @@ class BuildDetailsTest(APITestCase):
         assert data['testFailures']['total'] == 0
         assert data['testFailures']['testGroups'] == []
         assert data['testChanges'] == []
+
+    def test_conditional_get(self):
+        build = self.create_build(self.project)
+        self.create_job(build)
+
+        path = '/api/0/builds/{0}/'.format(build.id.hex)
+
+        resp = self.client.get(path)
+        assert resp.status_code == 200
+        etag = resp.headers['ETag']
+        data = self.unserialize(resp)
+        assert data['build']['id'] == build.id.hex
+
+        # the test client can't read an empty body through the Sentry
+        # middleware unless the response is buffered
+        resp = self.client.get(
+            path, headers={'If-None-Match': etag}, buffered=True)
+        assert resp.status_code == 304
+        assert resp.headers['ETag'] == etag
+
+        # served from the cache
+        with mock.patch.object(BuildDetailsAPIView, 'get') as get:
+            resp = self.client.get(path)
+        assert not get.called
+        assert resp.status_code == 200
+        assert resp.headers['ETag'] == etag
+        assert self.unserialize(resp) == data
+
+        build.label = 'foo'
+        db.session.add(build)
+        with mock.patch('changes.events.pubsub.publish_many'):
+            assert publish_build_update(build)
+
+        resp = self.client.get(path, headers={'If-None-Match': etag})
+        assert resp.status_code == 200
+        assert resp.headers['ETag'] != etag
+        assert self.unserialize(resp)['build']['name'] == 'foo'
+
+    def test_cached_view_error(self):
+        build = self.create_build(self.project)
+
+        path = '/api/0/builds/{0}/'.format(build.id.hex)
+
+        with mock.patch.object(BuildDetailsAPIView, 'get') as get:
+            get.return_value = ('', 404)
+            resp = self.client.get(path)
+        assert resp.status_code == 404
+        assert 'ETag' not in resp.headers
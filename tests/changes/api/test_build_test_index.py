@@ -33,3 +33,19 @@ class BuildTestIndexTest(APITestCase):
         data = self.unserialize(resp)
         assert len(data) == 1
         assert data[0]['id'] == group.id.hex
+
+    def test_query_count(self):
+        build = self.create_build(self.project)
+        job = self.create_job(build, status=Status.finished)
+        path = '/api/0/builds/{0}/tests/'.format(build.id.hex)
+
+        def create_test():
+            parent = self.create_testgroup(job, num_leaves=1)
+            self.create_testgroup(job, parent=parent, num_leaves=0)
+
+        create_test()
+        num_queries = self.count_queries(path)
+
+        for _ in xrange(3):
+            create_test()
+        assert self.count_queries(path) == num_queries
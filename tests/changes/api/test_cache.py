@@ -0,0 +1,60 @@
+from __future__ import absolute_import
+
+import mock
+
+from changes.api.cache import (
+    get_etag, get_project_cache_keys, get_response, invalidate, set_response
+)
+from changes.testutils import TestCase
+
+
+class GetEtagTest(TestCase):
+    def test_invalidate(self):
+        keys = ['builds:1', 'builds:1:jobs']
+
+        etag = get_etag('/foo/', keys, 'a', 300)
+        assert get_etag('/foo/', keys, 'a', 300) == etag
+        assert get_etag('/foo/?bar=1', keys, 'a', 300) != etag
+        assert get_etag('/foo/', keys, 'b', 300) != etag
+
+        invalidate(['builds:2'])
+        assert get_etag('/foo/', keys, 'a', 300) == etag
+
+        invalidate(['builds:1:jobs'])
+        assert get_etag('/foo/', keys, 'a', 300) != etag
+
+    @mock.patch('changes.api.cache.time')
+    def test_expires(self, time):
+        keys = ['builds:1']
+
+        time.time.return_value = 600
+        etag = get_etag('/foo/', keys, 'a', 300)
+
+        time.time.return_value = 899
+        assert get_etag('/foo/', keys, 'a', 300) == etag
+
+        time.time.return_value = 900
+        assert get_etag('/foo/', keys, 'a', 300) != etag
+
+
+class ResponseTest(TestCase):
+    def test_simple(self):
+        assert get_response('a') is None
+        set_response('a', '{}', 60)
+        assert get_response('a') == '{}'
+
+
+class GetProjectCacheKeysTest(TestCase):
+    def test_simple(self):
+        assert get_project_cache_keys('a' * 32) is None
+
+        keys, version = get_project_cache_keys(self.project.slug)
+        assert keys == [
+            'projects:{0}'.format(self.project.id.hex),
+            'projects:{0}:builds'.format(self.project.id.hex),
+        ]
+        assert version is None
+
+        build = self.create_build(self.project)
+        keys, version = get_project_cache_keys(self.project.id.hex)
+        assert version == build.date_modified
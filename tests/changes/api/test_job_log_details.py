@@ -1,9 +1,29 @@
+import mock
+
 from changes.config import db
 from changes.models import LogSource, LogChunk
+from changes.storage.blob import MemoryStorage
+from changes.storage.logs import LogSegmentStore
 from changes.testutils import APITestCase
 
 
 class JobLogDetailsTest(APITestCase):
+    def create_log(self, *texts):
+        build = self.create_build(self.project)
+        job = self.create_job(build)
+        source = LogSource(job=job, project=self.project, name='test')
+        db.session.add(source)
+
+        offset = 0
+        for text in texts:
+            db.session.add(LogChunk(
+                job=job, project=self.project, source=source,
+                offset=offset, size=len(text), text=text,
+            ))
+            offset += len(text)
+
+        return job, source
+
     def test_simple(self):
         build = self.create_build(self.project)
         job = self.create_job(build)
@@ -32,3 +52,113 @@ class JobLogDetailsTest(APITestCase):
         assert len(data['chunks']) == 2
         assert data['chunks'][0]['text'] == lc1.text
         assert data['chunks'][1]['text'] == lc2.text
+
+    def test_caught_up(self):
+        job, source = self.create_log('a' * 100, 'b' * 100)
+
+        path = '/api/0/jobs/{0}/logs/{1}/'.format(
+            job.id.hex, source.id.hex)
+
+        resp = self.client.get(path + '?offset=200')
+        assert resp.status_code == 200
+        data = self.unserialize(resp)
+        assert data['chunks'] == []
+        assert data['nextOffset'] == 200
+
+    def test_segments(self):
+        build = self.create_build(self.project)
+        job = self.create_job(build)
+        source = LogSource(job=job, project=self.project, name='test')
+        db.session.add(source)
+        db.session.flush()
+
+        store = LogSegmentStore(MemoryStorage())
+        store.append(source, 0, 'a' * 100)
+        store.append(source, 100, 'b' * 100)
+
+        path = '/api/0/jobs/{0}/logs/{1}/'.format(
+            job.id.hex, source.id.hex)
+
+        with mock.patch('changes.storage.logs.get_log_store', return_value=store):
+            resp = self.client.get(path + '?limit=150')
+
+        assert resp.status_code == 200
+        data = self.unserialize(resp)
+        assert data['nextOffset'] == 200
+        assert len(data['chunks']) == 2
+        assert data['chunks'][0]['offset'] == 50
+        assert data['chunks'][0]['text'] == 'a' * 50
+        assert data['chunks'][1]['text'] == 'b' * 100
+
+    def test_offset(self):
+        job, source = self.create_log('foo\nbar\n', 'baz\n')
+
+        path = '/api/0/jobs/{0}/logs/{1}/?offset=4&limit=6'.format(
+            job.id.hex, source.id.hex)
+
+        resp = self.client.get(path)
+        assert resp.status_code == 200
+        data = self.unserialize(resp)
+        assert data['nextOffset'] == 10
+        assert [(c['offset'], c['text']) for c in data['chunks']] == [
+            (4, 'bar\n'),
+            (8, 'ba'),
+        ]
+
+    def test_tail(self):
+        job, source = self.create_log('foo\nbar\n', 'baz\n')
+
+        path = '/api/0/jobs/{0}/logs/{1}/?tail=2'.format(
+            job.id.hex, source.id.hex)
+
+        resp = self.client.get(path)
+        assert resp.status_code == 200
+        data = self.unserialize(resp)
+        assert data['nextOffset'] == 12
+        assert ''.join(c['text'] for c in data['chunks']) == 'bar\nbaz\n'
+
+
+class JobLogRawTest(APITestCase):
+    def setUp(self):
+        super(JobLogRawTest, self).setUp()
+        build = self.create_build(self.project)
+        self.job = self.create_job(build)
+        self.source = LogSource(job=self.job, project=self.project, name='test')
+        db.session.add(self.source)
+        for offset, text in ((0, 'foo\nbar\n'), (8, 'baz\n')):
+            db.session.add(LogChunk(
+                job=self.job, project=self.project, source=self.source,
+                offset=offset, size=len(text), text=text,
+            ))
+
+        self.path = '/api/0/jobs/{0}/logs/{1}/raw/'.format(
+            self.job.id.hex, self.source.id.hex)
+
+    def test_full(self):
+        resp = self.client.get(self.path)
+        assert resp.status_code == 200
+        assert resp.data == 'foo\nbar\nbaz\n'
+        assert resp.headers['Accept-Ranges'] == 'bytes'
+
+    def test_range(self):
+        resp = self.client.get(self.path, headers={'Range': 'bytes=4-9'})
+        assert resp.status_code == 206
+        assert resp.data == 'bar\nba'
+        assert resp.headers['Content-Range'] == 'bytes 4-9/12'
+
+        resp = self.client.get(self.path, headers={'Range': 'bytes=-4'})
+        assert resp.status_code == 206
+        assert resp.data == 'baz\n'
+
+    def test_unsatisfiable_range(self):
+        # the test client can't read an empty body through the Sentry
+        # middleware unless the response is buffered
+        resp = self.client.get(
+            self.path, headers={'Range': 'bytes=20-30'}, buffered=True)
+        assert resp.status_code == 416
+        assert resp.headers['Content-Range'] == 'bytes */12'
+
+    def test_tail(self):
+        resp = self.client.get(self.path + '?tail=1')
+        assert resp.status_code == 200
+        assert resp.data == 'baz\n'
@@ -0,0 +1,34 @@
+from changes.config import db
+from changes.models import LogChunkWriter, LogSource
+from changes.testutils import APITestCase
+
+
+class JobLogSearchTest(APITestCase):
+    def test_simple(self):
+        build = self.create_build(self.project)
+        job = self.create_job(build)
+        source = LogSource(job=job, project=self.project, name='test')
+        db.session.add(source)
+
+        writer = LogChunkWriter(source, index=True)
+        writer.write('foo\nerror: bad\nbar\n')
+        writer.close()
+
+        path = '/api/0/jobs/{0}/logs/search/'.format(job.id.hex)
+
+        resp = self.client.get(path)
+        assert resp.status_code == 400
+
+        resp = self.client.get(path + '?q=error')
+        assert resp.status_code == 200
+        data = self.unserialize(resp)
+        assert data['hasMore'] is False
+        assert len(data['matches']) == 1
+        assert data['matches'][0]['source']['id'] == source.id.hex
+        assert data['matches'][0]['offset'] == 4
+        assert data['matches'][0]['text'] == 'error: bad'
+        assert data['matches'][0]['before'] == ['foo']
+        assert data['matches'][0]['after'] == ['bar']
+
+        resp = self.client.get(path + '?q=err(&regex=1')
+        assert resp.status_code == 400
@@ -30,3 +30,20 @@ class NodeJobIndexTest(APITestCase):
         data = self.unserialize(resp)
         assert len(data) == 1
         assert data[0]['id'] == job.id.hex
+
+    def test_query_count(self):
+        node = self.create_node()
+        path = '/api/0/nodes/{0}/jobs/'.format(node.id.hex)
+
+        def create_job():
+            build = self.create_build(self.project, author=self.create_author())
+            job = self.create_job(build)
+            phase = self.create_jobphase(job)
+            self.create_jobstep(phase, node=node)
+
+        create_job()
+        num_queries = self.count_queries(path)
+
+        for _ in xrange(3):
+            create_job()
+        assert self.count_queries(path) == num_queries
@@ -1,3 +1,7 @@
+import re
+
+from datetime import datetime
+from urlparse import urlparse
 from uuid import uuid4
 
 from changes.testutils import APITestCase
@@ -24,3 +28,61 @@ class ProjectBuildListTest(APITestCase):
         data = self.unserialize(resp)
         assert len(data) == 1
         assert data[0]['id'] == build.id.hex
+
+    def test_query_count(self):
+        path = '/api/0/projects/{0}/builds/'.format(self.project.id.hex)
+
+        self.create_build(self.project, author=self.create_author())
+        num_queries = self.count_queries(path)
+
+        for _ in xrange(3):
+            self.create_build(self.project, author=self.create_author())
+        assert self.count_queries(path) == num_queries
+
+    def get_links(self, resp):
+        links = {}
+        for url, name in re.findall(r'<([^>]+)>; rel="(\w+)"', resp.headers.get('Link', '')):
+            # the test client drops the query string of absolute URLs
+            url = urlparse(url)
+            links[name] = '{0}?{1}'.format(url.path, url.query)
+        return links
+
+    def test_keyset_pagination(self):
+        builds = [
+            self.create_build(self.project, date_created=datetime(2013, 9, 19, 22, 15, n))
+            for n in xrange(5)
+        ]
+        builds.reverse()
+
+        path = '/api/0/projects/{0}/builds/?per_page=2'.format(self.project.id.hex)
+
+        resp = self.client.get(path)
+        assert resp.status_code == 200
+        data = self.unserialize(resp)
+        assert [b['id'] for b in data] == [b.id.hex for b in builds[:2]]
+        links = self.get_links(resp)
+        assert 'previous' not in links
+
+        resp = self.client.get(links['next'])
+        data = self.unserialize(resp)
+        assert [b['id'] for b in data] == [b.id.hex for b in builds[2:4]]
+        links = self.get_links(resp)
+
+        resp = self.client.get(links['next'])
+        data = self.unserialize(resp)
+        assert [b['id'] for b in data] == [builds[4].id.hex]
+        links = self.get_links(resp)
+        assert 'next' not in links
+
+        resp = self.client.get(links['previous'])
+        data = self.unserialize(resp)
+        assert [b['id'] for b in data] == [b.id.hex for b in builds[2:4]]
+
+        # offset pagination is still available
+        resp = self.client.get(path + '&page=2')
+        data = self.unserialize(resp)
+        assert [b['id'] for b in data] == [b.id.hex for b in builds[2:4]]
+        assert '&page=3' in self.get_links(resp)['next']
+
+        resp = self.client.get(path + '&cursor=invalid')
+        assert resp.status_code == 400
@@ -51,3 +51,28 @@ class ProjectDetailsTest(APITestCase):
         project = Project.query.get(self.project.id)
         assert project.name == 'details test project'
         assert project.slug == 'details-test-project'
+
+    def test_update_invalidates_cache(self):
+        path = '/api/0/projects/{0}/'.format(
+            self.project.id.hex)
+
+        resp = self.client.get(path)
+        assert resp.status_code == 200
+        etag = resp.headers['ETag']
+
+        # the test client can't read an empty body through the Sentry
+        # middleware unless the response is buffered
+        resp = self.client.get(
+            path, headers={'If-None-Match': etag}, buffered=True)
+        assert resp.status_code == 304
+
+        resp = self.client.post(path, data={
+            'name': 'details test project',
+            'slug': 'details-test-project',
+        })
+        assert resp.status_code == 200
+
+        resp = self.client.get(path, headers={'If-None-Match': etag})
+        assert resp.status_code == 200
+        data = self.unserialize(resp)
+        assert data['name'] == 'details test project'
@@ -0,0 +1,34 @@
+from uuid import uuid4
+
+from changes.config import db
+from changes.models import LogChunkWriter, LogSource
+from changes.testutils import APITestCase
+
+
+class ProjectLogSearchTest(APITestCase):
+    def create_log(self, project, text):
+        build = self.create_build(project)
+        job = self.create_job(build)
+        source = LogSource(job=job, project=project, name='test')
+        db.session.add(source)
+
+        writer = LogChunkWriter(source, index=True)
+        writer.write(text)
+        writer.close()
+        return source
+
+    def test_simple(self):
+        path = '/api/0/projects/{0}/logs/search/?q=error'.format(uuid4().hex)
+        resp = self.client.get(path)
+        assert resp.status_code == 404
+
+        source = self.create_log(self.project, 'foo\nerror: bad\n')
+        self.create_log(self.create_project(), 'error: other project\n')
+
+        path = '/api/0/projects/{0}/logs/search/?q=error'.format(self.project.id.hex)
+        resp = self.client.get(path)
+        assert resp.status_code == 200
+        data = self.unserialize(resp)
+        assert len(data['matches']) == 1
+        assert data['matches'][0]['source']['id'] == source.id.hex
+        assert data['matches'][0]['text'] == 'error: bad'
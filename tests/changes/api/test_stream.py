@@ -0,0 +1,96 @@
+from __future__ import absolute_import
+
+import mock
+
+from changes.api.stream import EventStream
+from changes.testutils import TestCase
+
+
+class EventStreamTest(TestCase):
+    def create_stream(self, **kwargs):
+        pubsub = mock.Mock()
+        stream = EventStream(channels=['builds:1'], pubsub=pubsub, **kwargs)
+        pubsub.subscribe.assert_called_once_with('builds:1', stream.push)
+        return stream
+
+    def read_event(self, iterator):
+        lines = []
+        while not lines or lines[-1] != '\n':
+            lines.append(next(iterator))
+        return ''.join(lines)
+
+    def test_fifo(self):
+        stream = self.create_stream()
+        iterator = iter(stream)
+        assert next(iterator) == '\n'
+
+        stream.push({'event': 'build.update', 'id': 'a', 'data': '1'})
+        stream.push({'event': 'job.update', 'id': 'b', 'data': '2'})
+
+        assert self.read_event(iterator) == 'event: build.update\ndata: 1\n\n'
+        assert self.read_event(iterator) == 'event: job.update\ndata: 2\n\n'
+
+        stream.close()
+        stream.pubsub.unsubscribe.assert_called_once_with('builds:1', stream.push)
+        assert list(iterator) == []
+
+    def test_collapses_updates(self):
+        stream = self.create_stream()
+        iterator = iter(stream)
+        next(iterator)
+
+        stream.push({'event': 'build.update', 'id': 'a', 'data': '1'})
+        stream.push({'event': 'buildlog.update', 'data': '2'})
+        stream.push({'event': 'build.update', 'id': 'a', 'data': '3'})
+        assert len(stream.pending) == 2
+
+        assert self.read_event(iterator) == 'event: buildlog.update\ndata: 2\n\n'
+        assert self.read_event(iterator) == 'event: build.update\ndata: 3\n\n'
+
+    def test_bounded(self):
+        stream = self.create_stream(max_pending=2)
+        iterator = iter(stream)
+        next(iterator)
+
+        for n in xrange(3):
+            stream.push({'seq': n + 1, 'event': 'buildlog.update', 'data': str(n)})
+
+        # nothing is dropped, the stream is closed once its backlog is sent
+        assert not stream.active
+        stream.pubsub.unsubscribe.assert_called_once_with('builds:1', stream.push)
+        assert [e['data'] for e in stream.pending.values()] == ['0', '1']
+
+        assert self.read_event(iterator) == 'id: 1\nevent: buildlog.update\ndata: 0\n\n'
+        assert self.read_event(iterator) == 'id: 2\nevent: buildlog.update\ndata: 1\n\n'
+        assert list(iterator) == []
+
+    def test_replay(self):
+        pubsub = mock.Mock()
+        pubsub.get_replay.return_value = [
+            {'seq': 6, 'event': 'build.update', 'id': 'a', 'data': '1'},
+            {'seq': 7, 'event': 'buildlog.update', 'data': '2'},
+        ]
+
+        def subscribe(channel, callback):
+            # published after subscribing, but also in the replay buffer
+            callback({'seq': 7, 'event': 'buildlog.update', 'data': '2'})
+            callback({'seq': 8, 'event': 'buildlog.update', 'data': '3'})
+        pubsub.subscribe.side_effect = subscribe
+
+        stream = EventStream(channels=['builds:1'], pubsub=pubsub, last_event_id=5)
+        pubsub.get_replay.assert_called_once_with('builds:1', 5)
+
+        iterator = iter(stream)
+        next(iterator)
+
+        assert self.read_event(iterator) == 'id: 6\nevent: build.update\ndata: 1\n\n'
+        assert self.read_event(iterator) == 'id: 7\nevent: buildlog.update\ndata: 2\n\n'
+        assert self.read_event(iterator) == 'id: 8\nevent: buildlog.update\ndata: 3\n\n'
+        assert not stream.pending
+
+    def test_heartbeat(self):
+        stream = self.create_stream(heartbeat_interval=0.01)
+        iterator = iter(stream)
+        next(iterator)
+
+        assert next(iterator) == ': ping\n\n'
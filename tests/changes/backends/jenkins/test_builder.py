@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 
+import json
 import mock
 import os.path
 import responses
@@ -13,7 +14,9 @@ from changes.constants import Status, Result
 from changes.models import (
     Artifact, TestCase, Patch, LogSource, LogChunk, Job
 )
-from changes.backends.jenkins.builder import JenkinsBuilder, chunked
+from changes.backends.jenkins.builder import (
+    JenkinsBuilder, JobSnapshotCache, chunked, job_snapshots
+)
 from changes.testutils import (
     BackendTestCase, eager_tasks, SAMPLE_DIFF, SAMPLE_XUNIT
 )
@@ -329,13 +332,21 @@ class SyncBuildTest(BaseTestCase):
         step = self.create_jobstep(phase, data=job.data)
 
         builder = self.get_builder()
-        builder.sync_step(step)
+        with mock.patch.object(builder.logger, 'info') as log_info:
+            builder.sync_step(step)
 
         assert step.data['build_no'] == 2
         assert step.status == Status.finished
         assert step.result == Result.passed
         assert step.date_finished is not None
 
+        # the sync is summarized along with the process's requests to Jenkins
+        stats = builder.http.stats.as_dict()['jenkins.example.com']
+        log_info.assert_called_with(
+            'Synced %s #%s (%s: %d requests, %d errors, %dms average)',
+            'server', 2, 'jenkins.example.com', stats['requests'], stats['errors'],
+            stats['avgTime'] * 1000)
+
     @responses.activate
     def test_failed_result(self):
         responses.add(
@@ -609,6 +620,88 @@ class SyncBuildTest(BaseTestCase):
         assert len(test_list) == 2
 
 
+class BatchSyncTest(BaseTestCase):
+    def setUp(self):
+        super(BatchSyncTest, self).setUp()
+        job_snapshots.clear()
+
+    def create_step(self, build_no):
+        build = self.create_build(self.project)
+        job = self.create_job(build=build, data={
+            'build_no': build_no,
+            'item_id': 13,
+            'job_name': 'server',
+            'queued': False,
+        })
+        phase = self.create_jobphase(job)
+        return self.create_jobstep(phase, data=job.data)
+
+    @responses.activate
+    def test_shares_snapshot(self):
+        finished = json.loads(self.load_fixture('fixtures/GET/job_details_success.json'))
+        building = json.loads(self.load_fixture('fixtures/GET/job_details_building.json'))
+        building['number'] = 3
+
+        responses.add(
+            responses.GET, 'http://jenkins.example.com/job/server/api/json/',
+            body=json.dumps({'builds': [building, finished]}))
+        for build_no in (2, 3):
+            responses.add(
+                responses.GET, 'http://jenkins.example.com/job/server/{0}/logText/progressiveHtml/?start=0'.format(build_no),
+                match_querystring=True,
+                adding_headers={'X-Text-Size': '0'},
+                body='')
+
+        step_finished = self.create_step(2)
+        step_building = self.create_step(3)
+
+        builder = self.get_builder()
+        builder.batch_sync = True
+        builder.sync_step(step_finished)
+        builder.sync_step(step_building)
+
+        assert step_finished.status == Status.finished
+        assert step_finished.result == Result.passed
+        assert step_building.status == Status.in_progress
+
+        snapshot_calls = [
+            c for c in responses.calls
+            if c.request.url.startswith('http://jenkins.example.com/job/server/api/json/')
+        ]
+        assert len(snapshot_calls) == 1
+        assert 'tree=builds' in snapshot_calls[0].request.url
+
+
+class JobSnapshotCacheTest(BaseTestCase):
+    def test_evicts_expired(self):
+        cache = JobSnapshotCache()
+
+        with mock.patch('changes.backends.jenkins.builder.time.time', return_value=100):
+            assert cache.get('foo', 3, lambda: {1: 'foo'}) == {1: 'foo'}
+            assert cache.get('foo', 3, lambda: {1: 'bar'}) == {1: 'foo'}
+
+        with mock.patch('changes.backends.jenkins.builder.time.time', return_value=102):
+            assert cache.get('bar', 3, lambda: {1: 'bar'}) == {1: 'bar'}
+            assert sorted(cache.snapshots) == ['bar', 'foo']
+
+        # only the snapshots which have expired are dropped
+        with mock.patch('changes.backends.jenkins.builder.time.time', return_value=104):
+            assert cache.get('baz', 3, lambda: {1: 'baz'}) == {1: 'baz'}
+            assert sorted(cache.snapshots) == ['bar', 'baz']
+            assert sorted(cache.key_locks) == ['bar', 'baz']
+
+    def test_keeps_snapshot_being_fetched(self):
+        cache = JobSnapshotCache()
+
+        with mock.patch('changes.backends.jenkins.builder.time.time', return_value=100):
+            cache.get('foo', 3, lambda: {1: 'foo'})
+
+        with mock.patch('changes.backends.jenkins.builder.time.time', return_value=104):
+            with cache.key_locks['foo']:
+                cache.get('bar', 3, lambda: {1: 'bar'})
+            assert sorted(cache.key_locks) == ['bar', 'foo']
+
+
 class ChunkedTest(BaseTestCase):
     def test_simple(self):
         foo = 'aaa\naaa\naaa\n'
@@ -0,0 +1,56 @@
+from __future__ import absolute_import
+
+import mock
+import responses
+
+from flask import current_app
+
+from changes.backends.http import HttpClient, get_http_client
+from changes.testutils import TestCase
+
+
+class HttpClientTest(TestCase):
+    @responses.activate
+    def test_records_stats(self):
+        responses.add(
+            responses.GET, 'http://jenkins.example.com/api/json/',
+            body='{}')
+        responses.add(
+            responses.POST, 'http://jenkins.example.com/job/server/build',
+            status=500)
+
+        client = HttpClient()
+        resp = client.get('http://jenkins.example.com/api/json/')
+        assert resp.text == '{}'
+
+        resp = client.post('http://jenkins.example.com/job/server/build')
+        assert resp.status_code == 500
+
+        stats = client.stats.as_dict()
+        assert stats.keys() == ['jenkins.example.com']
+        assert stats['jenkins.example.com']['requests'] == 2
+        assert stats['jenkins.example.com']['errors'] == 0
+
+    def test_only_retries_idempotent_requests(self):
+        client = HttpClient(max_retries=2)
+        url = 'http://jenkins.example.com/job/server/build'
+
+        assert client.session.get_adapter(url).max_retries == 2
+        assert client.unsafe_session.get_adapter(url).max_retries == 0
+
+        with mock.patch.object(client.session, 'request') as request:
+            client.get(url)
+        request.assert_called_once_with('GET', url)
+
+        with mock.patch.object(client.unsafe_session, 'request') as request:
+            client.post(url)
+        request.assert_called_once_with('POST', url)
+
+
+class GetHttpClientTest(TestCase):
+    def test_shared_per_process(self):
+        client = get_http_client()
+        assert get_http_client(current_app) is client
+
+        with mock.patch('changes.backends.http.os.getpid', return_value=-1):
+            assert get_http_client() is not client
@@ -0,0 +1,94 @@
+from __future__ import absolute_import
+
+import json
+import mock
+
+from flask import current_app
+
+from changes.ext.pubsub import _PubSubState
+from changes.testutils import TestCase
+
+
+class PubSubStateTest(TestCase):
+    def setUp(self):
+        super(PubSubStateTest, self).setUp()
+        patcher = mock.patch.object(_PubSubState, 'get_connection')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.state = _PubSubState(mock.Mock(), current_app)
+        self.state._spawn = lambda func, *args: func(*args)
+        self.state._listener = mock.Mock()
+        self.pubsub = self.state._pubsub
+
+    def test_subscribes_per_channel(self):
+        foo, bar = mock.Mock(), mock.Mock()
+
+        self.state.subscribe('builds:1', foo)
+        self.state.subscribe('builds:1', bar)
+        self.pubsub.subscribe.assert_called_once_with('builds:1')
+
+        self.state.subscribe('jobs:*', foo)
+        self.pubsub.psubscribe.assert_called_once_with('jobs:*')
+
+        self.state.unsubscribe('builds:1', foo)
+        assert not self.pubsub.unsubscribe.called
+
+        self.state.unsubscribe('builds:1', bar)
+        self.pubsub.unsubscribe.assert_called_once_with('builds:1')
+
+        self.state.unsubscribe('jobs:*', foo)
+        self.pubsub.punsubscribe.assert_called_once_with('jobs:*')
+
+    def test_routes_messages(self):
+        foo, bar = mock.Mock(), mock.Mock()
+
+        self.state.subscribe('builds:1', foo)
+        self.state.subscribe('jobs:*', bar)
+
+        data = json.dumps({'event': 'build.update'})
+
+        self.state._process_msg({
+            'type': 'message', 'pattern': None,
+            'channel': 'builds:1', 'data': data,
+        })
+        foo.assert_called_once_with({'event': 'build.update'})
+        assert not bar.called
+
+        self.state._process_msg({
+            'type': 'pmessage', 'pattern': 'jobs:*',
+            'channel': 'jobs:2', 'data': data,
+        })
+        bar.assert_called_once_with({'event': 'build.update'})
+
+        self.state._process_msg({
+            'type': 'message', 'pattern': None,
+            'channel': 'builds:2', 'data': data,
+        })
+        assert foo.call_count == 1
+
+    def test_get_replay(self):
+        self.state._redis.lrange.return_value = [
+            json.dumps({'seq': 3, 'event': 'build.update'}),
+            json.dumps({'seq': 2, 'event': 'build.update'}),
+            json.dumps({'seq': 1, 'event': 'build.update'}),
+        ]
+
+        events = self.state.get_replay('builds:1', 1)
+        self.state._redis.lrange.assert_called_once_with('pubsub:replay:builds:1', 0, -1)
+        assert [e['seq'] for e in events] == [2, 3]
+
+        assert self.state.get_replay('builds:*', 1) == []
+
+    def test_publish_many(self):
+        pipe = self.state._redis.pipeline.return_value
+        self.state._publish_script = mock.Mock()
+
+        self.state.publish_many(['builds:1', 'jobs:2'], {'event': 'build.update'})
+
+        assert self.state._publish_script.call_count == 2
+        _, kwargs = self.state._publish_script.call_args_list[0]
+        assert kwargs['keys'] == ['pubsub:seq', 'pubsub:replay:builds:1']
+        assert kwargs['args'][:2] == ['{"event": "build.update"}', 'builds:1']
+        assert kwargs['client'] is pipe
+        pipe.execute.assert_called_once_with()
@@ -1,11 +1,14 @@
+import mock
+import pytest
 import uuid
 
 from cStringIO import StringIO
+from lxml import etree
 
 from changes.constants import Result
-from changes.models import Job, TestResult
+from changes.models import Job, TestResult, TestResultManager
 from changes.handlers.xunit import XunitHandler
-from changes.testutils import SAMPLE_XUNIT
+from changes.testutils import SAMPLE_XUNIT, TestCase
 
 
 def test_result_generation():
@@ -39,3 +42,82 @@ E   ImportError: No module named mock"""
     assert r2.duration == 1.65796279907
     assert r2.result == Result.passed
     assert r2.message == ''
+
+
+def test_iter_tests_batches():
+    job = Job(
+        id=uuid.uuid4(),
+        project_id=uuid.uuid4()
+    )
+
+    fp = StringIO(SAMPLE_XUNIT)
+
+    handler = XunitHandler(job)
+    batches = list(handler.iter_tests(fp, batch_size=1))
+
+    assert len(batches) == 2
+    assert [len(b) for b in batches] == [1, 1]
+    assert batches[0][0].name == 'tests.test_report'
+    assert batches[0][0].result == Result.failed
+    assert batches[1][0].name == 'test_simple'
+    assert batches[1][0].result == Result.passed
+
+
+DUPLICATE_XUNIT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuite errors="0" failures="1" name="" skips="0" tests="2" time="0.077">
+    <testcase classname="tests.test_report" name="test_simple" time="0.001"/>
+    <testcase classname="tests.test_report" name="test_simple" time="0.002">
+        <failure message="flaky">AssertionError</failure>
+    </testcase>
+</testsuite>"""
+
+# a report which was cut off after its first test
+TRUNCATED_XUNIT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuite errors="0" failures="0" name="" skips="0" tests="2" time="0.077">
+    <testcase classname="tests.test_report" name="test_one" time="0.001"/>
+    <testcase classname="tests.test_report" name="test_tw"""
+
+
+class XunitHandlerTest(TestCase):
+    def iter_single_tests(self, handler):
+        # split the report into as many batches as possible
+        return mock.patch.object(handler, 'iter_tests', side_effect=lambda fp: (
+            XunitHandler.iter_tests(handler, fp, batch_size=1)))
+
+    @mock.patch.object(TestResultManager, 'merge')
+    def test_process_merges_report_at_once(self, merge):
+        job = self.create_job(self.create_build(self.project))
+
+        handler = XunitHandler(job)
+        with self.iter_single_tests(handler):
+            assert handler.process(StringIO(SAMPLE_XUNIT)) == 2
+
+        assert merge.call_count == 1
+        test_list = merge.call_args[0][0]
+        assert [t.name for t in test_list] == ['tests.test_report', 'test_simple']
+
+    def test_process_keeps_duplicates(self):
+        from changes.models import TestCase
+        job = self.create_job(self.create_build(self.project))
+
+        handler = XunitHandler(job)
+        with self.iter_single_tests(handler):
+            assert handler.process(StringIO(DUPLICATE_XUNIT)) == 2
+
+        testcases = sorted(
+            TestCase.query.filter_by(job_id=job.id), key=lambda t: t.duration)
+        assert len(testcases) == 2
+        assert [t.name for t in testcases] == ['test_simple', 'test_simple']
+        assert [t.result for t in testcases] == [Result.passed, Result.failed]
+
+    def test_process_saves_nothing_on_error(self):
+        from changes.models import TestCase, TestGroup
+        job = self.create_job(self.create_build(self.project))
+
+        handler = XunitHandler(job)
+        with self.iter_single_tests(handler):
+            with pytest.raises(etree.XMLSyntaxError):
+                handler.process(StringIO(TRUNCATED_XUNIT))
+
+        assert TestCase.query.filter_by(job_id=job.id).count() == 0
+        assert TestGroup.query.filter_by(job_id=job.id).count() == 0
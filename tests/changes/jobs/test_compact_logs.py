@@ -0,0 +1,64 @@
+from __future__ import absolute_import
+
+import mock
+
+from changes.config import db
+from changes.constants import Status
+from changes.jobs.compact_logs import compact_logs
+from changes.models import LogChunk, LogSegment, LogSource
+from changes.storage.blob import MemoryStorage
+from changes.storage.logs import LogSegmentStore
+from changes.testutils import TestCase
+
+
+class CompactLogsTest(TestCase):
+    def setUp(self):
+        super(CompactLogsTest, self).setUp()
+        build = self.create_build(self.project)
+        self.job = self.create_job(build, status=Status.finished)
+        self.source = LogSource(job=self.job, project=self.project, name='console')
+        db.session.add(self.source)
+
+        for offset in xrange(0, 40, 4):
+            db.session.add(LogChunk(
+                job=self.job, project=self.project, source=self.source,
+                offset=offset, size=4, text='foo\n',
+            ))
+        db.session.commit()
+
+    def get_chunks(self):
+        return list(LogChunk.query.filter(
+            LogChunk.source_id == self.source.id,
+        ).order_by(LogChunk.offset.asc()))
+
+    def test_merges_chunks(self):
+        compact_logs(job_id=self.job.id.hex)
+
+        chunks = self.get_chunks()
+        assert len(chunks) == 1
+        assert chunks[0].offset == 0
+        assert chunks[0].size == 40
+        assert chunks[0].text == 'foo\n' * 10
+
+    def test_unfinished_job(self):
+        self.job.status = Status.in_progress
+        db.session.commit()
+
+        compact_logs(job_id=self.job.id.hex)
+
+        assert len(self.get_chunks()) == 10
+
+    @mock.patch('changes.jobs.compact_logs.get_log_store')
+    def test_segment_storage(self, get_log_store):
+        get_log_store.return_value = LogSegmentStore(MemoryStorage())
+
+        compact_logs(job_id=self.job.id.hex)
+
+        assert self.get_chunks() == []
+
+        segments = list(LogSegment.query.filter(
+            LogSegment.source_id == self.source.id,
+        ))
+        assert len(segments) == 1
+        assert segments[0].offset == 0
+        assert segments[0].size == 40
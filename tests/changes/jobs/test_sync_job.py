@@ -66,6 +66,7 @@ class SyncJobTest(TestCase):
             'job_id': job.id.hex,
             'task_id': job.id.hex,
             'parent_task_id': build.id.hex,
+            'task_token': mock.ANY,
         }, countdown=5)
 
         publish_job_update.assert_called_once_with(job)
@@ -113,6 +114,10 @@ class SyncJobTest(TestCase):
             'job_id': job.id.hex,
         })
 
+        queue_delay.assert_any_call('compact_logs', kwargs={
+            'job_id': job.id.hex,
+        }, countdown=60)
+
         task = Task.query.get(task.id)
 
         assert task.status == Status.finished
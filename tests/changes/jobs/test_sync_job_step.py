@@ -63,6 +63,7 @@ class SyncJobStepTest(TestCase):
             'step_id': step.id.hex,
             'task_id': step.id.hex,
             'parent_task_id': job.id.hex,
+            'task_token': mock.ANY,
         }, countdown=5)
 
     @mock.patch('changes.config.queue.delay')
@@ -36,4 +36,5 @@ class SyncRepoTest(TestCase):
             'repo_id': repo.id.hex,
             'task_id': repo.id.hex,
             'parent_task_id': None,
+            'task_token': mock.ANY,
         }, countdown=5)
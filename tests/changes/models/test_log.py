@@ -0,0 +1,72 @@
+from __future__ import absolute_import
+
+import mock
+
+from changes.config import db
+from changes.models import LogChunk, LogChunkWriter, LogSource
+from changes.testutils import TestCase
+
+
+class LogChunkWriterTest(TestCase):
+    def setUp(self):
+        super(LogChunkWriterTest, self).setUp()
+        build = self.create_build(self.project)
+        self.job = self.create_job(build)
+        self.source = LogSource(job=self.job, project=self.project, name='console')
+        db.session.add(self.source)
+
+    def get_chunks(self):
+        return list(LogChunk.query.filter(
+            LogChunk.source_id == self.source.id,
+        ).order_by(LogChunk.offset.asc()))
+
+    def test_coalesces_flushes(self):
+        publish = mock.Mock()
+
+        writer = LogChunkWriter(
+            self.source, flush_size=8, flush_interval=60, publish=publish)
+        writer.write('foo\n')
+        assert publish.call_count == 0
+
+        writer.write('bar\n')
+        writer.write('baz\n')
+        writer.close()
+
+        assert writer.offset == 12
+
+        chunks = self.get_chunks()
+        assert [(c.offset, c.size, c.text) for c in chunks] == [
+            (0, 4, 'foo\n'),
+            (4, 4, 'bar\n'),
+            (8, 4, 'baz\n'),
+        ]
+        assert chunks[0].job_id == self.job.id
+        assert chunks[0].project_id == self.project.id
+
+        assert publish.call_count == 2
+        update = publish.call_args_list[0][0][0]
+        assert update.id == chunks[0].id
+        assert update.offset == 0
+        assert update.size == 8
+        assert update.text == 'foo\nbar\n'
+
+        update = publish.call_args_list[1][0][0]
+        assert update.offset == 8
+        assert update.size == 4
+        assert update.text == 'baz\n'
+
+    def test_updates_existing(self):
+        writer = LogChunkWriter(self.source)
+        writer.write('foo')
+        writer.close()
+
+        writer = LogChunkWriter(self.source)
+        writer.write('bar\n')
+        writer.write('baz\n')
+        writer.close()
+
+        chunks = self.get_chunks()
+        assert [(c.offset, c.size, c.text) for c in chunks] == [
+            (0, 4, 'bar\n'),
+            (4, 4, 'baz\n'),
+        ]
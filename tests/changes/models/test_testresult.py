@@ -1,7 +1,9 @@
+from hashlib import sha1
+
 from changes.config import db
 from changes.constants import Result
-from changes.models import TestSuite
-from changes.models.testresult import TestResult, TestResultManager
+from changes.models import AggregateTestGroup, AggregateTestSuite, TestSuite
+from changes.models.testresult import TestResult, TestResultManager, TestTree
 from changes.testutils.cases import TestCase
 
 
@@ -106,16 +108,481 @@ class TestResultManagerTestCase(TestCase):
 
         assert list(group_list[3].testcases) == [testcase_list[1]]
 
-        # agg_groups = sorted(AggregateTestGroup.query.all(), key=lambda x: x.name)
+        agg_groups = sorted(AggregateTestGroup.query.all(), key=lambda x: x.name)
+
+        assert len(agg_groups) == 4
+
+        for agg in agg_groups:
+            assert agg.first_job_id == job.id
+            assert agg.last_job_id == job.id
+            assert agg.project_id == self.project.id
+
+        assert agg_groups[0].name == 'tests.changes.handlers.test_coverage'
+        assert agg_groups[0].parent_id is None
+        assert agg_groups[1].name == 'tests.changes.handlers.test_coverage.test_foo'
+        assert agg_groups[1].parent_id == agg_groups[0].id
+        assert agg_groups[2].name == 'tests.changes.handlers.test_xunit'
+        assert agg_groups[2].parent_id is None
+        assert agg_groups[3].name == 'tests.changes.handlers.test_xunit.test_bar'
+        assert agg_groups[3].parent_id == agg_groups[2].id
+
+    def test_save_aggregate_groups_existing(self):
+        build = self.create_build(self.project)
+        first_job = self.create_job(build)
+        job = self.create_job(build)
+
+        existing = AggregateTestGroup(
+            project=self.project,
+            name='foo',
+            name_sha=sha1('foo').hexdigest(),
+            first_job=first_job,
+            last_job=first_job,
+        )
+        db.session.add(existing)
+        db.session.flush()
+
+        manager = TestResultManager(job)
+        agg_ids = manager.save_aggregate_groups([
+            ('foo', None),
+            ('foo.bar', 'foo'),
+        ])
+
+        assert agg_ids['foo'] == existing.id
+
+        db.session.expire_all()
+
+        existing = AggregateTestGroup.query.get(agg_ids['foo'])
+        assert existing.first_job_id == first_job.id
+        assert existing.last_job_id == job.id
+
+        child = AggregateTestGroup.query.get(agg_ids['foo.bar'])
+        assert child.name == 'foo.bar'
+        assert child.parent_id == existing.id
+        assert child.first_job_id == job.id
+        assert child.last_job_id == job.id
+
+    def test_save_aggregate_groups_no_duplicates(self):
+        build = self.create_build(self.project)
+        first_job = self.create_job(build)
+        job = self.create_job(build)
+
+        agg_ids = TestResultManager(first_job).save_aggregate_groups([
+            ('foo', None),
+        ])
+        assert TestResultManager(job).save_aggregate_groups([
+            ('foo', None),
+            ('foo.bar', 'foo'),
+        ])['foo'] == agg_ids['foo']
+
+        assert AggregateTestGroup.query.filter(
+            AggregateTestGroup.project_id == self.project.id,
+        ).count() == 2
+
+    def test_save_aggregate_suites(self):
+        build = self.create_build(self.project)
+        first_job = self.create_job(build)
+        job = self.create_job(build)
+
+        existing = AggregateTestSuite(
+            project=self.project,
+            name='foo',
+            name_sha=sha1('foo').hexdigest(),
+            first_job=first_job,
+            last_job=first_job,
+        )
+        db.session.add(existing)
+
+        suites = [
+            TestSuite(name='foo', name_sha=sha1('foo').hexdigest(), job=job, project=self.project),
+            TestSuite(name='bar', name_sha=sha1('bar').hexdigest(), job=job, project=self.project),
+        ]
+        db.session.add_all(suites)
+        db.session.flush()
+
+        manager = TestResultManager(job)
+        agg_ids = manager.save_aggregate_suites(suites)
+
+        assert agg_ids[existing.name_sha] == existing.id
+
+        db.session.expire_all()
+
+        existing = AggregateTestSuite.query.get(agg_ids[sha1('foo').hexdigest()])
+        assert existing.first_job_id == first_job.id
+        assert existing.last_job_id == job.id
+
+        new = AggregateTestSuite.query.get(agg_ids[sha1('bar').hexdigest()])
+        assert new.name == 'bar'
+        assert new.project_id == self.project.id
+        assert new.first_job_id == job.id
+        assert new.last_job_id == job.id
+
+    def test_bulk(self):
+        from changes.models import TestCase, TestGroup
+
+        build = self.create_build(self.project)
+        job = self.create_job(build)
+        suite = TestSuite(name='foobar', job=job, project=self.project)
+
+        db.session.add(suite)
+
+        results = [
+            TestResult(
+                job=job,
+                suite=suite,
+                name='test_bar',
+                package='tests.changes.handlers.test_xunit',
+                result=Result.failed,
+                message='collection failed',
+                duration=156,
+            ),
+            TestResult(
+                job=job,
+                suite=suite,
+                name='test_baz',
+                package='tests.changes.handlers.test_xunit',
+                result=Result.passed,
+                duration=10,
+            ),
+            TestResult(
+                job=job,
+                suite=suite,
+                name='test_foo',
+                package='tests.changes.handlers.test_coverage',
+                result=Result.passed,
+                message='foobar failed',
+                duration=12,
+            ),
+        ]
+        manager = TestResultManager(job)
+        manager.save(results, bulk=True)
+
+        testcase_list = sorted(TestCase.query.all(), key=lambda x: x.name)
+
+        assert len(testcase_list) == 3
+
+        for test in testcase_list:
+            assert test.job_id == job.id
+            assert test.project_id == self.project.id
+            assert test.suite_id == suite.id
+            assert len(test.groups) == 1
+
+        assert testcase_list[0].name == 'test_bar'
+        assert testcase_list[0].result == Result.failed
+        assert testcase_list[0].message == 'collection failed'
+        assert testcase_list[0].duration == 156
+
+        group_list = sorted(TestGroup.query.all(), key=lambda x: x.name)
+
+        assert len(group_list) == 6
+
+        for group in group_list:
+            assert group.job_id == job.id
+            assert group.project_id == self.project.id
+            assert group.suite_id == suite.id
+
+        assert group_list[0].name == 'tests.changes.handlers'
+        assert group_list[0].parent_id is None
+        assert group_list[0].duration == 178
+        assert group_list[0].num_tests == 3
+        assert group_list[0].num_failed == 1
+        assert group_list[0].result == Result.failed
+        assert group_list[0].num_leaves == 1
+
+        assert group_list[1].name == 'tests.changes.handlers.test_coverage'
+        assert group_list[1].parent_id == group_list[0].id
+        assert group_list[1].num_tests == 1
+        assert group_list[1].num_leaves == 1
+        assert list(group_list[1].testcases) == []
+
+        assert group_list[2].name == 'tests.changes.handlers.test_coverage.test_foo'
+        assert group_list[2].parent_id == group_list[1].id
+        assert list(group_list[2].testcases) == [testcase_list[2]]
+
+        assert group_list[3].name == 'tests.changes.handlers.test_xunit'
+        assert group_list[3].parent_id == group_list[0].id
+        assert group_list[3].duration == 166
+        assert group_list[3].num_tests == 2
+        assert group_list[3].num_failed == 1
+        assert group_list[3].result == Result.failed
+        assert group_list[3].num_leaves == 2
+
+        assert group_list[4].name == 'tests.changes.handlers.test_xunit.test_bar'
+        assert group_list[4].parent_id == group_list[3].id
+        assert group_list[4].duration == 156
+        assert group_list[4].num_tests == 1
+        assert group_list[4].num_failed == 1
+        assert group_list[4].num_leaves == 0
+        assert list(group_list[4].testcases) == [testcase_list[0]]
+
+        assert group_list[5].name == 'tests.changes.handlers.test_xunit.test_baz'
+        assert group_list[5].parent_id == group_list[3].id
+        assert group_list[5].result == Result.passed
+        assert list(group_list[5].testcases) == [testcase_list[1]]
+
+    def test_merge(self):
+        from changes.models import TestCase, TestGroup
+
+        build = self.create_build(self.project)
+        job = self.create_job(build)
+
+        manager = TestResultManager(job)
+        manager.merge([
+            TestResult(job=job, package='pkg.mod1', name='test_a',
+                       result=Result.passed, duration=10),
+            TestResult(job=job, package='pkg.mod1', name='test_b',
+                       result=Result.failed, duration=5),
+        ])
+        manager.merge([
+            TestResult(job=job, package='pkg.mod2', name='test_c',
+                       result=Result.passed, duration=7),
+        ])
+
+        assert TestCase.query.filter_by(job=job).count() == 3
+
+        groups = dict((g.name, g) for g in TestGroup.query.filter_by(job=job))
+
+        assert sorted(groups) == [
+            'pkg', 'pkg.mod1', 'pkg.mod1.test_a', 'pkg.mod1.test_b',
+            'pkg.mod2', 'pkg.mod2.test_c',
+        ]
+
+        assert groups['pkg'].parent_id is None
+        assert groups['pkg'].num_tests == 3
+        assert groups['pkg'].num_failed == 1
+        assert groups['pkg'].duration == 22
+        assert groups['pkg'].result == Result.failed
+
+        assert groups['pkg.mod1'].parent_id == groups['pkg'].id
+        assert groups['pkg.mod1'].num_tests == 2
+
+        assert groups['pkg.mod2'].parent_id == groups['pkg'].id
+        assert groups['pkg.mod2'].num_tests == 1
+        assert groups['pkg.mod2'].num_failed == 0
+        assert groups['pkg.mod2'].duration == 7
+        assert groups['pkg.mod2'].result == Result.passed
+
+        leaf = groups['pkg.mod2.test_c']
+        assert leaf.parent_id == groups['pkg.mod2'].id
+        assert [t.name for t in leaf.testcases] == ['test_c']
+
+    def test_merge_new_parent(self):
+        from changes.models import TestGroup
+
+        build = self.create_build(self.project)
+        job = self.create_job(build)
+
+        manager = TestResultManager(job)
+        manager.merge([
+            TestResult(job=job, package='a.b', name='test_one',
+                       result=Result.failed, duration=1),
+        ])
+        manager.merge([
+            TestResult(job=job, package='a.c', name='test_two',
+                       result=Result.passed, duration=2),
+            TestResult(job=job, package='a.c', name='test_three',
+                       result=Result.passed, duration=4),
+        ])
+
+        groups = dict((g.name, g) for g in TestGroup.query.filter_by(job=job))
+
+        # 'a' only became a group with the second shard, but still accounts
+        # for the tests of the first
+        assert groups['a'].parent_id is None
+        assert groups['a'].num_tests == 3
+        assert groups['a'].num_failed == 1
+        assert groups['a'].duration == 7
+        assert groups['a'].result == Result.failed
+
+        assert groups['a.b'].parent_id == groups['a'].id
+        assert groups['a.c'].parent_id == groups['a'].id
+        assert groups['a.c'].num_tests == 2
+
+    def test_merge_replaces_existing_tests(self):
+        from changes.models import TestCase, TestGroup
+
+        build = self.create_build(self.project)
+        job = self.create_job(build)
+
+        manager = TestResultManager(job)
+        manager.merge([
+            TestResult(job=job, package='a.b', name='test_x',
+                       result=Result.failed, duration=1),
+            TestResult(job=job, package='a.b', name='test_y',
+                       result=Result.passed, duration=2),
+        ])
+        manager.merge([
+            TestResult(job=job, package='a.b', name='test_x',
+                       result=Result.passed, duration=4),
+            TestResult(job=job, package='a.b', name='test_y',
+                       result=Result.passed, duration=2),
+        ])
+
+        testcases = dict(
+            (t.name, t) for t in TestCase.query.filter_by(job=job))
+        assert sorted(testcases) == ['test_x', 'test_y']
+        assert testcases['test_x'].result == Result.passed
+        assert testcases['test_x'].duration == 4
+
+        groups = dict((g.name, g) for g in TestGroup.query.filter_by(job=job))
+
+        assert sorted(groups) == ['a', 'a.b', 'a.b.test_x', 'a.b.test_y']
+
+        for name in ('a', 'a.b'):
+            assert groups[name].num_tests == 2
+            assert groups[name].num_failed == 0
+            assert groups[name].duration == 6
+            assert groups[name].result == Result.passed
+
+        assert groups['a.b'].num_leaves == 2
+        assert [t.id for t in groups['a.b.test_x'].testcases] == [
+            testcases['test_x'].id]
+
+    def test_merge_new_groups_into_existing_tree(self):
+        from changes.models import TestCase, TestGroup
+
+        build = self.create_build(self.project)
+        job = self.create_job(build)
+
+        manager = TestResultManager(job)
+        manager.merge([
+            TestResult(job=job, package='a.b.c', name='test_one',
+                       result=Result.passed, duration=1),
+            TestResult(job=job, package='a.b.c', name='test_two',
+                       result=Result.passed, duration=2),
+        ])
+        manager.merge([
+            TestResult(job=job, package='a.b.d', name='test_three',
+                       result=Result.failed, duration=4),
+            TestResult(job=job, package='a.b.d', name='test_four',
+                       result=Result.passed, duration=8),
+            TestResult(job=job, package='a.e', name='test_five',
+                       result=Result.passed, duration=16),
+        ])
+
+        assert TestCase.query.filter_by(job=job).count() == 5
+
+        groups = dict((g.name, g) for g in TestGroup.query.filter_by(job=job))
+
+        assert sorted(groups) == [
+            'a.b', 'a.b.c', 'a.b.c.test_one', 'a.b.c.test_two', 'a.b.d',
+            'a.b.d.test_four', 'a.b.d.test_three', 'a.e', 'a.e.test_five',
+        ]
+
+        assert groups['a.b'].parent_id is None
+        assert groups['a.b'].num_tests == 4
+        assert groups['a.b'].num_failed == 1
+        assert groups['a.b'].duration == 15
+        assert groups['a.b'].result == Result.failed
+
+        assert groups['a.b.c'].parent_id == groups['a.b'].id
+        assert groups['a.b.c'].num_tests == 2
+
+        assert groups['a.b.d'].parent_id == groups['a.b'].id
+        assert groups['a.b.d'].num_tests == 2
+        assert groups['a.b.d'].num_failed == 1
+        assert groups['a.b.d'].result == Result.failed
+
+        assert groups['a.b.d.test_three'].parent_id == groups['a.b.d'].id
+
+        assert groups['a.e'].parent_id is None
+        assert groups['a.e'].num_tests == 1
+        assert groups['a.e.test_five'].parent_id == groups['a.e'].id
+
+    def get_tree(self, job):
+        from changes.models import TestGroup
+
+        groups = list(TestGroup.query.filter_by(job=job))
+        names = dict((g.id, g.name) for g in groups)
+        return sorted(
+            (g.name, names.get(g.parent_id), g.num_tests, g.num_failed,
+             g.duration, g.result, g.num_leaves,
+             sorted(t.name for t in g.testcases))
+            for g in groups
+        )
+
+    def test_merge_matches_save(self):
+        def get_results(job):
+            return [
+                TestResult(job=job, package='a.b', name='test_one',
+                           result=Result.failed, duration=1),
+                TestResult(job=job, package='a.b', name='test_two',
+                           result=Result.passed, duration=2),
+                TestResult(job=job, package='a.c.d', name='test_three',
+                           result=Result.passed, duration=4),
+                TestResult(job=job, package='a.c.e', name='test_four',
+                           result=Result.passed, duration=8),
+                TestResult(job=job, package='a.c.e', name='test_five',
+                           result=Result.skipped, duration=16),
+                TestResult(job=job, package='a.c', name='test_six',
+                           result=Result.passed, duration=32),
+                TestResult(job=job, package='f', name='test_seven',
+                           result=Result.passed, duration=64),
+                TestResult(job=job, name='test_eight',
+                           result=Result.passed, duration=128),
+            ]
+
+        build = self.create_build(self.project)
+        job = self.create_job(build)
+        TestResultManager(job).save(get_results(job))
+        expected = self.get_tree(job)
+
+        for shards in ([[0], [1], [2, 3], [4, 5, 6, 7]],
+                       [[5], [2], [4], [3], [0], [7], [1], [6]],
+                       [[0, 2, 4, 6], [1, 3, 5, 7]],
+                       [[6, 7], [0, 1, 2, 3, 4, 5]]):
+            job = self.create_job(build)
+            manager = TestResultManager(job)
+            for shard in shards:
+                results = get_results(job)
+                manager.merge([results[idx] for idx in shard])
+
+            assert self.get_tree(job) == expected, shards
+
+
+class TestTreeTestCase(TestCase):
+    def test_matches_regroup_tests(self):
+        job = self.create_job(self.create_build(self.project))
+
+        results = [
+            TestResult(job=job, package='a.b.c', name='test_foo', duration=1),
+            TestResult(job=job, package='a.b.c', name='test_bar', duration=2,
+                       result=Result.failed),
+            TestResult(job=job, package='a.b.d', name='test_baz', duration=4),
+            TestResult(job=job, package='a.e.f', name='test_foo', duration=8),
+            TestResult(job=job, name='test_root', duration=16),
+        ]
+
+        manager = TestResultManager(job)
+        leaf_counts = manager.count_leaves_with_tests(results)
+        expected = dict(
+            (name, tests)
+            for (name, _), tests in manager.regroup_tests(results)
+            if leaf_counts.get(name, 0) >= 1
+        )
+
+        tree = TestTree(results)
+        groups = list(tree.iter_groups())
+
+        assert sorted(n.name for n, _ in groups) == sorted(expected)
+        assert sorted(expected) == ['a.b', 'a.b.c', 'a.b.d', 'a.e.f']
 
-        # assert len(agg_groups) == 4
+        groups_by_name = dict((n.name, (n, p)) for n, p in groups)
+        for name, tests in expected.iteritems():
+            node, parent = groups_by_name[name]
+            assert node.num_tests == len(tests)
+            assert node.duration == sum(t.duration for t in tests)
+            assert node.num_failed == len([t for t in tests if t.result == Result.failed])
+            assert node.num_leaves == leaf_counts[name]
 
-        # for agg in agg_groups:
-        #     # assert agg.last_job == build
-        #     assert agg.first_job_id == job.id
-        #     assert agg.project_id == self.project.id
+        assert groups_by_name['a.b'][1] is None
+        assert groups_by_name['a.b.c'][1].name == 'a.b'
+        assert groups_by_name['a.b.c'][0].result == Result.failed
+        assert groups_by_name['a.e.f'][1] is None
 
-        # assert agg_groups[0].name == 'tests.changes.handlers.test_coverage'
-        # assert agg_groups[1].name == 'tests.changes.handlers.test_coverage.test_foo'
-        # assert agg_groups[2].name == 'tests.changes.handlers.test_xunit'
-        # assert agg_groups[3].name == 'tests.changes.handlers.test_xunit.test_bar'
+        leaves = dict((tests[0].id, p.name) for tests, p in tree.iter_leaves())
+        assert leaves == {
+            'a.b.c.test_foo': 'a.b.c',
+            'a.b.c.test_bar': 'a.b.c',
+            'a.b.d.test_baz': 'a.b.d',
+            'a.e.f.test_foo': 'a.e.f',
+        }
@@ -0,0 +1,188 @@
+from __future__ import absolute_import
+
+import mock
+
+from datetime import datetime, timedelta
+from uuid import UUID
+
+from changes.config import redis
+from changes.constants import Result, Status
+from changes.models import Task
+from changes.queue.store import RedisTaskStore
+from changes.testutils import TestCase
+
+
+class RedisTaskStoreTest(TestCase):
+    task_id = UUID('33846695b2774b29a71795a009e8168a')
+    parent_id = UUID('659974858dcf4aa08e73a940e1066328')
+
+    def setUp(self):
+        super(RedisTaskStoreTest, self).setUp()
+        self.store = RedisTaskStore()
+
+    def test_create(self):
+        task = self.store.create(
+            'foo', self.parent_id.hex, self.task_id.hex, data={'kwargs': {}})
+
+        assert task.status == Status.queued
+
+        # tasks are not written to the database until they're snapshotted
+        assert Task.query.count() == 0
+
+        children = self.store.get_children(self.parent_id.hex)
+        assert len(children) == 1
+        assert children[0].task_name == 'foo'
+        assert children[0].task_id == self.task_id
+        assert children[0].parent_id == self.parent_id
+        assert children[0].data == {'kwargs': {}}
+
+        assert self.store.create(
+            'foo', self.parent_id.hex, self.task_id.hex, data={}) is None
+
+    def test_get_or_create(self):
+        task, created = self.store.get_or_create(
+            'foo', self.parent_id.hex, self.task_id.hex, data={'kwargs': {}})
+        assert created
+        assert task.status == Status.queued
+
+        task, created = self.store.get_or_create(
+            'foo', self.parent_id.hex, self.task_id.hex, data={})
+        assert not created
+        assert task.data == {'kwargs': {}}
+
+    def test_get_or_create_lost_race(self):
+        self.store.create(
+            'foo', self.parent_id.hex, self.task_id.hex, data={'kwargs': {}})
+
+        # another process creates the task between our read and our write
+        get = self.store.get
+        with mock.patch.object(self.store, 'get', side_effect=[None, get(
+                'foo', self.parent_id.hex, self.task_id.hex)]):
+            task, created = self.store.get_or_create(
+                'foo', self.parent_id.hex, self.task_id.hex, data={})
+
+        assert not created
+        assert task.data == {'kwargs': {}}
+
+    def test_get_or_create_while_being_created(self):
+        # another process has claimed the task but not yet written the rest
+        redis.hsetnx(
+            self.store._key('foo', self.parent_id.hex, self.task_id.hex),
+            'task_id', self.task_id.hex)
+
+        task, created = self.store.get_or_create(
+            'foo', self.parent_id.hex, self.task_id.hex, data={'kwargs': {}})
+
+        assert not created
+        assert task.task_id == self.task_id
+        assert task.status == Status.queued
+
+    def test_transitions(self):
+        self.store.create(
+            'foo', self.parent_id.hex, self.task_id.hex, data={'kwargs': {}})
+
+        self.store.mark_in_progress(
+            'foo', self.parent_id.hex, self.task_id.hex, retry=True)
+
+        task = self.store.get('foo', self.parent_id.hex, self.task_id.hex)
+        assert task.status == Status.in_progress
+        assert task.num_retries == 1
+
+        date_started = datetime(2013, 9, 19, 22, 15, 22)
+        date_finished = datetime(2013, 9, 19, 22, 15, 33)
+        self.store.mark_finished(
+            'foo', self.parent_id.hex, self.task_id.hex,
+            date_started=date_started, date_finished=date_finished)
+
+        task = self.store.get('foo', self.parent_id.hex, self.task_id.hex)
+        assert task.status == Status.finished
+        assert task.date_started == date_started
+        assert task.date_finished == date_finished
+
+    def test_expire(self):
+        task = self.store.create(
+            'foo', self.parent_id.hex, self.task_id.hex, data={'kwargs': {}})
+
+        self.store.expire([task], datetime.utcnow())
+
+        task = self.store.get('foo', self.parent_id.hex, self.task_id.hex)
+        assert task.status == Status.finished
+        assert task.result == Result.aborted
+
+    def test_check_children(self):
+        current_datetime = datetime.utcnow()
+
+        stale = self.store.create(
+            'foo', self.parent_id.hex, self.task_id.hex, data={'kwargs': {}})
+        self.store.touch([stale], current_datetime - timedelta(minutes=10))
+
+        expired = self.store.create(
+            'bar', self.parent_id.hex, self.task_id.hex, data={'kwargs': {}})
+        self.store.touch([expired], current_datetime - timedelta(hours=1))
+
+        num_expired, num_pending, need_run = self.store.check_children(
+            self.parent_id.hex,
+            run_before=current_datetime - timedelta(minutes=5),
+            expire_before=current_datetime - timedelta(minutes=30),
+            date_modified=current_datetime,
+        )
+
+        assert num_expired == 1
+        assert num_pending == 1
+        assert [t.task_name for t in need_run] == ['foo']
+
+        task = self.store.get('bar', self.parent_id.hex, self.task_id.hex)
+        assert task.status == Status.finished
+        assert task.result == Result.aborted
+
+    def test_find(self):
+        self.store.create(
+            'foo', self.parent_id.hex, self.task_id.hex, data={'kwargs': {}})
+        self.store.create(
+            'bar', None, self.task_id.hex, data={'kwargs': {}})
+
+        task_list = self.store.find(self.task_id.hex)
+        assert sorted(t.task_name for t in task_list) == ['bar', 'foo']
+
+    def test_snapshot(self):
+        existing = self.create_task(
+            task_name='bar',
+            task_id=UUID('70e090f5c41e4175a9fd630464804bb0'),
+            parent_id=self.parent_id,
+            status=Status.queued,
+        )
+
+        self.store.create(
+            'foo', self.parent_id.hex, self.task_id.hex, data={'kwargs': {}})
+        self.store.mark_in_progress(
+            'bar', self.parent_id.hex, existing.task_id.hex)
+
+        assert self.store.snapshot() == 2
+        # nothing has changed since
+        assert self.store.snapshot() == 0
+
+        task = Task.query.filter(Task.task_id == self.task_id).one()
+        assert task.task_name == 'foo'
+        assert task.parent_id == self.parent_id
+        assert task.status == Status.queued
+
+        task = Task.query.filter(Task.task_id == existing.task_id).one()
+        assert task.status == Status.in_progress
+
+    def test_reconcile(self):
+        task = self.create_task(
+            task_name='foo',
+            task_id=self.task_id,
+            parent_id=self.parent_id,
+            status=Status.in_progress,
+        )
+
+        # the task is missing from redis, so it gets loaded
+        assert self.store.reconcile() == (1, 0)
+
+        children = self.store.get_children(self.parent_id.hex)
+        assert [c.task_id for c in children] == [task.task_id]
+
+        # once the pending snapshot has been written both sides agree
+        self.store.snapshot()
+        assert self.store.reconcile() == (0, 0)
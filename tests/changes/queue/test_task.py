@@ -2,13 +2,16 @@ from __future__ import absolute_import
 
 import mock
 
+from datetime import datetime, timedelta
 from uuid import UUID
 
 from changes.config import db
 from changes.constants import Result, Status
 from changes.models import Task
 from changes.testutils import TestCase
-from changes.queue.task import tracked_task
+from changes.queue.task import (
+    flush_poll_stats, get_poll_countdown, record_poll, tracked_task
+)
 
 
 @tracked_task
@@ -21,11 +24,23 @@ def unfinished_task(foo='bar'):
     raise unfinished_task.NotFinished
 
 
+@tracked_task
+def waiting_task(foo='bar'):
+    raise waiting_task.NotFinished(countdown=60)
+
+
 @tracked_task
 def error_task(foo='bar'):
     raise Exception
 
 
+@tracked_task
+def parent_task(child_id):
+    # the child finishes while its parent is still running
+    success_task(task_id=child_id, parent_task_id=parent_task.task_id)
+    raise parent_task.NotFinished(countdown=60)
+
+
 class DelayTest(TestCase):
     @mock.patch('changes.config.queue.delay')
     def test_simple(self, queue_delay):
@@ -171,19 +186,17 @@ class VerifyAllChildrenTest(TestCase):
         result = success_task.verify_all_children()
         assert result == Status.finished
 
-    @mock.patch('changes.queue.task.needs_requeued')
     @mock.patch('changes.config.queue.delay')
-    def test_child_needs_run(self, queue_delay, needs_requeued):
+    def test_child_needs_run(self, queue_delay):
         child_id = UUID('33846695b2774b29a71795a009e8168a')
         parent_task_id = UUID('659974858dcf4aa08e73a940e1066328')
 
-        needs_requeued.return_value = True
-
         task = self.create_task(
             task_name='success_task',
             task_id=child_id,
             parent_id=parent_task_id,
             status=Status.in_progress,
+            date_modified=datetime.utcnow() - timedelta(minutes=10),
             data={
                 'kwargs': {'foo': 'bar'},
             },
@@ -195,7 +208,6 @@ class VerifyAllChildrenTest(TestCase):
 
         assert result == Status.in_progress
 
-        needs_requeued.assert_called_once_with(task)
         queue_delay.assert_called_once_with(
             'success_task', kwargs={
                 'task_id': child_id.hex,
@@ -204,19 +216,21 @@ class VerifyAllChildrenTest(TestCase):
             },
         )
 
-    @mock.patch('changes.queue.task.needs_expired')
+        db.session.refresh(task)
+
+        assert task.date_modified > datetime.utcnow() - timedelta(minutes=1)
+
     @mock.patch('changes.config.queue.delay')
-    def test_child_is_expired(self, queue_delay, needs_expired):
+    def test_child_is_expired(self, queue_delay):
         child_id = UUID('33846695b2774b29a71795a009e8168a')
         parent_task_id = UUID('659974858dcf4aa08e73a940e1066328')
 
-        needs_expired.return_value = True
-
         task = self.create_task(
             task_name='success_task',
             task_id=child_id,
             parent_id=parent_task_id,
             status=Status.in_progress,
+            date_modified=datetime.utcnow() - timedelta(hours=1),
             data={
                 'kwargs': {'foo': 'bar'},
             },
@@ -230,11 +244,11 @@ class VerifyAllChildrenTest(TestCase):
 
         db.session.refresh(task)
 
-        needs_expired.assert_called_once_with(task)
-
         assert task.status == Status.finished
         assert task.result == Result.aborted
 
+        assert not queue_delay.called
+
 
 class RunTest(TestCase):
     @mock.patch('changes.config.queue.delay')
@@ -297,10 +311,166 @@ class RunTest(TestCase):
                 'foo': 'bar',
                 'task_id': task_id.hex,
                 'parent_task_id': parent_task_id.hex,
+                'task_token': mock.ANY,
             },
             countdown=5,
         )
 
+    @mock.patch('changes.config.queue.delay')
+    @mock.patch('changes.config.queue.retry')
+    def test_unfinished_with_countdown(self, queue_retry, queue_delay):
+        task_id = UUID('33846695b2774b29a71795a009e8168a')
+        parent_task_id = UUID('659974858dcf4aa08e73a940e1066328')
+
+        self.create_task(
+            task_name='waiting_task',
+            task_id=task_id,
+            parent_id=parent_task_id,
+        )
+
+        waiting_task(
+            foo='bar',
+            task_id=task_id.hex,
+            parent_task_id=parent_task_id.hex,
+        )
+
+        queue_delay.assert_called_once_with(
+            'waiting_task',
+            kwargs={
+                'foo': 'bar',
+                'task_id': task_id.hex,
+                'parent_task_id': parent_task_id.hex,
+                'task_token': mock.ANY,
+            },
+            countdown=60,
+        )
+
+    @mock.patch('changes.config.queue.delay')
+    @mock.patch('changes.config.queue.retry')
+    def test_success_wakes_parent(self, queue_retry, queue_delay):
+        task_id = UUID('33846695b2774b29a71795a009e8168a')
+        parent_task_id = UUID('659974858dcf4aa08e73a940e1066328')
+
+        self.create_task(
+            task_name='unfinished_task',
+            task_id=parent_task_id,
+            status=Status.in_progress,
+            data={
+                'kwargs': {'foo': 'baz'},
+            },
+        )
+        self.create_task(
+            task_name='success_task',
+            task_id=task_id,
+            parent_id=parent_task_id,
+        )
+
+        success_task(
+            foo='bar',
+            task_id=task_id.hex,
+            parent_task_id=parent_task_id.hex,
+        )
+
+        queue_delay.assert_called_once_with(
+            'unfinished_task',
+            kwargs={
+                'foo': 'baz',
+                'task_id': parent_task_id.hex,
+                'parent_task_id': None,
+                'task_token': mock.ANY,
+            },
+            countdown=1,
+        )
+
+        # a second child finishing shortly after shouldn't wake it up again
+        queue_delay.reset_mock()
+
+        sibling_id = UUID('70e090f5c41e4175a9fd630464804bb0')
+        self.create_task(
+            task_name='success_task',
+            task_id=sibling_id,
+            parent_id=parent_task_id,
+        )
+
+        success_task(
+            foo='bar',
+            task_id=sibling_id.hex,
+            parent_task_id=parent_task_id.hex,
+        )
+
+        assert not queue_delay.called
+
+    @mock.patch('changes.config.queue.delay')
+    @mock.patch('changes.config.queue.retry')
+    def test_wakeup_supersedes_scheduled_run(self, queue_retry, queue_delay):
+        task_id = UUID('33846695b2774b29a71795a009e8168a')
+        parent_task_id = UUID('659974858dcf4aa08e73a940e1066328')
+
+        self.create_task(
+            task_name='waiting_task',
+            task_id=parent_task_id,
+            status=Status.in_progress,
+            data={
+                'kwargs': {'foo': 'baz'},
+            },
+        )
+        self.create_task(
+            task_name='success_task',
+            task_id=task_id,
+            parent_id=parent_task_id,
+        )
+
+        waiting_task(foo='baz', task_id=parent_task_id.hex)
+        scheduled = queue_delay.call_args[1]['kwargs']
+
+        success_task(
+            foo='bar',
+            task_id=task_id.hex,
+            parent_task_id=parent_task_id.hex,
+        )
+        woken = queue_delay.call_args[1]['kwargs']
+        assert woken['task_token'] != scheduled['task_token']
+
+        # the run the parent scheduled itself is dropped
+        queue_delay.reset_mock()
+        waiting_task(**scheduled)
+        assert not queue_delay.called
+
+        waiting_task(**woken)
+        assert queue_delay.call_count == 1
+
+    @mock.patch('changes.config.queue.delay')
+    @mock.patch('changes.config.queue.retry')
+    def test_wakeup_during_first_run(self, queue_retry, queue_delay):
+        task_id = UUID('33846695b2774b29a71795a009e8168a')
+        parent_task_id = UUID('659974858dcf4aa08e73a940e1066328')
+
+        self.create_task(
+            task_name='parent_task',
+            task_id=parent_task_id,
+            status=Status.in_progress,
+            data={
+                'kwargs': {'child_id': task_id.hex},
+            },
+        )
+        self.create_task(
+            task_name='success_task',
+            task_id=task_id,
+            parent_id=parent_task_id,
+        )
+
+        # the first run of a task is enqueued without a token
+        parent_task(child_id=task_id.hex, task_id=parent_task_id.hex)
+
+        assert queue_delay.call_count == 2
+        woken, scheduled = queue_delay.call_args_list
+        assert woken[1]['countdown'] == 1
+
+        # the run the parent schedules replaces the wakeup, so it mustn't wait
+        # out its own countdown
+        assert scheduled[1]['countdown'] == 1
+        assert scheduled[1]['kwargs']['task_token'] != woken[1]['kwargs']['task_token']
+
     @mock.patch('changes.config.queue.delay')
     @mock.patch('changes.config.queue.retry')
     def test_error(self, queue_retry, queue_delay):
@@ -341,3 +511,35 @@ class RunTest(TestCase):
             },
             countdown=60,
         )
+
+
+class GetPollCountdownTest(TestCase):
+    def test_no_history(self):
+        assert get_poll_countdown(datetime.utcnow(), None) == 5
+        assert get_poll_countdown(None, 60000) == 5
+
+    def test_far_from_finish(self):
+        date_started = datetime.utcnow() - timedelta(minutes=5)
+        assert get_poll_countdown(date_started, 3 * 3600 * 1000) == 60
+
+    def test_near_finish(self):
+        date_started = datetime.utcnow() - timedelta(seconds=200)
+        countdown = get_poll_countdown(date_started, 300 * 1000)
+        assert 20 <= countdown <= 25
+
+    def test_overdue(self):
+        date_started = datetime.utcnow() - timedelta(minutes=10)
+        assert get_poll_countdown(date_started, 60000) == 5
+
+
+class PollStatsTest(TestCase):
+    def test_simple(self):
+        build_id = UUID('659974858dcf4aa08e73a940e1066328')
+
+        record_poll(build_id, 60)
+        record_poll(build_id, 20)
+        record_poll(build_id, 5)
+
+        # 85 seconds at a fixed 5 second countdown would have been 17 polls
+        assert flush_poll_stats(build_id) == (3, 14)
+        assert flush_poll_stats(build_id) == (0, 0)
@@ -0,0 +1,30 @@
+from __future__ import absolute_import
+
+import pytest
+import shutil
+import tempfile
+
+from changes.storage.blob import BlobNotFound, FileSystemStorage
+from changes.testutils import TestCase
+
+
+class FileSystemStorageTest(TestCase):
+    def setUp(self):
+        super(FileSystemStorageTest, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.storage = FileSystemStorage(root=self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        super(FileSystemStorageTest, self).tearDown()
+
+    def test_simple(self):
+        self.storage.put('foo/bar.z', 'hello')
+        assert self.storage.get('foo/bar.z') == 'hello'
+
+        self.storage.put('foo/bar.z', 'world')
+        assert self.storage.get('foo/bar.z') == 'world'
+
+        self.storage.delete('foo/bar.z')
+        with pytest.raises(BlobNotFound):
+            self.storage.get('foo/bar.z')
@@ -0,0 +1,120 @@
+from __future__ import absolute_import
+
+import zlib
+
+from changes.config import db
+from changes.models import LogChunk, LogSegment, LogSource
+from changes.storage.blob import MemoryStorage
+from changes.storage.logs import (
+    DatabaseLogStore, LogSegmentStore, find_tail_offset
+)
+from changes.testutils import TestCase
+
+
+class LogSegmentStoreTest(TestCase):
+    def setUp(self):
+        super(LogSegmentStoreTest, self).setUp()
+        build = self.create_build(self.project)
+        self.job = self.create_job(build)
+        self.source = LogSource(job=self.job, project=self.project, name='console')
+        db.session.add(self.source)
+        db.session.flush()
+
+        self.storage = MemoryStorage()
+        self.store = LogSegmentStore(self.storage)
+
+    def test_append_and_read(self):
+        assert self.store.get_size(self.source) is None
+
+        self.store.append(self.source, 0, 'foo\nbar\n')
+        self.store.append(self.source, 8, 'baz\n')
+
+        assert self.store.get_size(self.source) == 12
+        # segments are stored compressed
+        key = self.store.get_key(self.source, 0)
+        assert zlib.decompress(self.storage.get(key)) == 'foo\nbar\n'
+
+        chunks = self.store.read(self.source)
+        assert [(c.offset, c.size, c.text) for c in chunks] == [
+            (0, 8, 'foo\nbar\n'),
+            (8, 4, 'baz\n'),
+        ]
+
+        chunks = self.store.read(self.source, offset=4, limit=6)
+        assert [(c.offset, c.size, c.text) for c in chunks] == [
+            (4, 4, 'bar\n'),
+            (8, 2, 'ba'),
+        ]
+
+    def test_import_chunks(self):
+        for offset, text in ((0, 'foo\n'), (4, 'bar\n'), (8, 'baz\n')):
+            db.session.add(LogChunk(
+                job=self.job, project=self.project, source=self.source,
+                offset=offset, size=len(text), text=text,
+            ))
+        db.session.flush()
+
+        assert self.store.import_chunks(self.source, segment_size=8) == 3
+
+        assert LogChunk.query.filter_by(source=self.source).count() == 0
+        segments = list(LogSegment.query.filter_by(
+            source=self.source,
+        ).order_by(LogSegment.offset.asc()))
+        assert [(s.offset, s.size) for s in segments] == [(0, 8), (8, 4)]
+
+        chunks = self.store.read(self.source)
+        assert ''.join(c.text for c in chunks) == 'foo\nbar\nbaz\n'
+
+
+class DatabaseLogStoreTest(TestCase):
+    def setUp(self):
+        super(DatabaseLogStoreTest, self).setUp()
+        build = self.create_build(self.project)
+        job = self.create_job(build)
+        self.source = LogSource(job=job, project=self.project, name='console')
+        db.session.add(self.source)
+
+        for offset, text in ((0, 'foo\n'), (4, 'bar\n'), (8, 'baz\n')):
+            db.session.add(LogChunk(
+                job=job, project=self.project, source=self.source,
+                offset=offset, size=len(text), text=text,
+            ))
+
+        self.store = DatabaseLogStore()
+
+    def test_read(self):
+        assert self.store.get_size(self.source) == 12
+
+        chunks = self.store.read(self.source, offset=6, limit=4)
+        assert [(c.offset, c.text) for c in chunks] == [
+            (6, 'r\n'),
+            (8, 'ba'),
+        ]
+
+    def test_find_tail_offset(self):
+        assert find_tail_offset(self.store, self.source, 12, 0) == 12
+        assert find_tail_offset(self.store, self.source, 12, 1) == 8
+        assert find_tail_offset(self.store, self.source, 12, 2) == 4
+        assert find_tail_offset(self.store, self.source, 12, 10) == 0
+
+    def test_compact(self):
+        db.session.flush()
+
+        assert self.store.compact(self.source, chunk_size=8) == (3, 2)
+
+        chunks = list(LogChunk.query.filter(
+            LogChunk.source_id == self.source.id,
+        ).order_by(LogChunk.offset.asc()))
+        assert [(c.offset, c.size, c.text) for c in chunks] == [
+            (0, 8, 'foo\nbar\n'),
+            (8, 4, 'baz\n'),
+        ]
+
+        # offsets within a merged chunk still read correctly
+        chunks = self.store.read(self.source, offset=6, limit=4)
+        assert [(c.offset, c.text) for c in chunks] == [
+            (6, 'r\n'),
+            (8, 'ba'),
+        ]
+
+        assert self.store.compact(self.source, chunk_size=8) == (2, 2)
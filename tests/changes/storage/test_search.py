@@ -0,0 +1,115 @@
+from __future__ import absolute_import
+
+from changes.config import db
+from changes.models import LogChunk, LogChunkWriter, LogSearchBlock, LogSource
+from changes.storage.search import get_index_prefix, index_source, search_logs
+from changes.testutils import TestCase
+
+
+class SearchLogsTest(TestCase):
+    def setUp(self):
+        super(SearchLogsTest, self).setUp()
+        build = self.create_build(self.project)
+        self.job = self.create_job(build)
+        self.source = LogSource(job=self.job, project=self.project, name='console')
+        db.session.add(self.source)
+
+    def write_log(self, *texts, **kwargs):
+        writer = LogChunkWriter(self.source, flush_size=8, index=True, **kwargs)
+        for text in texts:
+            writer.write(text)
+        writer.close()
+
+    def get_blocks(self):
+        return [(b.offset, b.size) for b in LogSearchBlock.query.filter(
+            LogSearchBlock.source_id == self.source.id,
+        ).order_by(LogSearchBlock.offset.asc())]
+
+    def test_indexed(self):
+        self.write_log('foo\nbar\n', 'baz\nerror: bad\n', 'done\n')
+
+        assert self.get_blocks() == [(0, 8), (8, 15), (23, 5)]
+
+        matches, has_more = search_logs([self.source], 'error')
+        assert not has_more
+        assert len(matches) == 1
+        assert matches[0]['source'] == self.source
+        assert matches[0]['offset'] == 12
+        assert matches[0]['text'] == 'error: bad'
+        assert matches[0]['before'] == ['baz']
+        assert matches[0]['after'] == []
+
+        matches, _ = search_logs([self.source], 'ba[rz]', regex=True)
+        assert [m['offset'] for m in matches] == [4, 8]
+
+        matches, has_more = search_logs([self.source], 'ba[rz]', regex=True, limit=1)
+        assert has_more
+        assert [m['offset'] for m in matches] == [4]
+
+        matches, _ = search_logs([self.source], 'missing')
+        assert matches == []
+
+    def test_unindexed(self):
+        db.session.add(LogChunk(
+            job=self.job, project=self.project, source=self.source,
+            offset=0, size=14, text='foo\nerror: bad',
+        ))
+        db.session.flush()
+
+        matches, _ = search_logs([self.source], 'error', context=1)
+        assert len(matches) == 1
+        assert matches[0]['offset'] == 4
+        assert matches[0]['before'] == ['foo']
+
+        assert index_source(self.source) == 1
+
+        block = LogSearchBlock.query.filter(
+            LogSearchBlock.source_id == self.source.id,
+        ).one()
+        assert block.offset == 0
+        assert block.size == 14
+
+        matches, _ = search_logs([self.source], 'error')
+        assert [m['offset'] for m in matches] == [4]
+
+    def test_line_split_between_flushes(self):
+        self.write_log('foo\nerror', ': bad\n', 'done')
+
+        # the partial line is carried over to the next block
+        assert self.get_blocks() == [(0, 4), (4, 11), (15, 4)]
+
+        matches, _ = search_logs([self.source], 'error: bad')
+        assert len(matches) == 1
+        assert matches[0]['offset'] == 4
+        assert matches[0]['text'] == 'error: bad'
+
+        # continuing the log replaces the block of its last line
+        assert get_index_prefix(self.source, 19) == 'done'
+        self.write_log(' now\n', offset=19, index_prefix='done')
+        assert self.get_blocks() == [(0, 4), (4, 11), (15, 9)]
+
+        matches, _ = search_logs([self.source], 'done now')
+        assert [m['offset'] for m in matches] == [15]
+
+    def test_index_source_aligns_blocks(self):
+        db.session.add(LogChunk(
+            job=self.job, project=self.project, source=self.source,
+            offset=0, size=7, text='foo\nerr',
+        ))
+        db.session.add(LogChunk(
+            job=self.job, project=self.project, source=self.source,
+            offset=7, size=15, text='or: bad\nbar\nbaz',
+        ))
+        db.session.flush()
+
+        matches, _ = search_logs([self.source], 'ba[rz]', regex=True, context=1)
+        assert [m['offset'] for m in matches] == [15, 19]
+        assert matches[0]['before'] == ['error: bad']
+        assert matches[0]['after'] == ['baz']
+        assert matches[1]['after'] == []
+
+        assert index_source(self.source, block_size=8) == 2
+        assert self.get_blocks() == [(0, 15), (15, 7)]
+
+        matches, _ = search_logs([self.source], 'error')
+        assert [m['offset'] for m in matches] == [4]
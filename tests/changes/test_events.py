@@ -6,37 +6,69 @@ from changes.events import publish_build_update, publish_job_update
 
 
 class PublishBuildUpdateTest(TestCase):
-    @mock.patch('changes.events.pubsub.publish')
-    def test_simple(self, publish):
+    @mock.patch('changes.events.pubsub.publish_many')
+    def test_simple(self, publish_many):
         build = self.create_build(self.project)
         json = as_json(build)
 
-        publish_build_update(build)
+        assert publish_build_update(build)
 
-        publish.assert_any_call('builds:{0}'.format(build.id.hex), {
+        publish_many.assert_called_once_with([
+            'builds:{0}'.format(build.id.hex),
+            'projects:{0}:builds'.format(build.project_id.hex),
+            'revisions:{0}:builds'.format(build.source.revision_sha),
+        ], {
+            'id': build.id.hex,
             'data': json,
             'event': 'build.update',
         })
-        publish.assert_any_call('projects:{0}:builds'.format(build.project_id.hex), {
-            'data': json,
+
+    @mock.patch('changes.events.queue.delay')
+    @mock.patch('changes.events.pubsub.publish_many')
+    def test_unchanged(self, publish_many, queue_delay):
+        build = self.create_build(self.project)
+
+        assert publish_build_update(build)
+        assert not publish_build_update(build, force=True)
+        assert publish_many.call_count == 1
+        assert not queue_delay.called
+
+    @mock.patch('changes.events.queue.delay')
+    @mock.patch('changes.events.pubsub.publish_many')
+    def test_debounced(self, publish_many, queue_delay):
+        build = self.create_build(self.project)
+
+        assert publish_build_update(build)
+
+        build.label = 'foo'
+        assert not publish_build_update(build)
+        build.label = 'bar'
+        assert not publish_build_update(build)
+        assert publish_many.call_count == 1
+
+        queue_delay.assert_called_once_with('publish_object_update', kwargs={
             'event': 'build.update',
-        })
+            'object_id': build.id.hex,
+        }, countdown=1)
+
+        assert publish_build_update(build, force=True)
+        assert publish_many.call_count == 2
 
 
 class PublishJobUpdateTest(TestCase):
-    @mock.patch('changes.events.pubsub.publish')
-    def test_simple(self, publish):
+    @mock.patch('changes.events.pubsub.publish_many')
+    def test_simple(self, publish_many):
         build = self.create_build(self.project)
         job = self.create_job(build=build)
         json = as_json(job)
 
-        publish_job_update(job)
+        assert publish_job_update(job)
 
-        publish.assert_any_call('jobs:{0}'.format(job.id.hex), {
-            'data': json,
-            'event': 'job.update',
-        })
-        publish.assert_any_call('builds:{0}:jobs'.format(job.build_id.hex), {
+        publish_many.assert_called_once_with([
+            'jobs:{0}'.format(job.id.hex),
+            'builds:{0}:jobs'.format(job.build_id.hex),
+        ], {
+            'id': job.id.hex,
             'data': json,
             'event': 'job.update',
         })
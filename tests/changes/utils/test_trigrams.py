@@ -0,0 +1,20 @@
+from __future__ import absolute_import
+
+from changes.utils.trigrams import (
+    get_pattern_trigrams, get_trigrams, hash_trigram)
+
+
+def test_get_trigrams():
+    assert get_trigrams('ab') == []
+    assert get_trigrams('Foo\nfoo') == [hash_trigram('foo')]
+    assert get_trigrams(u'abcd') == sorted([hash_trigram('abc'), hash_trigram('bcd')])
+
+
+def test_get_pattern_trigrams():
+    assert get_pattern_trigrams('Error') == get_trigrams('error')
+    assert get_pattern_trigrams('a.c') == [hash_trigram('a.c')]
+
+    assert get_pattern_trigrams('error: .*', regex=True) == get_trigrams('error: ')
+    assert get_pattern_trigrams('abc.def', regex=True) == get_trigrams('abc\ndef')
+    assert get_pattern_trigrams('abc|def', regex=True) == []
+    assert get_pattern_trigrams('(abc', regex=True) == []